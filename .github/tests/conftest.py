@@ -0,0 +1,63 @@
+"""
+Shared pytest fixtures.
+
+The assignment scripts have numeric prefixes (e.g. ``1_patient_data_cleaner.py``)
+so they cannot be imported with a plain ``import`` statement. These fixtures
+load them by path so tests can call their functions directly.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+# Make helper modules that live next to the scripts importable
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+def load_script(filename):
+    """Import one of the project scripts by file name and return the module."""
+    module_name = Path(filename).stem
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, PROJECT_ROOT / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def cleaner():
+    """The patient data cleaner module."""
+    return load_script("1_patient_data_cleaner.py")
+
+@pytest.fixture
+def dosage():
+    """The medication dosage calculator module."""
+    return load_script("2_med_dosage_calculator.py")
+
+@pytest.fixture
+def cohort():
+    """The cohort analysis module."""
+    return load_script("3_cohort_analysis.py")
+
+@pytest.fixture
+def patients_csv(tmp_path):
+    """A small synthetic patients CSV in the generate_large_health_data.py layout."""
+    import random
+
+    rng = random.Random(7)
+    path = tmp_path / "patients.csv"
+    lines = ["Pregnancies,Glucose,BloodPressure,SkinThickness,Insulin,BMI,"
+             "DiabetesPedigreeFunction,Age,Outcome,diagnosis"]
+    for _ in range(5000):
+        lines.append(",".join(str(v) for v in [
+            rng.randint(0, 10), rng.randint(50, 200), rng.randint(40, 120), rng.randint(0, 50),
+            rng.randint(0, 300), round(rng.uniform(0, 70), 1), round(rng.uniform(0, 2), 3),
+            rng.randint(21, 90), rng.randint(0, 1),
+            rng.choice(["Diabetes", "Pre-diabetes", "No Diabetes"])]))
+    path.write_text("\n".join(lines) + "\n")
+    return path
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for allergy contraindication screening
+
+This script tests that:
+1. Allergies naming a medication, an alias or an allergy class are flagged
+2. Unrelated allergies and unknown medications are not flagged
+3. Batch screening agrees with per-order screening and both dosage engines
+"""
+
+import pytest
+
+from formulary import load_formulary
+
+@pytest.fixture
+def index():
+    return load_formulary().allergy_index
+
+@pytest.mark.parametrize("medication, allergies, expected", [
+    ("ibuprofen", ["aspirin"], ["aspirin"]),
+    ("Advil", ["NSAIDs ", "penicillin"], ["NSAIDs "]),
+    ("fentanyl", ["Sublimaze"], ["Sublimaze"]),
+    ("amiodarone", ["iodine", "latex"], ["iodine"]),
+    ("lorazepam", ["aspirin"], []),
+    ("epinephrine", [], []),
+    ("unknownium", ["aspirin"], []),
+])
+def test_conflicts(index, medication, allergies, expected):
+    assert index.conflicts(medication, allergies) == expected
+
+def test_index_is_shared_and_interned(index):
+    formulary = index.formulary
+    assert formulary.allergy_index is index
+    assert index.intern("  Aspirin") is index.intern("aspirin")
+    assert formulary["ibuprofen"].code in index.medications_for("ASPIRIN")
+
+def test_misspelled_allergies_are_not_cached(index):
+    for i in range(100):
+        assert index.medications_for(f"free text {i}") == frozenset()
+    assert index.medications_for(" Aspirin ") == index.medications_for("aspirin")
+    assert not any("free text 0" in value for value in vars(index).values()
+                   if isinstance(value, dict))
+
+def test_single_allergy_string(index):
+    assert index.conflicts("ibuprofen", "aspirin") == ["aspirin"]
+    assert index.conflicts("lorazepam", "aspirin") == []
+
+def test_batch_screen(index):
+    orders = [
+        {"medication": "ibuprofen", "allergies": ["aspirin"]},
+        {"medication": "lorazepam", "allergies": ["aspirin"]},
+        {"medication": "sumatriptan", "allergies": ["sulfonamides"]},
+        {"medication": "albuterol"},
+    ]
+    expected = [index.conflicts(o["medication"], o.get("allergies", [])) for o in orders]
+    assert index.screen(orders) == expected == [["aspirin"], [], ["sulfonamides"], []]
+
+def test_dosage_engines_flag_contraindications(dosage):
+    orders = [
+        {"name": "A", "weight": 70, "medication": "ibuprofen", "allergies": ["aspirin"]},
+        {"name": "B", "weight": 70, "medication": "epinephrine", "allergies": ["penicillin"]},
+    ]
+    results, _ = dosage.calculate_all_dosages(orders)
+    assert [r["contraindications"] for r in results] == [["aspirin"], []]
+    assert dosage.calculate_all_dosages(orders, engine="numpy")[0] == results
+    assert dosage.screen_contraindications(orders) == [["aspirin"], []]
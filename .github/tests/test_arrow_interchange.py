@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tests for the Arrow IPC interchange (patient_arrow.py)
+
+This script tests that:
+1. Records round-trip through Arrow files, typed where possible
+2. Reads are memory-mapped and allocate no column buffers
+3. Files carry a schema version and newer versions are rejected
+4. Record batches can be appended to an existing file
+5. clean -> dose -> cohort stages hand off through Arrow files
+6. The scripts load without pyarrow installed
+"""
+
+import json
+import subprocess
+import sys
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.ipc
+import pytest
+
+import patient_arrow
+from conftest import PROJECT_ROOT
+from pipeline import cli
+
+PATIENTS = [
+    {"name": "John Smith", "age": 32, "gender": "male", "diagnosis": "flu",
+     "weight": 80.0, "medication": "epinephrine", "is_first_dose": False,
+     "allergies": ["sulfa"]},
+    {"name": "Ana López", "age": 45, "gender": "female", "diagnosis": "asthma",
+     "weight": 72.5, "medication": "amiodarone", "is_first_dose": True, "allergies": [],
+     "notes": {"ward": 3}},
+    {"name": "Li Wei", "age": 60, "diagnosis": "flu", "weight": 55.0,
+     "medication": "lorazepam"},
+]
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "patients.arrow"
+    assert patient_arrow.write_arrow_patients(PATIENTS, str(path), batch_size=2) == 3
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == PATIENTS
+
+    schema = patient_arrow.read_arrow_table(str(path)).schema
+    assert schema.field("age").type == pa.int64()
+    assert schema.field("diagnosis").type == pa.string()
+    assert schema.field("allergies").type == pa.list_(pa.string())
+    assert schema.field("notes").metadata == {b"pipeline.encoding": b"json"}
+    assert schema.metadata[b"pipeline.schema_version"] == b"1"
+
+def test_mixed_types_fall_back_to_json(tmp_path):
+    raw = [{"name": "a", "age": "32", "is_first_dose": 1}, {"name": "b", "age": 45}]
+    path = tmp_path / "raw.arrow"
+    patient_arrow.write_arrow_patients(raw, str(path))
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == raw
+
+def test_later_batches_widen_the_schema(tmp_path):
+    patients = [{"name": "a", "age": 30, "weight": 80.0},
+                {"name": "b", "age": 41, "weight": "154 lbs"},
+                {"name": "c", "age": "forty", "room": 4},
+                {"name": "d", "age": 52, "weight": 60.5}]
+    path = tmp_path / "widened.arrow"
+    assert patient_arrow.write_arrow_patients(patients, str(path), batch_size=1) == 4
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == patients
+    schema = patient_arrow.read_arrow_table(str(path)).schema
+    for name in ("age", "weight", "room"):
+        assert schema.field(name).metadata == {b"pipeline.encoding": b"json"}
+    assert schema.field("name").type == pa.string()
+    assert [p.name for p in tmp_path.iterdir()] == ["widened.arrow"]
+
+def test_read_is_zero_copy(tmp_path):
+    path = tmp_path / "big.arrow"
+    patients = [{"name": f"p{i}", "age": i % 90, "weight": float(i)} for i in range(100_000)]
+    patient_arrow.write_arrow_patients(patients, str(path))
+
+    before = pa.total_allocated_bytes()
+    table = patient_arrow.read_arrow_table(str(path))
+    assert pa.total_allocated_bytes() - before < 1024
+    assert table.num_rows == 100_000
+    assert table.column("weight")[99_999].as_py() == 99_999.0
+
+def test_newer_schema_version_is_rejected(tmp_path):
+    path = tmp_path / "future.arrow"
+    schema = pa.schema([("name", pa.string())],
+                       metadata={b"pipeline.schema_version": b"99"})
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(pa.table({"name": ["a"]}, schema=schema))
+    with pytest.raises(ValueError, match="version 99"):
+        list(patient_arrow.iter_arrow_patients(str(path)))
+
+def test_append(tmp_path):
+    path = tmp_path / "patients.arrow"
+    assert patient_arrow.append_arrow_patients(PATIENTS[:2], str(path)) == 2
+    written = path.read_bytes()
+    assert patient_arrow.append_arrow_patients(PATIENTS[2:], str(path)) == 1
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == PATIENTS
+    assert len(list(patient_arrow.iter_arrow_batches(str(path)))) == 2
+    # Appended in place: the existing batches were not rewritten
+    assert path.read_bytes().startswith(written[:-len(patient_arrow.END_OF_STREAM)])
+
+    # Records needing a wider schema rewrite the file
+    more = [{"name": "x", "age": 20}, {"name": "y", "room": 4}]
+    assert patient_arrow.append_arrow_patients(more, str(path), batch_size=1) == 2
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == PATIENTS + more
+
+def test_append_to_file_format(tmp_path):
+    path = tmp_path / "polars.arrow"
+    pl.DataFrame({"name": ["a"], "age": [30]}).write_ipc(path)
+    assert patient_arrow.append_arrow_patients([{"name": "b", "age": 40}], str(path)) == 1
+    assert list(patient_arrow.iter_arrow_patients(str(path))) == [
+        {"name": "a", "age": 30}, {"name": "b", "age": 40}]
+
+def test_scripts_read_and_write_arrow(tmp_path, cleaner, dosage):
+    raw = [{"name": "john smith", "age": "32", "weight": 80, "medication": "epinephrine"},
+           {"name": "amy lee", "age": "12", "weight": 40, "medication": "epinephrine"}]
+    cleaned_path = str(tmp_path / "cleaned.arrow")
+    cleaner.write_patient_stream(cleaner.clean_patient_data(raw), cleaned_path)
+
+    cleaned = cleaner.load_patient_data(cleaned_path)
+    assert cleaned == cleaner.clean_patient_data(raw)
+    assert list(cleaner.iter_patient_records(cleaned_path)) == cleaned
+    assert dosage.load_patient_data(cleaned_path) == cleaned
+
+def test_pipeline_stages_hand_off_through_arrow(tmp_path, cleaner, dosage, cohort):
+    orders = tmp_path / "orders.json"
+    raw = [{"name": "john smith", "age": "32", "weight": 80.0, "medication": "epinephrine",
+            "is_first_dose": False, "allergies": ["sulfa"]},
+           {"name": "ana lopez", "age": "45", "weight": 60.0, "medication": "amiodarone",
+            "is_first_dose": True, "allergies": []}]
+    orders.write_text(json.dumps(raw))
+    cleaned, doses = tmp_path / "cleaned.arrow", tmp_path / "doses.arrow"
+    assert cli.main(["clean", str(orders), "-o", str(cleaned)]) == 0
+    assert cli.main(["dose", str(cleaned), "-o", str(doses)]) == 0
+    expected, _ = dosage.calculate_all_dosages(cleaner.clean_patient_data(raw))
+    assert list(patient_arrow.iter_arrow_patients(str(doses))) == expected
+    assert cli.main(["dose", str(cleaned), "--format", "arrow"]) == 1
+
+    patients = tmp_path / "patients.arrow"
+    assert cli.main(["generate", "--rows", "2000", "--workers", "1", "-o", str(patients)]) == 0
+    csv_path = tmp_path / "patients.csv"
+    pl.read_ipc(patients).write_csv(csv_path)
+    cache_dir = str(tmp_path / "cache")
+    from_arrow = cohort.analyze_patient_cohorts(str(patients), cache_dir)
+    assert not list((tmp_path / "cache").glob("*.parquet"))
+    assert from_arrow.equals(cohort.analyze_patient_cohorts(str(csv_path), cache_dir))
+    chunked, _ = cohort.analyze_patient_cohorts_chunked(str(patients), cache_dir=cache_dir,
+                                                        chunk_rows=500)
+    assert chunked["patient_count"].to_list() == from_arrow["patient_count"].to_list()
+
+    stream = tmp_path / "patients_stream.arrow"
+    table = pl.read_ipc(patients).to_arrow()
+    with pa.OSFile(str(stream), "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    assert cohort.analyze_patient_cohorts(str(stream), cache_dir,
+                                          use_result_cache=False).equals(from_arrow)
+
+    output = tmp_path / "cohorts.arrow"
+    cohort.write_results(from_arrow, str(output))
+    assert pl.read_ipc(output).equals(from_arrow)
+
+def test_scripts_import_without_pyarrow():
+    code = (
+        "import importlib.abc, sys\n"
+        "class Block(importlib.abc.MetaPathFinder):\n"
+        "    def find_spec(self, name, path=None, target=None):\n"
+        "        if name.partition('.')[0] == 'pyarrow':\n"
+        "            raise ModuleNotFoundError(name)\n"
+        "sys.meta_path.insert(0, Block())\n"
+        "from conftest import load_script\n"
+        "for script in ('1_patient_data_cleaner.py', '2_med_dosage_calculator.py',\n"
+        "               '3_cohort_analysis.py'):\n"
+        "    load_script(script)\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT / ".github" / "tests",
+                   check=True, capture_output=True)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the benchmark harness (benchmark.py)
+
+This script tests that:
+1. Benchmark runs produce timing, throughput, RSS and allocation metrics
+2. Generated inputs are reused between runs
+3. The comparison flags metrics that exceed the thresholds
+4. dose/dict-cache reuses one DosageCache across timed runs
+"""
+
+import importlib
+import json
+import os
+
+import pytest
+
+import benchmark
+
+def result(case, records, seconds, rss, alloc=None):
+    row = {'case': case, 'records': records, 'median_seconds': seconds, 'peak_rss_bytes': rss}
+    if alloc is not None:
+        row['alloc_peak_bytes'] = alloc
+    return row
+
+def test_run_benchmarks(tmp_path):
+    lines = []
+    data_dir = str(tmp_path / "data")
+    results = benchmark.run_benchmarks(['clean/dict', 'dose/numpy', 'cohort/warm'], [500],
+                                       repeat=2, data_dir=data_dir, log=lines.append)
+    assert [r['case'] for r in results['results']] == ['clean/dict', 'dose/numpy', 'cohort/warm']
+    for r in results['results']:
+        assert r['records'] == 500
+        assert 0 < r['best_seconds'] <= r['median_seconds']
+        assert r['throughput_rps'] == pytest.approx(500 / r['median_seconds'])
+        assert r['peak_rss_bytes'] >= r['input_rss_bytes'] > 0
+        assert r['alloc_peak_bytes'] >= 0
+    assert len(lines) == 3
+    assert results['meta']['polars']
+    json.dumps(results)
+
+    inputs = sorted(os.listdir(data_dir))
+    assert len(inputs) == 3
+    mtimes = [os.path.getmtime(os.path.join(data_dir, f)) for f in inputs]
+    benchmark.run_benchmarks(['clean/dict'], [500], repeat=1, data_dir=data_dir, trace=False)
+    assert [os.path.getmtime(os.path.join(data_dir, f)) for f in inputs] == mtimes
+
+def test_compare_results():
+    baseline = {'results': [result('dose/numpy', 1000, 1.0, 100, 50),
+                            result('dose/dict', 1000, 1.0, 100)]}
+    current = {'results': [result('dose/numpy', 1000, 1.05, 130, 50),
+                           result('dose/dict', 1000, 1.5, 100),
+                           result('dose/dict', 10_000, 9.0, 100)]}
+    rows = benchmark.compare_results(baseline, current, time_threshold=0.1, memory_threshold=0.2)
+    assert rows[0]['regressions'] == ['peak_rss_bytes']
+    assert rows[0]['median_seconds'] == pytest.approx(1.05)
+    assert rows[1]['regressions'] == ['median_seconds']
+    assert rows[2]['regressions'] == [] and rows[2]['median_seconds'] is None
+
+    assert benchmark.compare_results(baseline, current, time_threshold=1.0,
+                                     memory_threshold=1.0)[1]['regressions'] == []
+
+def test_compare_command_exit_status(tmp_path, capsys):
+    base, slow = tmp_path / "base.json", tmp_path / "slow.json"
+    base.write_text(json.dumps({'results': [result('cohort/warm', 10, 1.0, 100)]}))
+    slow.write_text(json.dumps({'results': [result('cohort/warm', 10, 2.0, 100)]}))
+    assert benchmark.main(['compare', str(base), str(base)]) == 0
+    assert benchmark.main(['compare', str(base), str(slow)]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
+
+def test_parse_count():
+    assert benchmark.parse_count("1e8") == 100_000_000
+    assert benchmark.parse_count("100_000") == 100_000
+    with pytest.raises(ValueError):
+        benchmark.parse_count("0.5")
+
+def test_dose_cache_is_created_once(tmp_path, monkeypatch):
+    dosage = importlib.import_module("2_med_dosage_calculator")
+    caches = []
+
+    class RecordedCache(dosage.DosageCache):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            caches.append(self)
+
+    monkeypatch.setattr(dosage, "DosageCache", RecordedCache)
+    path = benchmark.prepare_input('dose', 50, str(tmp_path))
+    call = benchmark._make_call('dose/dict-cache', path, str(tmp_path))
+    call()
+    call()
+    assert len(caches) == 1 and caches[0].hits >= 50
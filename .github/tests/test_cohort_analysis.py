@@ -46,7 +46,7 @@ def test_script_runs():
         subprocess.run(["python", str(generate_script)], check=True, cwd=str(project_root))
     else:
         # Verify hash of existing file
-        expected_hash = "6f0a4bfef15ad875bd90a160f7cfdacff2def36c36a4af8ee06eade4d9611478"
+        expected_hash = "54aa1d9c38450bf9a7de449f8bc0ad5c1e789367e4e6530336f18ad3861e3d58"
         current_hash = calculate_file_hash(data_file)
         if current_hash != expected_hash:
             # Regenerate if hash doesn't match
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the approximate (sketch-based) mode in cohort_analysis.py
+
+This script tests that:
+1. Counts and means match the exact analysis
+2. Quantile intervals contain the exact quantiles; small strata are exact
+3. Distinct counts are within HyperLogLog error
+4. Sketches are saved once and merge like a sketch of the union
+5. Sketches from different Polars versions are not merged or reused
+"""
+
+import json
+import os
+
+import polars as pl
+import pytest
+
+def exact_quantile(csv_path, label, column, q):
+    bounds = {"Underweight": (10, 18.5), "Normal": (18.5, 25),
+              "Overweight": (25, 30), "Obese": (30, 60.01)}
+    low, high = bounds[label]
+    df = pl.read_csv(csv_path).filter((pl.col("BMI") >= low) & (pl.col("BMI") < high))
+    return df[column].quantile(q)
+
+def test_counts_and_means_match_exact(cohort, patients_csv, tmp_path):
+    approx = cohort.approximate_cohorts(str(patients_csv), sample_size=200,
+                                        cache_dir=str(tmp_path))
+    exact = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path))
+    assert approx.select(exact.columns).schema == exact.schema
+    assert approx["patient_count"].to_list() == exact["patient_count"].to_list()
+    for column in ["avg_glucose", "avg_age"]:
+        assert all(abs(a - b) < 1e-9 for a, b in zip(approx[column], exact[column]))
+
+def test_quantile_bounds(cohort, patients_csv, tmp_path):
+    approx = cohort.approximate_cohorts(str(patients_csv), quantiles=[0.1, 0.5, 0.9],
+                                        sample_size=200, cache_dir=str(tmp_path))
+    for row in approx.to_dicts():
+        for column in ["Glucose", "Age"]:
+            for q in [0.1, 0.5, 0.9]:
+                name = f"{column.lower()}_p{q * 100:g}"
+                truth = exact_quantile(patients_csv, row["bmi_range"], column, q)
+                assert row[f"{name}_low"] <= truth <= row[f"{name}_high"]
+                assert row[f"{name}_low"] < row[f"{name}_high"]
+
+    # Every stratum fits in a large sample, so the answers are exact
+    full = cohort.approximate_cohorts(str(patients_csv), sample_size=10_000,
+                                      cache_dir=str(tmp_path))
+    for row in full.to_dicts():
+        truth = exact_quantile(patients_csv, row["bmi_range"], "Glucose", 0.5)
+        assert row["glucose_p50"] == row["glucose_p50_low"] == row["glucose_p50_high"] == truth
+
+def test_distinct_patients(cohort, patients_csv, tmp_path):
+    # Duplicate every row: distinct counts should not change
+    doubled = tmp_path / "doubled.csv"
+    df = pl.read_csv(patients_csv)
+    pl.concat([df, df]).write_csv(doubled)
+    approx = cohort.approximate_cohorts(str(doubled), cache_dir=str(tmp_path))
+    for row in approx.to_dicts():
+        unique = row["patient_count"] / 2
+        assert abs(row["distinct_patients"] - unique) <= 0.05 * unique
+
+def test_sketch_saved_and_mergeable(cohort, patients_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    whole = cohort.CohortSketch.build(str(patients_csv), 100, cache_dir)
+    assert any(f.endswith(".sketch-100.json") for f in os.listdir(cache_dir))
+
+    df = pl.read_csv(patients_csv, schema_overrides=cohort.PATIENT_SCHEMA)
+    left = cohort.CohortSketch.from_frame(df.head(2000).lazy(), 100)
+    right = cohort.CohortSketch.from_frame(df.tail(df.height - 2000).lazy(), 100)
+    merged = left.merge(right)
+    assert merged.sample.equals(whole.sample)
+    assert merged.registers == whole.registers
+    assert merged.stats == whole.stats
+
+    def fail(*args, **kwargs):
+        raise AssertionError("data was rescanned")
+    monkeypatch.setattr(cohort.pl, "scan_parquet", fail)
+    assert cohort.CohortSketch.build(str(patients_csv), 100, cache_dir).sample.equals(whole.sample)
+
+def test_sketches_from_other_polars_versions(cohort, patients_csv, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    sketch = cohort.CohortSketch.build(str(patients_csv), 100, cache_dir)
+    assert sketch.polars_version == pl.__version__
+    older = cohort.CohortSketch(sketch.sample, sketch.stats, sketch.registers, 100, "0.20.0")
+    with pytest.raises(ValueError, match="Polars"):
+        sketch.merge(older)
+
+    # A saved sketch from another version (or none recorded) is rebuilt
+    (saved,) = [f for f in os.listdir(cache_dir) if f.endswith(".sketch-100.json")]
+    path = os.path.join(cache_dir, saved)
+    with open(path) as f:
+        state = json.load(f)
+    del state["polars_version"]
+    with open(path, "w") as f:
+        json.dump(state, f)
+    assert cohort.CohortSketch.load(path[:-len(".json")]).polars_version == "unknown"
+    assert cohort.CohortSketch.build(str(patients_csv), 100, cache_dir).merge(sketch)
+    with open(path) as f:
+        assert json.load(f)["polars_version"] == pl.__version__
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the out-of-core chunked mode in cohort_analysis.py
+
+This script tests that:
+1. Chunked results match the in-memory analysis for any chunk size
+2. The chunk size shrinks when memory exceeds the budget
+3. Memory budgets are parsed and peak RSS is reported
+4. Options the whole-input modes would ignore are rejected
+"""
+
+import pytest
+
+def assert_same(left, right):
+    assert left.schema == right.schema
+    assert left["patient_count"].to_list() == right["patient_count"].to_list()
+    for column in ["avg_glucose", "avg_age"]:
+        assert all(abs(a - b) < 1e-9 for a, b in zip(left[column], right[column]))
+
+@pytest.mark.parametrize("chunk_rows", [333, 700, 100_000])
+def test_chunked_matches_analysis(cohort, patients_csv, tmp_path, chunk_rows):
+    expected = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path))
+    result, stats = cohort.analyze_patient_cohorts_chunked(
+        str(patients_csv), "64MB", cache_dir=str(tmp_path), chunk_rows=chunk_rows)
+    assert_same(result, expected)
+    assert stats["rows"] == 5000
+    assert stats["chunks"] == -(-5000 // chunk_rows)
+    assert stats["peak_rss_bytes"] >= stats["baseline_rss_bytes"] > 0
+
+def test_chunk_size_adapts_to_budget(cohort, patients_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(cohort, "MIN_CHUNK_ROWS", 100)
+    readings = iter(range(0, 10**12, 10**9))
+    monkeypatch.setattr(cohort, "current_rss", lambda: next(readings))
+    result, stats = cohort.analyze_patient_cohorts_chunked(
+        str(patients_csv), "1MB", cache_dir=str(tmp_path), chunk_rows=1600)
+    assert stats["chunk_rows"] == 100
+    assert stats["rows"] == 5000
+    assert_same(result, cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path)))
+
+def test_parse_size(cohort):
+    assert cohort.parse_size("512MB") == 512 << 20
+    assert cohort.parse_size("1.5GiB") == 3 << 29
+    assert cohort.parse_size("2g") == 2 << 30
+    assert cohort.parse_size(4096) == 4096
+    for bad in ["lots", "0MB", "-1GB", "5PB"]:
+        with pytest.raises(ValueError):
+            cohort.parse_size(bad)
+
+def test_cli_reports_peak_rss(cohort, patients_csv, tmp_path, capsys):
+    cohort.main([str(patients_csv), "--memory-budget", "256MB", "--cache-dir", str(tmp_path)])
+    assert "peak RSS" in capsys.readouterr().out
+
+@pytest.mark.parametrize("mode", [["--memory-budget", "256MB"], ["--approx"], ["--store", "s"]])
+@pytest.mark.parametrize("option", [["--diagnosis", "Flu"], ["--age-min", "40"],
+                                    ["--age-max", "60"], ["--partitioned"],
+                                    ["--group-by", "diagnosis"]])
+def test_ignored_options_are_rejected(cohort, capsys, mode, option):
+    with pytest.raises(SystemExit):
+        cohort.parse_args(["patients.csv", *mode, *option])
+    assert "cannot be combined" in capsys.readouterr().err
+
+@pytest.mark.parametrize("argv, needed", [
+    (["--retract", "b1"], "--store"),
+    (["--quantile", "0.5"], "--approx"),
+    (["--sample-size", "100"], "--approx"),
+    (["--store", "s", "--quantile", "0.5"], "--approx"),
+])
+def test_dependent_options_are_rejected(cohort, capsys, argv, needed):
+    with pytest.raises(SystemExit):
+        cohort.parse_args(["patients.csv", *argv])
+    assert f"requires {needed}" in capsys.readouterr().err
+
+def test_group_by_rejects_partitioned(cohort):
+    with pytest.raises(SystemExit):
+        cohort.parse_args(["patients.csv", "--group-by", "diagnosis", "--partitioned"])
+    assert cohort.parse_args(["patients.csv", "--group-by", "diagnosis", "--diagnosis", "Flu"])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the cohort cube in cohort_analysis.py
+
+This script tests that:
+1. The BMI-range rollup matches analyze_patient_cohorts
+2. Other rollups, filters and aggregations match direct Polars queries
+3. Cubes are saved once and rollups never rescan the data
+"""
+
+import os
+
+import polars as pl
+import pytest
+
+def source(csv_path):
+    return pl.read_csv(csv_path).filter(pl.col("BMI").is_between(10, 60))
+
+def assert_frames_close(left, right, keys):
+    left, right = left.sort(keys), right.sort(keys)
+    assert left.columns == right.columns
+    for column in left.columns:
+        if left[column].dtype.is_float():
+            assert all(abs(a - b) < 1e-6 for a, b in zip(left[column], right[column]))
+        else:
+            assert left[column].cast(pl.String).to_list() == right[column].cast(pl.String).to_list()
+
+def test_default_rollup_matches_analysis(cohort, patients_csv, tmp_path):
+    cube = cohort.CohortCube.build(str(patients_csv), cache_dir=str(tmp_path))
+    expected = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path))
+    result = cube.rollup(["bmi_range"])
+    assert result.schema == expected.schema
+    assert_frames_close(result, expected, ["bmi_range"])
+
+def test_rollups_match_direct_queries(cohort, patients_csv, tmp_path):
+    cube = cohort.CohortCube.build(str(patients_csv), cache_dir=str(tmp_path))
+    measures = {
+        "n": ("count", None),
+        "glucose_total": ("sum", "Glucose"),
+        "age_min": ("min", "Age"),
+        "age_max": ("max", "Age"),
+        "glucose_var": ("var", "Glucose"),
+        "age_sd": ("std", "Age"),
+    }
+    result = cube.rollup(["diagnosis", "Outcome"], measures, filters={"age_band": [40, 50]})
+    expected = source(patients_csv).filter(pl.col("Age").is_between(40, 59)).group_by(
+        "diagnosis", "Outcome").agg(
+        pl.len().alias("n"), pl.col("Glucose").sum().alias("glucose_total"),
+        pl.col("Age").min().alias("age_min"), pl.col("Age").max().alias("age_max"),
+        pl.col("Glucose").var().alias("glucose_var"), pl.col("Age").std().alias("age_sd"))
+    assert_frames_close(result, expected, ["diagnosis", "Outcome"])
+
+    total = cube.rollup([], {"n": ("count", None)})
+    assert total["n"].item() == source(patients_csv).height
+
+def test_cube_is_cached(cohort, patients_csv, tmp_path, monkeypatch):
+    cube = cohort.CohortCube.build(str(patients_csv), cache_dir=str(tmp_path))
+    assert len([f for f in os.listdir(tmp_path) if ".cube-" in f]) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("data was rescanned")
+    monkeypatch.setattr(cohort.pl, "scan_parquet", fail)
+    monkeypatch.setattr(cohort.pl, "scan_csv", fail)
+    reloaded = cohort.CohortCube.build(str(patients_csv), cache_dir=str(tmp_path))
+    assert reloaded.table.height == cube.table.height
+    for dims in (["age_band"], ["diagnosis"], ["bmi_range", "Outcome"]):
+        reloaded.rollup(dims)
+    assert reloaded.rollup(["age_band"]) is reloaded.rollup(["age_band"])
+
+def test_custom_dimensions(cohort, patients_csv, tmp_path):
+    dims = {"glucose_band": {"column": "Glucose", "breaks": [100, 126], "labels": ["low", "mid", "high"]}}
+    cube = cohort.CohortCube.build(str(patients_csv), dims, ["BMI"], cache_dir=str(tmp_path))
+    result = cube.rollup(["glucose_band"], {"bmi": ("mean", "BMI")})
+    assert result["glucose_band"].cast(pl.String).to_list() == ["low", "mid", "high"]
+
+    with pytest.raises(ValueError):
+        cube.rollup(["diagnosis"])
+    with pytest.raises(ValueError):
+        cube.rollup(["glucose_band"], {"x": ("median", "BMI")})
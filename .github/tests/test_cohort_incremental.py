@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental cohort aggregate store in cohort_analysis.py
+
+This script tests that:
+1. Merging appended batches reproduces a full recompute
+2. Already-merged batches are skipped and the store persists across opens
+3. Retracting a batch undoes it exactly
+"""
+
+import math
+
+import polars as pl
+import pytest
+
+def split_batches(csv_path, tmp_path, parts=3):
+    df = pl.read_csv(csv_path)
+    size = math.ceil(df.height / parts)
+    paths = []
+    for i in range(parts):
+        path = tmp_path / f"batch_{i}.csv"
+        df.slice(i * size, size).write_csv(path)
+        paths.append(str(path))
+    return paths
+
+def assert_same(left, right):
+    assert left["bmi_range"].to_list() == right["bmi_range"].to_list()
+    assert left["patient_count"].to_list() == right["patient_count"].to_list()
+    for column in ["avg_glucose", "avg_age"]:
+        for a, b in zip(left[column], right[column]):
+            assert abs(a - b) < 1e-9
+
+def test_incremental_matches_full(cohort, patients_csv, tmp_path):
+    batches = split_batches(patients_csv, tmp_path)
+    store = cohort.CohortAggregateStore(str(tmp_path / "store.json"))
+    assert len(store.update(batches[:2])) == 2
+    assert len(store.update(batches)) == 1
+
+    full = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path / "cache"))
+    result = store.results()
+    assert result.schema == full.schema
+    assert_same(result, full)
+
+def test_store_persists_and_skips_merged(cohort, patients_csv, tmp_path):
+    batches = split_batches(patients_csv, tmp_path)
+    path = str(tmp_path / "store.json")
+    cohort.CohortAggregateStore(path).update(batches)
+
+    reopened = cohort.CohortAggregateStore(path)
+    assert reopened.update(batches) == []
+    assert reopened.results()["patient_count"].sum() == pl.read_csv(patients_csv).filter(
+        pl.col("BMI").is_between(10, 60)).height
+
+def test_retract(cohort, patients_csv, tmp_path):
+    batches = split_batches(patients_csv, tmp_path)
+    store = cohort.CohortAggregateStore(str(tmp_path / "store.json"))
+    store.update(batches[:2])
+    before = store.results(spread=True)
+    bad = store.append(batches[2])
+    store.retract(bad)
+    assert store.results(spread=True).equals(before)
+
+    with pytest.raises(KeyError):
+        store.retract(bad)
+
+def test_spread_matches_polars(cohort, patients_csv, tmp_path):
+    store = cohort.CohortAggregateStore(str(tmp_path / "store.json"))
+    store.append(str(patients_csv))
+    df = pl.read_csv(patients_csv).filter(pl.col("BMI").is_between(18.5, 24.999))
+    normal = store.results(spread=True).filter(pl.col("bmi_range") == "Normal").row(0, named=True)
+    assert abs(normal["std_glucose"] - df["Glucose"].std(ddof=0)) < 1e-6
+    assert abs(normal["std_age"] - df["Age"].std(ddof=0)) < 1e-6
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the Parquet conversion cache in cohort_analysis.py
+
+This script tests that:
+1. Cohort results match an eager reference computation
+2. Repeated analyses reuse the cached Parquet file
+3. Changing the source file or conversion settings creates a new file
+"""
+
+import os
+
+import polars as pl
+
+def reference(csv_path):
+    """Eager reference implementation of the cohort statistics."""
+    df = pl.read_csv(csv_path).filter((pl.col("BMI") >= 10) & (pl.col("BMI") <= 60))
+    rows = {}
+    for label, low, high in [("Underweight", 10, 18.5), ("Normal", 18.5, 25),
+                             ("Overweight", 25, 30), ("Obese", 30, 61)]:
+        part = df.filter((pl.col("BMI") >= low) & (pl.col("BMI") < high))
+        rows[label] = (part["Glucose"].mean(), part.height, part["Age"].mean())
+    return rows
+
+def as_rows(result):
+    return {r["bmi_range"]: (r["avg_glucose"], r["patient_count"], r["avg_age"])
+            for r in result.to_dicts()}
+
+def test_results_match_reference(cohort, patients_csv, tmp_path):
+    result = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path / "cache"))
+    assert result.columns == ["bmi_range", "avg_glucose", "patient_count", "avg_age"]
+    assert result["bmi_range"].cast(pl.String).to_list() == cohort.BMI_LABELS
+    expected = reference(patients_csv)
+    for label, (glucose, count, age) in as_rows(result).items():
+        assert count == expected[label][1]
+        assert abs(glucose - expected[label][0]) < 1e-9
+        assert abs(age - expected[label][2]) < 1e-9
+
+def test_conversion_is_cached(cohort, patients_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    first = cohort.convert_to_parquet(str(patients_csv), cache_dir)
+
+    # A second conversion must not rescan the CSV or rehash the file
+    def fail(*args, **kwargs):
+        raise AssertionError("CSV was converted again")
+    monkeypatch.setattr(cohort.pl, "scan_csv", fail)
+    monkeypatch.setattr(cohort.hashlib, "sha256", fail)
+    assert cohort.convert_to_parquet(str(patients_csv), cache_dir) == first
+    cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=cache_dir)
+    assert not [f for f in os.listdir(cache_dir) if f.endswith(".tmp")]
+
+def test_cache_keys(cohort, patients_csv, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    original = cohort.convert_to_parquet(str(patients_csv), cache_dir)
+    assert cohort.convert_to_parquet(str(patients_csv), cache_dir, compression="lz4") != original
+    assert cohort.convert_to_parquet(str(patients_csv), cache_dir, row_group_size=1000) != original
+
+    with open(patients_csv, "a") as f:
+        f.write("1,100,70,20,0,22.0,0.5,40,0,Diabetes\n")
+    changed = cohort.convert_to_parquet(str(patients_csv), cache_dir)
+    assert changed != original
+    assert pl.read_parquet(changed).height == pl.read_parquet(original).height + 1
+
+def test_explicit_dtypes(cohort, patients_csv, tmp_path):
+    schema = pl.read_parquet_schema(cohort.convert_to_parquet(str(patients_csv), str(tmp_path)))
+    assert schema["BMI"] == pl.Float64
+    assert schema["Glucose"] == pl.Int64
+    assert schema["diagnosis"] == pl.String
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for the Hive-partitioned cohort dataset in cohort_analysis.py
+
+This script tests that:
+1. The dataset has one diagnosis/age_band partition per key, BMI-sorted
+2. Partitioned results match the single-file analysis
+3. Filters prune partitions and give the same result as filtering the CSV
+4. The dataset is written from a single scan of the cached conversion
+"""
+
+import json
+import os
+
+import polars as pl
+
+def as_rows(result):
+    return {r["bmi_range"]: (r["avg_glucose"], r["patient_count"], r["avg_age"])
+            for r in result.to_dicts()}
+
+def assert_same(left, right):
+    left, right = as_rows(left), as_rows(right)
+    assert left.keys() == right.keys()
+    for label, (glucose, count, age) in left.items():
+        assert count == right[label][1]
+        assert abs(glucose - right[label][0]) < 1e-9
+        assert abs(age - right[label][2]) < 1e-9
+
+def test_dataset_layout(cohort, patients_csv, tmp_path):
+    dataset = cohort.write_partitioned_dataset(str(patients_csv), str(tmp_path))
+    with open(os.path.join(dataset, cohort.DATASET_MANIFEST)) as f:
+        partitions = json.load(f)["partitions"]
+
+    source = pl.read_csv(patients_csv)
+    keys = source.select("diagnosis", (pl.col("Age") // 10 * 10).alias("age_band")).unique()
+    assert len(partitions) == keys.height
+    assert sum(p["rows"] for p in partitions) == source.height
+    assert any(p["path"].startswith("diagnosis=No%20Diabetes") for p in partitions)
+
+    for partition in partitions:
+        part = pl.read_parquet(os.path.join(dataset, partition["path"]), hive_partitioning=False)
+        assert "diagnosis" not in part.columns
+        assert part["BMI"].is_sorted()
+        assert part.height == partition["rows"]
+
+    # Reused on the next call
+    assert cohort.write_partitioned_dataset(str(patients_csv), str(tmp_path)) == dataset
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+def test_dataset_is_streamed_per_partition(cohort, patients_csv, tmp_path, monkeypatch):
+    cohort.convert_to_parquet(str(patients_csv), str(tmp_path))
+    scans, sinks = [], []
+    scan_parquet = pl.scan_parquet
+    sink_parquet = pl.LazyFrame.sink_parquet
+    monkeypatch.setattr(pl, "scan_parquet",
+                        lambda *args, **kwargs: scans.append(args) or scan_parquet(*args, **kwargs))
+    monkeypatch.setattr(pl.LazyFrame, "sink_parquet",
+                        lambda self, target, **kwargs: sinks.append(target)
+                        or sink_parquet(self, target, **kwargs))
+    dataset = cohort.write_partitioned_dataset(str(patients_csv), str(tmp_path), force=True)
+    assert len(scans) == 1
+
+    with open(os.path.join(dataset, cohort.DATASET_MANIFEST)) as f:
+        partitions = json.load(f)["partitions"]
+    keys = [(p["diagnosis"], p["age_band"]) for p in partitions]
+    assert keys == sorted(keys)
+    assert len(sinks) == len(partitions)
+    for partition in partitions:
+        bmi = pl.read_parquet(os.path.join(dataset, partition["path"]),
+                              hive_partitioning=False)["BMI"]
+        assert (partition["bmi_min"], partition["bmi_max"]) == (bmi.min(), bmi.max())
+
+def test_partitioned_matches_flat(cohort, patients_csv, tmp_path):
+    flat = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path))
+    partitioned = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path),
+                                                 partitioned=True)
+    assert_same(partitioned, flat)
+
+def test_filters_prune_partitions(cohort, patients_csv, tmp_path, monkeypatch):
+    filters = {"diagnosis": "Diabetes", "Age": (40, 59)}
+    scanned = []
+    original_scan = cohort.pl.scan_parquet
+
+    def recording_scan(source, **kwargs):
+        scanned.append(source)
+        return original_scan(source, **kwargs)
+    monkeypatch.setattr(cohort.pl, "scan_parquet", recording_scan)
+
+    result = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir=str(tmp_path),
+                                            filters=filters)
+    files = scanned[-1]
+    assert len(files) == 2
+    assert all("diagnosis=Diabetes" in f and ("age_band=40" in f or "age_band=50" in f)
+               for f in files)
+
+    csv = tmp_path / "filtered.csv"
+    (pl.read_csv(patients_csv)
+       .filter((pl.col("diagnosis") == "Diabetes") & pl.col("Age").is_between(40, 59))
+       .write_csv(csv))
+    monkeypatch.setattr(cohort.pl, "scan_parquet", original_scan)
+    assert_same(result, cohort.analyze_patient_cohorts(str(csv), cache_dir=str(tmp_path)))
+
+def test_filter_kinds(cohort, patients_csv, tmp_path):
+    dataset = cohort.write_partitioned_dataset(str(patients_csv), str(tmp_path))
+    source = pl.read_csv(patients_csv)
+
+    both = cohort.scan_cohort_dataset(dataset, {"diagnosis": ["Diabetes", "No Diabetes"]})
+    assert both.collect().height == source.filter(
+        pl.col("diagnosis").is_in(["Diabetes", "No Diabetes"])).height
+
+    bmi = cohort.scan_cohort_dataset(dataset, {"BMI": (None, 15.0), "Age": 33}).collect()
+    assert bmi.height == source.filter((pl.col("BMI") <= 15.0) & (pl.col("Age") == 33)).height
+
+    empty = cohort.scan_cohort_dataset(dataset, {"diagnosis": "Unknown"}).collect()
+    assert empty.height == 0 and "BMI" in empty.columns
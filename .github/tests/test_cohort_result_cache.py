@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the query-result cache in cohort_analysis.py
+
+This script tests that:
+1. Repeated queries are answered from the cache without scanning the data
+2. Keys follow the normalized query plan and the input's content
+3. The cache evicts least recently used results past its size bound
+4. The cache can be bypassed, and hits and misses are counted
+"""
+
+import json
+import os
+import time
+
+import polars as pl
+
+import instrumentation
+
+def test_repeated_query_is_cached(cohort, patients_csv, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    cache = cohort.ResultCache(os.path.join(cache_dir, "results"))
+    first = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir, result_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("data was scanned again")
+    monkeypatch.setattr(cohort.pl, "scan_parquet", fail)
+    start = time.perf_counter()
+    again = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir, result_cache=cache)
+    assert time.perf_counter() - start < 0.5
+    assert again.equals(first)
+    assert again.schema == first.schema
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_fingerprint_follows_the_query(cohort):
+    base = cohort.query_fingerprint({"diagnosis": ["Diabetes", "Healthy"], "Age": (40, 59)})
+    assert base == cohort.query_fingerprint({"Age": (40, 59),
+                                             "diagnosis": {"Healthy", "Diabetes"}})
+    assert base != cohort.query_fingerprint({"diagnosis": ["Diabetes"], "Age": (40, 59)})
+    assert cohort.query_fingerprint() == cohort.query_fingerprint({})
+
+def test_fingerprint_covers_bins(cohort, monkeypatch):
+    original = cohort.query_fingerprint()
+    monkeypatch.setattr(cohort, "BMI_LABELS", ["Low", "Normal", "High", "Very high"])
+    assert cohort.query_fingerprint() != original
+
+def test_filters_and_data_changes(cohort, patients_csv, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    filtered = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir,
+                                              filters={"diagnosis": "Diabetes"})
+    unfiltered = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir)
+    assert filtered["patient_count"].sum() < unfiltered["patient_count"].sum()
+    # Partitioned and single-file scans share a key: the results are equal
+    cache = cohort.ResultCache(os.path.join(cache_dir, "results"))
+    cohort.analyze_patient_cohorts(str(patients_csv), cache_dir, partitioned=True,
+                                   result_cache=cache)
+    assert cache.hits == 1
+
+    with open(patients_csv, "a") as f:
+        f.write("1,100,70,20,0,22.0,0.5,40,0,Diabetes\n")
+    changed = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir)
+    assert changed["patient_count"].sum() == unfiltered["patient_count"].sum() + 1
+
+def test_lru_eviction(cohort, tmp_path):
+    cache = cohort.ResultCache(str(tmp_path / "results"), max_bytes="1MB")
+    frame = pl.DataFrame({"x": list(range(1000))})
+    cache.put("a", frame)
+    size = cache.stats()["bytes"]
+    cache.max_bytes = size * 2
+    cache.put("b", frame)
+    os.utime(os.path.join(cache.directory, "b.parquet"), ns=(1, 1))
+    assert cache.get("a") is not None  # "a" is now the most recently used
+    cache.put("c", frame)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["bytes"] <= cache.max_bytes
+
+    cache.max_bytes = 1
+    cache.put("d", frame)
+    assert cache.stats()["entries"] == 1 and cache.get("d") is not None
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+
+def test_corrupt_result_is_a_miss(cohort, tmp_path):
+    cache = cohort.ResultCache(str(tmp_path / "results"))
+    os.makedirs(cache.directory)
+    with open(os.path.join(cache.directory, "bad.parquet"), "wb") as f:
+        f.write(b"not parquet")
+    assert cache.get("bad") is None and cache.misses == 1
+
+def test_bypass(cohort, patients_csv, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cohort.analyze_patient_cohorts(str(patients_csv), cache_dir, use_result_cache=False)
+    assert not os.path.exists(os.path.join(cache_dir, "results"))
+
+def test_command_line_reports_hits(cohort, patients_csv, tmp_path, capsys):
+    metrics = tmp_path / "metrics.jsonl"
+    argv = [str(patients_csv), "--cache-dir", str(tmp_path / "cache"), "--metrics", str(metrics)]
+    cohort.main(argv)
+    assert "Result cache: miss" in capsys.readouterr().out
+    cohort.main(argv)
+    assert "Result cache: hit" in capsys.readouterr().out
+    cohort.main(argv + ["--no-result-cache"])
+    assert "Result cache" not in capsys.readouterr().out
+
+    runs = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert [run["caches"]["result"]["hits"] for run in runs[:2]] == [0, 1]
+    assert "result" not in runs[2]["caches"]
+    assert not instrumentation.enabled()
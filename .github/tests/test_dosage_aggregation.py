@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming dosage aggregation in med_dosage_calculator.py
+
+This script tests that:
+1. ExactSum is correctly rounded where naive summation is not
+2. Per-medication totals, counts, min/max and loading doses are correct
+3. Aggregators built on separate shards merge to the single-pass result
+"""
+
+import math
+import random
+
+def test_exact_sum_beats_naive(dosage):
+    values = [1e16, 1.0, -1e16] * 1000 + [0.1] * 10
+    exact = dosage.ExactSum()
+    for value in values:
+        exact.add(value)
+    assert exact.value == math.fsum(values)
+    assert sum(values) != math.fsum(values)
+
+def orders(n, seed):
+    rng = random.Random(seed)
+    return [{"name": f"P{i}", "weight": rng.uniform(2, 150),
+             "medication": rng.choice(["amiodarone", "Cordarone", "fentanyl", "unknownium"]),
+             "is_first_dose": rng.random() < 0.3} for i in range(n)]
+
+def test_report(dosage):
+    batch = orders(2000, seed=3)
+    results, total = dosage.calculate_all_dosages(batch)
+    aggregator = dosage.aggregate_dosages(batch)
+    rows = {row["medication"]: row for row in aggregator.report()}
+
+    assert set(rows) == {"amiodarone", "fentanyl", "unknownium"}
+    amio = [r for r in results if r["medication"] in ("amiodarone", "Cordarone")]
+    assert rows["amiodarone"]["orders"] == len(amio)
+    assert rows["amiodarone"]["total_mg"] == math.fsum(r["final_dosage"] for r in amio)
+    assert rows["amiodarone"]["max_mg"] == max(r["final_dosage"] for r in amio)
+    assert rows["amiodarone"]["loading_doses"] == sum(r["loading_dose_applied"] for r in amio)
+    assert aggregator.count == 2000
+    assert aggregator.total == total == math.fsum(r["final_dosage"] for r in results)
+
+def test_merge_matches_single_pass(dosage):
+    batch = orders(3000, seed=4)
+    shards = [batch[i::3] for i in range(3)]
+    merged = dosage.DosageAggregator()
+    for shard in shards:
+        merged.merge(dosage.aggregate_dosages(shard))
+    assert merged.report() == dosage.aggregate_dosages(batch).report()
+    assert merged.total == dosage.aggregate_dosages(batch).total
+
+def test_iter_dosages_is_lazy(dosage):
+    def endless():
+        while True:
+            yield {"weight": 70, "medication": "fentanyl"}
+    stream = dosage.iter_dosages(endless())
+    assert next(stream)["final_dosage"] == 0.07
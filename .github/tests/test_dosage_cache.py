@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for DosageCache in med_dosage_calculator.py
+
+This script tests that:
+1. Cached results are identical to uncached results
+2. Hit/miss/eviction/expiry counters are maintained
+3. The cache is invalidated when the formulary is reloaded
+4. Bucketed weights are recorded as the dosing weight; keys are exact by default
+5. Cache hits build the record without copying the patient; --cache-size needs the dict engine
+"""
+
+import random
+import pytest
+
+from patient_records import PatientBatch
+
+def orders(n, seed=0):
+    rng = random.Random(seed)
+    return [{"name": f"P{i}", "weight": rng.choice([50.0, 70.0, 90.0]),
+             "medication": rng.choice(["amiodarone", "fentanyl", "epinephrine"]),
+             "is_first_dose": rng.random() < 0.5, "allergies": rng.choice([[], ["opioids"]])}
+            for i in range(n)]
+
+def test_cached_results_match(dosage):
+    batch = orders(500)
+    cache = dosage.DosageCache(maxsize=100)
+    assert dosage.calculate_all_dosages(batch, cache=cache) == dosage.calculate_all_dosages(batch)
+    stats = cache.stats()
+    assert stats["misses"] == 18  # 3 weights x 3 medications x 2 first-dose flags
+    assert stats["hits"] == 482
+    assert stats["evictions"] == 0
+
+def test_results_do_not_share_lists(dosage):
+    cache = dosage.DosageCache()
+    order = {"weight": 70, "medication": "epinephrine"}
+    first = dosage.calculate_dosage(order, cache)
+    first["warnings"].append("mutated")
+    assert dosage.calculate_dosage(order, cache)["warnings"] == ["Monitor for arrhythmias"]
+
+def test_lru_eviction(dosage):
+    cache = dosage.DosageCache(maxsize=2)
+    for medication in ["amiodarone", "fentanyl", "amiodarone", "epinephrine", "fentanyl"]:
+        cache.lookup(medication, 70.0, True)
+    assert cache.stats()["evictions"] == 2
+    assert cache.hits == 1
+    assert len(cache) == 2
+
+def test_ttl_expiry(dosage, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(dosage.time, "monotonic", lambda: clock[0])
+    cache = dosage.DosageCache(ttl=10)
+    cache.lookup("fentanyl", 70.0, False)
+    clock[0] += 5
+    cache.lookup("fentanyl", 70.0, False)
+    clock[0] += 11
+    cache.lookup("fentanyl", 70.0, False)
+    assert (cache.hits, cache.misses, cache.expirations) == (1, 2, 1)
+
+def test_weight_resolution(dosage):
+    cache = dosage.DosageCache(weight_resolution=1.0)
+    a = dosage.calculate_dosage({"weight": 70.2, "medication": "amiodarone"}, cache)
+    b = dosage.calculate_dosage({"weight": 69.8, "medication": "amiodarone"}, cache)
+    assert a["base_dosage"] == b["base_dosage"] == 350.0
+    assert cache.hits == 1
+    assert (a["weight"], a["dosing_weight"]) == (70.2, 70.0)
+    assert (b["weight"], b["dosing_weight"]) == (69.8, 70.0)
+
+    records = [{"weight": 70.2, "medication": "amiodarone"},
+               {"weight": 81.6, "medication": "fentanyl"}]
+    expected, _ = dosage.calculate_all_dosages(
+        records, cache=dosage.DosageCache(weight_resolution=1.0))
+    batch, _ = dosage.calculate_all_dosages(
+        PatientBatch.from_dicts(records), cache=dosage.DosageCache(weight_resolution=1.0))
+    assert list(batch.dicts()) == expected
+
+def test_bucketed_weight_is_rounded(dosage):
+    cache = dosage.DosageCache(weight_resolution=0.1)
+    assert cache.dosing_weight(70.3) == 70.3
+    assert dosage.calculate_dosage({"weight": 70.31, "medication": "fentanyl"},
+                                   cache)["dosing_weight"] == 70.3
+    assert dosage.DosageCache(weight_resolution=5).dosing_weight(71) == 70
+
+class NoCopy(dict):
+    def copy(self):
+        raise AssertionError("patient copied")
+
+def test_hits_build_the_record_from_the_entry(dosage):
+    cache = dosage.DosageCache()
+    order = NoCopy(name="P1", weight=70.0, medication="amiodarone", is_first_dose=True)
+    first, second = (dosage.calculate_dosage(order, cache) for _ in range(2))
+    assert cache.hits == 1
+    assert first == second == dosage.calculate_dosage(dict(order))
+    assert list(first) == [*order, "base_dosage", "loading_dose_applied", "final_dosage",
+                           "warnings", "contraindications"]
+
+def test_cache_size_requires_dict_engine(dosage, capsys):
+    with pytest.raises(SystemExit):
+        dosage.parse_args(["orders.json", "--engine", "numpy", "--cache-size", "64"])
+    assert "--cache-size" in capsys.readouterr().err
+    assert dosage.parse_args(["orders.json", "--cache-size", "64"]).cache_size == 64
+
+def test_exact_weights_by_default(dosage):
+    cache = dosage.DosageCache()
+    a = dosage.calculate_dosage({"weight": 70.2, "medication": "amiodarone"}, cache)
+    b = dosage.calculate_dosage({"weight": 70.2000001, "medication": "amiodarone"}, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert a == dosage.calculate_dosage({"weight": 70.2, "medication": "amiodarone"})
+    assert "dosing_weight" not in a and b["base_dosage"] > a["base_dosage"]
+
+def test_invalidated_on_formulary_reload(dosage, tmp_path):
+    cache = dosage.DosageCache()
+    assert cache.lookup("amiodarone", 10.0, False)[1] == 50.0
+    path = tmp_path / "rules.json"
+    path.write_text('{"medications": {"amiodarone": {"factor": 1.0}}}')
+    try:
+        dosage.use_formulary(str(path))
+        assert cache.lookup("amiodarone", 10.0, False)[1] == 10.0
+        assert cache.invalidations == 1
+    finally:
+        dosage.use_formulary()
+
+def test_invalid_size(dosage):
+    with pytest.raises(ValueError):
+        dosage.DosageCache(maxsize=0)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for the dosage engines in med_dosage_calculator.py
+
+This script tests that:
+1. Dosages follow the documented formulas
+2. The vectorized NumPy engine returns the same records as the dict engine
+3. calculate_dosage_table exposes the results as a structured array
+"""
+
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+
+def random_orders(dosage, n, seed=0):
+    rng = random.Random(seed)
+    medications = list(dosage.DOSAGE_FACTORS) + ["unknownium"]
+    return [{"name": f"Patient {i}", "weight": round(rng.uniform(3, 150), 1),
+             "medication": rng.choice(medications), "condition": "x",
+             "is_first_dose": rng.random() < 0.5, "allergies": []}
+            for i in range(n)]
+
+def test_documented_examples(dosage):
+    """The examples from the module docstring."""
+    epi = dosage.calculate_dosage({"weight": 70.0, "medication": "epinephrine",
+                                   "is_first_dose": False})
+    assert epi["final_dosage"] == pytest.approx(0.7)
+    assert epi["warnings"] == ["Monitor for arrhythmias"]
+
+    amio = dosage.calculate_dosage({"weight": 70.0, "medication": "amiodarone",
+                                    "is_first_dose": True})
+    assert amio["base_dosage"] == pytest.approx(350)
+    assert amio["loading_dose_applied"] is True
+    assert amio["final_dosage"] == pytest.approx(700)
+
+def test_missing_weight(dosage):
+    with pytest.raises(ValueError):
+        dosage.calculate_dosage({"medication": "fentanyl"})
+    with pytest.raises(ValueError):
+        dosage.calculate_dosage_table([{"medication": "fentanyl"}])
+
+@pytest.mark.parametrize("n", [0, 1, 1000])
+def test_numpy_matches_dict_engine(dosage, n):
+    orders = random_orders(dosage, n)
+    expected, expected_total = dosage.calculate_all_dosages(orders, engine="dict")
+    result, total = dosage.calculate_all_dosages(orders, engine="numpy")
+    assert result == expected
+    assert total == pytest.approx(expected_total)
+
+@pytest.mark.parametrize("engine", ["dict", "numpy"])
+def test_mixed_type_medications(dosage, engine):
+    orders = random_orders(dosage, 6, seed=2)
+    orders[1]["medication"] = 42
+    orders[3]["medication"] = 1.5
+    orders[4]["medication"] = "epinephrine"
+    result, _ = dosage.calculate_all_dosages(orders, engine=engine)
+    assert [r["final_dosage"] for r in result][1:4:2] == [0, 0]
+    assert result[4]["final_dosage"] == pytest.approx(orders[4]["weight"] * 0.01)
+    assert result == dosage.calculate_all_dosages(orders, engine="dict")[0]
+
+def test_dosage_table(dosage):
+    orders = random_orders(dosage, 200, seed=1)
+    table, total = dosage.calculate_dosage_table(orders)
+    expected, _ = dosage.calculate_all_dosages(orders)
+    assert table.dtype.names == tuple(name for name, _ in dosage.DOSAGE_TABLE_DTYPE)
+    assert np.array_equal(table["final_dosage"], [p["final_dosage"] for p in expected])
+    assert dosage.medication_names(table) == [
+        o["medication"] if o["medication"] in dosage.DOSAGE_FACTORS else None for o in orders]
+    assert total == pytest.approx(sum(p["final_dosage"] for p in expected))
+
+def test_unknown_engine(dosage):
+    with pytest.raises(ValueError):
+        dosage.calculate_all_dosages([], engine="gpu")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for dosage_service.py
+
+This script tests that:
+1. Concurrent requests are grouped into micro-batches
+2. Results match calculate_dosage and bad orders get an error response
+3. A full queue rejects requests (backpressure)
+4. The JSON-lines server answers pipelined requests in order, in process
+5. A connection stops being read while max_pipelined requests await responses
+6. Closing the service fails the orders of the batch being evaluated
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import dosage_service
+from dosage_service import DosageClient, DosageService, ServiceOverloaded
+
+def order(i):
+    return {"name": f"Patient {i}", "weight": 50 + i, "medication": "amiodarone",
+            "is_first_dose": i % 2 == 0, "allergies": []}
+
+def test_concurrent_requests_are_batched(dosage):
+    async def scenario():
+        service = DosageService(max_batch_size=64, max_latency=0.05)
+        await service.start()
+        results = await asyncio.gather(*(service.submit(order(i)) for i in range(200)))
+        stats = service.stats()
+        await service.close()
+        return results, stats
+
+    results, stats = asyncio.run(scenario())
+    assert results == [dosage.calculate_dosage(order(i)) for i in range(200)]
+    assert stats["requests"] == 200
+    assert stats["batches"] < 200
+    assert stats["mean_batch_size"] > 1
+    assert stats["p50_ms"] <= stats["p99_ms"]
+
+def test_bad_order_isolated():
+    async def scenario():
+        service = DosageService(max_latency=0.05)
+        await service.start()
+        good = service.submit(order(1))
+        bad = service.submit({"name": "No Weight", "medication": "fentanyl"})
+        results = await asyncio.gather(good, bad, return_exceptions=True)
+        await service.close()
+        return results, service.stats()
+
+    (good, bad), stats = asyncio.run(scenario())
+    assert good["final_dosage"] == 255
+    assert isinstance(bad, ValueError)
+    assert stats["errors"] == 1
+
+def test_backpressure():
+    async def scenario():
+        service = DosageService(max_queue=5)  # batcher not started: queue never drains
+        tasks = [asyncio.ensure_future(service.submit(order(i))) for i in range(5)]
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceOverloaded):
+            await service.submit(order(99))
+        rejected = service.stats()["rejected"]
+        await service.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return rejected
+
+    assert asyncio.run(scenario()) == 1
+
+def test_close_fails_inflight_batch(dosage, monkeypatch):
+    calculate = dosage_service.dosage_calculator.calculate_all_dosages
+
+    def slow(*args, **kwargs):
+        time.sleep(0.3)
+        return calculate(*args, **kwargs)
+    monkeypatch.setattr(dosage_service.dosage_calculator, "calculate_all_dosages", slow)
+
+    async def scenario():
+        service = DosageService(max_latency=0.001)
+        await service.start()
+        submitted = asyncio.ensure_future(service.submit(order(1)))
+        await asyncio.sleep(0.1)
+        await service.close()
+        with pytest.raises(ServiceOverloaded):
+            await asyncio.wait_for(submitted, 1)
+
+    asyncio.run(scenario())
+
+def test_json_lines_server(dosage):
+    async def scenario():
+        service = DosageService(max_latency=0.01)
+        server = await service.serve(port=0)
+        port = server.sockets[0].getsockname()[1]
+        client = await DosageClient.connect(port=port)
+        responses = await client.request_many(
+            [order(i) for i in range(20)] + [{"weight": 1}, [1, 2], {"op": "stats"}])
+        await client.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return responses
+
+    responses = asyncio.run(scenario())
+    assert responses[:20] == [dosage.calculate_dosage(order(i)) for i in range(20)]
+    assert "error" in responses[20] and "error" in responses[21]
+    assert responses[22]["requests"] == 21
+
+class StalledWriter:
+    """Stream writer whose drain() waits until released."""
+
+    def __init__(self):
+        self.lines = []
+        self.released = asyncio.Event()
+
+    def write(self, data):
+        self.lines.append(data)
+
+    async def drain(self):
+        await self.released.wait()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def test_pipelining_is_bounded(dosage):
+    async def scenario():
+        service = DosageService(max_latency=0.001, max_pipelined=4)
+        await service.start()
+        reader = asyncio.StreamReader()
+        for i in range(50):
+            reader.feed_data(json.dumps(order(i)).encode() + b"\n")
+        reader.feed_eof()
+        writer = StalledWriter()
+        handler = asyncio.create_task(service.handle_connection(reader, writer))
+        await asyncio.sleep(0.1)
+        # One response is being written and four wait in the queue
+        started = service.stats()["requests"]
+        writer.released.set()
+        await handler
+        await service.close()
+        return started, [json.loads(line) for line in writer.lines]
+
+    started, responses = asyncio.run(scenario())
+    assert started <= 6
+    assert responses == [dosage.calculate_dosage(order(i)) for i in range(50)]
+
+def test_disconnected_client_does_not_stall_the_reader():
+    class BrokenWriter(StalledWriter):
+        async def drain(self):
+            raise ConnectionResetError
+
+    async def scenario():
+        service = DosageService(max_latency=0.001, max_pipelined=2)
+        await service.start()
+        reader = asyncio.StreamReader()
+        for i in range(20):
+            reader.feed_data(json.dumps(order(i)).encode() + b"\n")
+        reader.feed_eof()
+        await asyncio.wait_for(service.handle_connection(reader, BrokenWriter()), 5)
+        requests = service.stats()["requests"]
+        await service.close()
+        return requests
+
+    assert asyncio.run(scenario()) == 20
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for formulary.py and its use in med_dosage_calculator.py
+
+This script tests that:
+1. The bundled formulary matches the documented dosage factors
+2. Aliases, brand names and case variants resolve to the same rule
+3. Compiled rules are immutable and invalid rule files are rejected
+4. The calculator can switch to a different JSON or TOML rule file
+"""
+
+import pytest
+
+from formulary import compile_formulary, load_formulary
+
+def test_bundled_formulary():
+    formulary = load_formulary()
+    assert formulary["epinephrine"].factor == 0.01
+    assert formulary["amiodarone"].factor == 5.0
+    assert formulary.loading_dose_medications() == {"amiodarone", "lorazepam", "fentanyl"}
+    assert [rule.code for rule in formulary] == list(range(len(formulary)))
+
+@pytest.mark.parametrize("spelling", ["fentanyl", "fentynal", "Sublimaze", "  FENTANYL ", "sublimaze"])
+def test_alias_resolution(spelling):
+    formulary = load_formulary()
+    assert formulary.get(spelling) is formulary["fentanyl"]
+
+def test_lookups_do_not_grow_the_formulary():
+    formulary = load_formulary()
+    spellings = dict(formulary.spellings())
+    for i in range(100):
+        assert formulary.get(" " * i + "Fentanyl") is formulary["fentanyl"]
+    assert formulary.get("unknown drug") is None
+    assert dict(formulary.spellings()) == spellings
+
+def test_rules_are_immutable():
+    rule = load_formulary()["ibuprofen"]
+    assert "aspirin" in rule.allergy_classes
+    with pytest.raises(AttributeError):
+        rule.factor = 100
+    assert not hasattr(rule, "__dict__")
+
+@pytest.mark.parametrize("spec", [
+    {},
+    {"medications": {"x": {"factor": -1}}},
+    {"medications": {"x": {"factor": "1"}}},
+    {"medications": {"x": {"factor": 1, "dose": 2}}},
+    {"medications": {"x": {"factor": 1, "aliases": ["y"]}, "y": {"factor": 2}}},
+])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        compile_formulary(spec)
+
+@pytest.fixture
+def restore_formulary(dosage):
+    yield
+    dosage.use_formulary()
+
+def test_use_toml_formulary(dosage, tmp_path, restore_formulary):
+    path = tmp_path / "rules.toml"
+    path.write_text('[medications.heparin]\nfactor = 80\nloading_dose = true\n'
+                    'warnings = ["Monitor for bleeding"]\naliases = ["Hep-Lock"]\n')
+    dosage.use_formulary(str(path))
+    assert dosage.DOSAGE_FACTORS == {"heparin": 80.0}
+    result = dosage.calculate_dosage({"weight": 50, "medication": "hep-lock", "is_first_dose": True})
+    assert result["final_dosage"] == 8000
+    assert result["warnings"] == ["Monitor for bleeding"]
+
+def test_calculator_resolves_aliases(dosage):
+    brand = dosage.calculate_dosage({"weight": 80, "medication": "Cordarone", "is_first_dose": True})
+    generic = dosage.calculate_dosage({"weight": 80, "medication": "amiodarone", "is_first_dose": True})
+    assert brand["final_dosage"] == generic["final_dosage"] == 800
+    assert brand["warnings"] == ["Monitor for hypotension"]
+    orders = [{"weight": 80, "medication": m, "is_first_dose": True} for m in ("Cordarone", "epinephrin")]
+    assert dosage.calculate_all_dosages(orders, engine="numpy") == dosage.calculate_all_dosages(orders)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline synthetic data generator (generate_large_health_data.py)
+
+This script tests that:
+1. Output is byte-identical for a seed and chunk size, for any worker count
+2. CSV, Parquet and partitioned Parquet outputs hold the same rows
+3. Generated values follow the bundled seed distribution
+"""
+
+import hashlib
+import json
+import os
+
+import polars as pl
+import pytest
+
+@pytest.fixture
+def generator():
+    from conftest import load_script
+    return load_script("generate_large_health_data.py")
+
+def digest(path):
+    return hashlib.sha256(open(path, "rb").read()).hexdigest()
+
+def test_deterministic_across_workers(generator, tmp_path):
+    one = generator.generate(str(tmp_path / "a.csv"), rows=25_000, seed=3, chunk_rows=4000, workers=1)
+    two = generator.generate(str(tmp_path / "b.csv"), rows=25_000, seed=3, chunk_rows=4000, workers=3)
+    assert one["rows"] == two["rows"] == 25_000
+    assert one["chunks"] == 7
+    assert digest(tmp_path / "a.csv") == digest(tmp_path / "b.csv")
+
+    generator.generate(str(tmp_path / "c.csv"), rows=25_000, seed=4, chunk_rows=4000, workers=1)
+    assert digest(tmp_path / "c.csv") != digest(tmp_path / "a.csv")
+
+    generator.generate(str(tmp_path / "a.parquet"), rows=25_000, seed=3, chunk_rows=4000, workers=1)
+    generator.generate(str(tmp_path / "b.parquet"), rows=25_000, seed=3, chunk_rows=4000, workers=2)
+    assert digest(tmp_path / "a.parquet") == digest(tmp_path / "b.parquet")
+
+def test_formats_agree(generator, tmp_path):
+    kwargs = dict(rows=12_000, seed=9, chunk_rows=5000, workers=1)
+    generator.generate(str(tmp_path / "p.csv"), **kwargs)
+    generator.generate(str(tmp_path / "p.parquet"), **kwargs)
+    generator.generate(str(tmp_path / "dataset"), fmt="partitioned", **kwargs)
+
+    csv = pl.read_csv(tmp_path / "p.csv")
+    assert csv.columns == generator.COLUMNS
+    assert pl.read_parquet(tmp_path / "p.parquet").equals(csv)
+
+    dataset = pl.read_parquet(str(tmp_path / "dataset" / "**" / "*.parquet"), hive_partitioning=True)
+    assert sorted(os.listdir(tmp_path / "dataset")) == [
+        "_generator.json", "diagnosis=Diabetes", "diagnosis=No%20Diabetes", "diagnosis=Pre-diabetes"]
+    key = generator.COLUMNS
+    assert dataset.select(key).sort(key).equals(csv.sort(key))
+
+    # Regenerating replaces a generated directory, but never a foreign one
+    generator.generate(str(tmp_path / "dataset"), fmt="partitioned", **kwargs)
+    (tmp_path / "mine").mkdir()
+    (tmp_path / "mine" / "notes.txt").write_text("keep")
+    with pytest.raises(ValueError):
+        generator.generate(str(tmp_path / "mine"), fmt="partitioned", **kwargs)
+
+def test_follows_seed_distribution(generator):
+    distribution = generator.load_distribution()
+    seeds = generator.np.random.SeedSequence(1).spawn(1)
+    df = generator.generate_chunk(distribution, 200_000, seeds[0])
+
+    assert abs(df["Outcome"].mean() - distribution["outcome_rate"]) < 0.01
+    assert df["Age"].min() >= 21
+    for column, entry in distribution["columns"].items():
+        for label in (0, 1):
+            values = df.filter(pl.col("Outcome") == label)[column]
+            if entry["quantiles"][label][0] == 0:
+                continue  # zero is an ordinary value (Pregnancies)
+            zeros = (values == 0).mean()
+            assert abs(zeros - entry["zero_fraction"][label]) < 0.01
+            nonzero = values.filter(values > 0)
+            median = entry["quantiles"][label][4]
+            assert abs(nonzero.median() - median) <= 0.05 * median + 1
+    shares = df["diagnosis"].value_counts(normalize=True)
+    diabetes = shares.filter(pl.col("diagnosis") == "Diabetes")["proportion"].item()
+    assert abs(diabetes - 0.3) < 0.01
+
+def test_invalid_distribution(generator, tmp_path):
+    path = tmp_path / "bad.json"
+    spec = generator.load_distribution()
+    spec["probabilities"] = [0, 0.5]
+    path.write_text(json.dumps(spec))
+    with pytest.raises(ValueError):
+        generator.load_distribution(str(path))
+    with pytest.raises(ValueError):
+        generator.chunk_layout(0)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for the pipeline instrumentation (instrumentation.py)
+
+This script tests that:
+1. Hooks are no-ops while recording is disabled
+2. Stages, counters and caches are recorded and exported as JSON lines
+   and Prometheus text
+3. The sampling profiler writes collapsed stacks
+4. Each script's main() reports its stages with --metrics
+"""
+
+import json
+import pstats
+
+import pytest
+
+import instrumentation
+
+@pytest.fixture(autouse=True)
+def clean_recorder():
+    instrumentation.disable()
+    instrumentation.reset()
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+def test_disabled_hooks_record_nothing():
+    with instrumentation.stage('load') as stage:
+        stage.records = 10
+        stage.bytes = 100
+    instrumentation.count('events')
+    instrumentation.cache('dosage', hits=1)
+    function = len
+    assert instrumentation.timed_calls('dedup', function) is function
+    assert instrumentation.snapshot() == {'stages': {}, 'counters': {}, 'caches': {}}
+
+def test_stages_counters_and_caches():
+    instrumentation.enable()
+    for records in (3, 4):
+        with instrumentation.stage('load', nbytes=10) as stage:
+            stage.records = records
+    instrumentation.count('partitions_pruned', 2)
+    instrumentation.cache('parquet', hits=3, misses=1)
+    timed = instrumentation.timed_calls('dedup', lambda x: x * 2)
+    assert [timed(i) for i in range(5)] == [0, 2, 4, 6, 8]
+
+    metrics = instrumentation.snapshot()
+    assert metrics['stages']['load']['calls'] == 2
+    assert metrics['stages']['load']['records'] == 7
+    assert metrics['stages']['load']['bytes'] == 20
+    assert metrics['stages']['dedup']['calls'] == 5
+    assert metrics['counters'] == {'partitions_pruned': 2}
+    assert metrics['caches']['parquet'] == {'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
+def test_stage_recorded_when_block_raises():
+    instrumentation.enable()
+    with pytest.raises(ValueError):
+        with instrumentation.stage('load'):
+            raise ValueError("bad input")
+    assert instrumentation.snapshot()['stages']['load']['calls'] == 1
+
+def test_exports(tmp_path):
+    metrics_path = tmp_path / "metrics.jsonl"
+    prometheus_path = tmp_path / "metrics.prom"
+    for _ in range(2):
+        with instrumentation.session('dose', str(metrics_path), str(prometheus_path)):
+            with instrumentation.stage('dosage', records=5):
+                pass
+            instrumentation.cache('dosage', hits=1, misses=1)
+
+    lines = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]['script'] == 'dose'
+    assert lines[0]['stages']['dosage']['records'] == 5
+    assert lines[0]['caches']['dosage']['hit_rate'] == 0.5
+    assert not instrumentation.enabled()
+
+    text = prometheus_path.read_text()
+    assert '# TYPE pipeline_stage_seconds_total counter' in text
+    assert 'pipeline_stage_records_total{script="dose",stage="dosage"} 5' in text
+    assert 'pipeline_cache_hit_ratio{script="dose",cache="dosage"} 0.5' in text
+
+def test_session_without_outputs_stays_disabled():
+    with instrumentation.session('clean'):
+        assert not instrumentation.enabled()
+
+def busy_loop(seconds):
+    import time
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+def test_sampling_profile(tmp_path):
+    profile_path = tmp_path / "profile.folded"
+    with instrumentation.session('clean', profile_path=str(profile_path)):
+        busy_loop(0.2)
+
+    lines = profile_path.read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, samples = line.rsplit(' ', 1)
+        assert int(samples) > 0
+    assert any('busy_loop (test_instrumentation.py:' in line for line in lines)
+
+def test_cprofile_profile(tmp_path):
+    profile_path = tmp_path / "profile.prof"
+    with instrumentation.session('clean', profile_path=str(profile_path), profiler='cprofile'):
+        busy_loop(0.05)
+    stats = pstats.Stats(str(profile_path))
+    assert any(name == 'busy_loop' for _, _, name in stats.stats)
+
+def test_scripts_report_stages(tmp_path, cleaner, dosage, cohort, patients_csv):
+    metrics_path = tmp_path / "metrics.jsonl"
+    patients = tmp_path / "patients.json"
+    patients.write_text(json.dumps([
+        {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "flu"},
+        {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "flu"},
+    ]))
+    orders = tmp_path / "orders.json"
+    orders.write_text(json.dumps([{"weight": 70, "medication": "epinephrine",
+                                   "is_first_dose": False}] * 3))
+
+    cleaner.main([str(patients), '--metrics', str(metrics_path)])
+    dosage.main([str(orders), '--cache-size', '8', '--metrics', str(metrics_path)])
+    cohort.main([str(patients_csv), '--cache-dir', str(tmp_path / "cache"),
+                 '--metrics', str(metrics_path)])
+
+    clean, dose, analysis = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    assert clean['stages']['load']['records'] == 2
+    assert clean['stages']['clean']['records'] == 1
+    assert clean['stages']['dedup']['calls'] == 2
+    assert dose['stages']['dosage']['records'] == 3
+    assert dose['caches']['dosage'] == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3}
+    assert set(analysis['stages']) == {'hash', 'convert', 'aggregate'}
+    assert analysis['stages']['convert']['bytes'] == patients_csv.stat().st_size
+    assert analysis['caches']['parquet'] == {'hits': 0, 'misses': 1, 'hit_rate': 0.0}
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk age/weight coercion (patient_coercion.py)
+
+This script tests that:
+1. Padded, decimal and unit-suffixed values are parsed, and pounds become kilograms
+2. Dirty values are rejected with the right reason code
+3. Rejected records stream to a quarantine JSON Lines file and are counted
+4. The cleaner and dosage calculator coerce before processing, from code and the CLI
+5. A batch where a fifth of the values are dirty costs about as much as a clean one
+"""
+
+import json
+import random
+import time
+
+import pytest
+
+import patient_coercion
+from patient_coercion import ColumnCoercer, coerce_column
+from pipeline import cli
+
+def test_ages_are_parsed():
+    values = ["32", "32.0", " 45 ", "45 yrs", "45yrs.", "60 Years", 70, 80.0, None]
+    coerced, reasons = coerce_column(values, "age")
+    assert coerced == [32, 32, 45, 45, 45, 60, 70, 80, None]
+    assert all(type(age) is int for age in coerced[:-1])
+    assert reasons == {}
+
+def test_weights_are_normalized_to_kg():
+    values = ["70", " 70.5 KG", "154 lbs", "154lb", 80, "100 pounds"]
+    coerced, reasons = coerce_column(values, "weight")
+    assert coerced == pytest.approx([70.0, 70.5, 154 * patient_coercion.LB_TO_KG,
+                                     154 * patient_coercion.LB_TO_KG, 80.0,
+                                     100 * patient_coercion.LB_TO_KG])
+    assert reasons == {}
+
+@pytest.mark.parametrize("field, value, reason", [
+    ("age", "", "empty"),
+    ("age", "   ", "empty"),
+    ("age", "unknown", "unparseable"),
+    ("age", "NaN", "unparseable"),
+    ("age", float("nan"), "unparseable"),
+    ("age", "45 days", "unknown_unit"),
+    ("age", "32.5", "not_integer"),
+    ("age", "-1", "out_of_range"),
+    ("age", 200, "out_of_range"),
+    ("age", True, "invalid_type"),
+    ("age", ["32"], "invalid_type"),
+    ("weight", "lbs", "unparseable"),
+    ("weight", "70 stone", "unknown_unit"),
+    ("weight", "2000 lbs", "out_of_range"),
+    ("weight", 0, "out_of_range"),
+    ("weight", None, "missing"),
+])
+def test_reason_codes(field, value, reason):
+    coerced, reasons = coerce_column(["40", value], field, required=True)
+    assert reasons == {1: reason}
+    assert coerced[1] is None
+    assert reason in patient_coercion.REASON_CODES
+
+def test_absent_optional_fields_are_left_alone():
+    coercer = ColumnCoercer()
+    assert coercer.coerce([{"name": "a"}, {"name": "b", "age": "30"}]) == [
+        {"name": "a"}, {"name": "b", "age": 30}]
+
+def test_quarantine_and_counts(tmp_path):
+    patients = [{"name": "a", "age": "32", "weight": "154 lbs"},
+                {"name": "b", "age": "", "weight": 70},
+                {"name": "c", "age": "abc", "weight": "heavy"},
+                {"name": "d", "age": "45 yrs", "weight": "70 kg"}]
+    path = tmp_path / "quarantine.jsonl"
+    with ColumnCoercer(quarantine_path=str(path), batch_size=3) as coercer:
+        kept = list(coercer.iter_coerce(patients))
+    assert [patient["name"] for patient in kept] == ["a", "d"]
+    assert kept[0]["age"] == 32 and kept[0]["weight"] == pytest.approx(69.853, abs=1e-3)
+    assert patients[0]["age"] == "32"
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        {"row": 1, "field": "age", "reason": "empty", "value": "", "record": patients[1]},
+        {"row": 2, "field": "age", "reason": "unparseable", "value": "abc",
+         "record": patients[2]},
+    ]
+    assert coercer.summary() == {
+        "records_seen": 4, "records_kept": 2, "records_quarantined": 2,
+        "errors": {"age": {"empty": 1, "unparseable": 1}, "weight": {"unparseable": 1}},
+    }
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(ValueError, match="'height'"):
+        ColumnCoercer(fields=("height",))
+
+def test_cleaner_coerces_first(cleaner):
+    patients = [{"name": "john smith", "age": "32.0"},
+                {"name": "ana lopez", "age": " 45 yrs "},
+                {"name": "li wei", "age": "abc"},
+                {"name": "amy lee", "age": "12"}]
+    assert cleaner.clean_patient_data(patients) == []
+
+    for engine in cleaner.CLEANING_ENGINES:
+        coercer = ColumnCoercer()
+        cleaned = cleaner.clean_patient_data(patients, engine=engine, coercer=coercer)
+        assert cleaned == [{"name": "John Smith", "age": 32}, {"name": "Ana Lopez", "age": 45}]
+        assert coercer.summary()["errors"]["age"] == {"unparseable": 1}
+        streamed = cleaner.iter_clean_patients(iter(patients), engine=engine,
+                                               coercer=ColumnCoercer())
+        assert list(streamed) == cleaned
+
+def test_command_lines(tmp_path, capsys, cleaner, dosage):
+    orders = tmp_path / "orders.jsonl"
+    raw = [{"name": "john smith", "age": "32", "weight": "176 lbs", "medication": "epinephrine"},
+           {"name": "ana lopez", "age": "", "weight": 60, "medication": "epinephrine"},
+           {"name": "li wei", "age": "51", "weight": "", "medication": "epinephrine"}]
+    orders.write_text("".join(json.dumps(order) + "\n" for order in raw))
+    quarantine, doses = tmp_path / "rejected.jsonl", tmp_path / "doses.jsonl"
+
+    assert cli.main(["clean", str(orders), "--quarantine", str(quarantine),
+                     "then", "dose", "--coerce", "-o", str(doses)]) == 0
+    assert "age empty: 1" in capsys.readouterr().err
+    dosed = [json.loads(line) for line in doses.read_text().splitlines()]
+    assert [order["name"] for order in dosed] == ["John Smith"]
+    assert dosed[0]["base_dosage"] == pytest.approx(176 * patient_coercion.LB_TO_KG * 0.01)
+    assert [json.loads(line)["reason"] for line in quarantine.read_text().splitlines()] == [
+        "empty", "empty"]
+
+    cleaner.main([str(orders), "--stream", "--coerce", "-o", str(tmp_path / "out.jsonl")])
+    assert "Coercion: 3 records seen, 2 quarantined" in capsys.readouterr().out
+    meds = tmp_path / "meds.json"
+    meds.write_text(json.dumps(raw))
+    results, _ = dosage.main([str(meds), "--coerce"])
+    assert [order["name"] for order in results] == ["john smith", "ana lopez"]
+    assert "weight empty: 1" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        cleaner.main([str(tmp_path / "*.jsonl"), "--coerce"])
+
+def test_dirty_batch_costs_about_the_same():
+    rng = random.Random(5)
+    clean = [{"age": str(rng.randint(18, 90)), "weight": round(rng.uniform(40, 120), 1)}
+             for _ in range(200_000)]
+    dirty = [dict(patient) for patient in clean]
+    for patient in dirty:
+        if rng.random() < 0.2:
+            patient["age"] = rng.choice(["", " 45 ", "45 yrs", "unknown", "32.0", "300"])
+        if rng.random() < 0.2:
+            patient["weight"] = rng.choice(["", "154 lbs", "heavy", " 70 kg"])
+
+    def best_of(patients):
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            ColumnCoercer().coerce(patients)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+    assert best_of(dirty) < 3 * best_of(clean)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for patient_dedup.py
+
+This script tests that:
+1. Fingerprints are fixed-width and ignore case/whitespace differences
+2. Every dedup mode drops the same duplicates and reports its counts
+3. The disk table grows past its initial size and can be reopened
+4. Disk tables start empty on each run unless resuming is requested
+"""
+
+import json
+
+import pytest
+
+from patient_dedup import (FINGERPRINT_SIZE, BloomFilter, FingerprintTable,
+                           PatientDeduplicator, patient_fingerprint)
+
+def make_patients(n, repeat=3):
+    """n distinct patients, each repeated `repeat` times."""
+    return [{"name": f"Patient {i}", "age": 20 + i % 60, "gender": "female", "diagnosis": "flu"}
+            for _ in range(repeat) for i in range(n)]
+
+def test_fingerprint_normalization():
+    """Case and whitespace differences map to the same fingerprint."""
+    a = {"name": "John Smith", "age": 32, "gender": "male", "diagnosis": "flu"}
+    b = {"name": " john  SMITH", "age": "32", "gender": "Male", "diagnosis": "flu ", "extra": 1}
+    c = dict(a, age=33)
+    assert len(patient_fingerprint(a)) == FINGERPRINT_SIZE
+    assert patient_fingerprint(a) == patient_fingerprint(b)
+    assert patient_fingerprint(a) != patient_fingerprint(c)
+
+def test_diagnosis_case_is_folded():
+    """Differently cased diagnoses are the same record; different ones are not."""
+    a = {"name": "Ann Lee", "age": 40, "gender": "female", "diagnosis": "Flu"}
+    assert patient_fingerprint(a) == patient_fingerprint(dict(a, diagnosis="FLU"))
+    assert patient_fingerprint(a) == patient_fingerprint(dict(a, diagnosis="flu"))
+    assert patient_fingerprint(a) != patient_fingerprint(dict(a, diagnosis="influenza"))
+
+@pytest.mark.parametrize("mode", ["memory", "disk", "bloom"])
+def test_modes_agree(mode, tmp_path):
+    """All modes keep the first occurrence of each record."""
+    patients = make_patients(500)
+    path = str(tmp_path / "seen.idx") if mode != "memory" else None
+    with PatientDeduplicator(mode=mode, path=path, expected_records=100) as dedup:
+        kept = [p for p in patients if not dedup.is_duplicate(p)]
+        assert kept == patients[:500]
+        assert dedup.records_seen == 1500
+        assert dedup.duplicates_dropped == 1000
+        assert dedup.summary()["unique_records"] == 500
+
+def test_bloom_without_exact_store():
+    """Pure Bloom mode stays within a small margin of the exact answer."""
+    dedup = PatientDeduplicator(mode="bloom", exact=False, expected_records=2000, error_rate=0.01)
+    patients = make_patients(2000, repeat=2)
+    kept = [p for p in patients if not dedup.is_duplicate(p)]
+    assert 2000 * 0.97 <= len(kept) <= 2000
+
+def test_bloom_filter_sizing():
+    """Lower error rates need more bits and hash functions."""
+    loose = BloomFilter(10_000, 0.05)
+    tight = BloomFilter(10_000, 0.0001)
+    assert tight.num_bits > loose.num_bits
+    assert tight.num_hashes > loose.num_hashes
+    with pytest.raises(ValueError):
+        BloomFilter(10, 0)
+
+def test_fingerprint_table_grows_and_reopens(tmp_path):
+    """Inserting past the load factor rehashes, and data survives reopening."""
+    path = str(tmp_path / "table.idx")
+    fingerprints = [patient_fingerprint({"name": str(i)}) for i in range(200)]
+    with FingerprintTable(path, initial_capacity=16) as table:
+        assert all(table.add(fp) for fp in fingerprints)
+        assert not table.add(fingerprints[0])
+        assert table.capacity >= 256
+    with FingerprintTable(path, resume=True) as table:
+        assert len(table) == 200
+        assert all(fp in table for fp in fingerprints)
+        assert sorted(table) == sorted(fingerprints)
+
+@pytest.mark.parametrize("mode", ["disk", "bloom"])
+def test_rerun_starts_empty_unless_resumed(mode, tmp_path):
+    path = str(tmp_path / "seen.idx")
+    patients = make_patients(100, repeat=1)
+    for resume, dropped in [(False, 0), (False, 0), (True, 100)]:
+        with PatientDeduplicator(mode=mode, path=path, expected_records=100,
+                                 resume=resume) as dedup:
+            assert sum(dedup.is_duplicate(p) for p in patients) == dropped
+            if mode == "bloom" and resume:
+                assert dedup.bloom_false_positives == 0
+
+def test_other_files_are_not_overwritten(tmp_path):
+    path = tmp_path / "patients.json"
+    path.write_text("[]")
+    with pytest.raises(ValueError, match="not a fingerprint table"):
+        PatientDeduplicator(mode="disk", path=str(path))
+    assert path.read_text() == "[]"
+
+def test_bloom_exact_store_is_on_disk():
+    with PatientDeduplicator(mode="bloom", expected_records=100) as dedup:
+        assert isinstance(dedup._exact, FingerprintTable)
+
+def test_command_line_flags(cleaner, tmp_path):
+    source = tmp_path / "patients.json"
+    source.write_text(json.dumps(make_patients(5, repeat=1)))
+    table = str(tmp_path / "seen.idx")
+    args = cleaner.parse_args([str(source), "--dedup", "bloom", "--no-exact"])
+    with cleaner.deduplicator_from_args(args) as dedup:
+        assert dedup._exact is None
+    for resume, kept in [([], 5), ([], 5), (["--dedup-resume"], 0)]:
+        args = cleaner.parse_args([str(source), "--dedup", "disk", "--dedup-path", table, *resume])
+        with cleaner.deduplicator_from_args(args) as dedup:
+            assert len(cleaner.clean_patient_data(make_patients(5, repeat=1), dedup)) == kept
+
+def test_clean_patient_data_reports_drops(cleaner):
+    """clean_patient_data uses the supplied deduplicator."""
+    dedup = PatientDeduplicator()
+    cleaned = cleaner.clean_patient_data(make_patients(10), dedup)
+    assert len(cleaned) == 10
+    assert dedup.summary()["duplicates_dropped"] == 20
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        PatientDeduplicator(mode="sqlite")
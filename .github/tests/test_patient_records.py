@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Tests for compact patient records and batches (patient_records.py)
+
+This script tests that:
+1. Batches round-trip to identical dictionaries, odd values included
+2. Categorical fields share one vocabulary across batches, which can be
+   scoped or reset; absent fields cost no per-row objects
+3. PatientRecord behaves like the dictionary it was built from
+4. clean_patient_data and calculate_all_dosages accept and return batches
+   with the same records as the list versions, for every engine
+5. A dosed batch uses roughly a tenth of the dictionaries' memory
+"""
+
+import random
+import tracemalloc
+
+import pytest
+
+import patient_records
+from patient_records import (EXCEPTION_CODE, MISSING_CODE, PatientBatch, PatientRecord,
+                             Vocabulary, reset_shared_vocabulary, vocabulary_scope)
+
+PATIENTS = [
+    {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "flu",
+     "weight": 80.0, "medication": "epinephrine", "is_first_dose": False,
+     "allergies": ["sulfa"]},
+    {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "flu",
+     "weight": 80.0, "medication": "epinephrine", "is_first_dose": False,
+     "allergies": ["sulfa"]},
+    {"name": "sarah johnson", "age": "17", "gender": "F", "diagnosis": "asthma",
+     "weight": 60, "medication": "amiodarone", "is_first_dose": True},
+    {"name": "ana lópez", "age": 45, "gender": "female", "diagnosis": "hypertension",
+     "weight": 72.5, "medication": "Amiodarone", "is_first_dose": True,
+     "allergies": ["iodine"]},
+    {"name": "li wei", "age": "abc", "diagnosis": "flu", "weight": 55.0,
+     "medication": "unknownium", "notes": {"ward": 3}},
+]
+
+def random_orders(count, seed=3):
+    rng = random.Random(seed)
+    medications = ["epinephrine", "amiodarone", "lidocaine", "adenosine", "atropine"]
+    return [{"name": f"patient {i}", "age": str(rng.randint(18, 90)),
+             "gender": rng.choice(["male", "female"]),
+             "diagnosis": rng.choice(["flu", "asthma", "hypertension"]),
+             "weight": round(rng.uniform(40, 120), 1),
+             "medication": rng.choice(medications),
+             "is_first_dose": rng.random() < 0.5,
+             "allergies": rng.choice([[], ["sulfa"], ["iodine", "latex"]])}
+            for i in range(count)]
+
+def test_round_trip():
+    batch = PatientBatch.from_dicts(PATIENTS, Vocabulary())
+    assert len(batch) == len(PATIENTS)
+    assert batch.to_dicts() == PATIENTS
+    assert [dict(record) for record in batch] == PATIENTS
+    assert batch.take([4, 0]).to_dicts() == [PATIENTS[4], PATIENTS[0]]
+    assert batch[-1]["notes"] == {"ward": 3}
+
+def test_odd_values_become_exceptions():
+    batch = PatientBatch.from_dicts(PATIENTS, Vocabulary())
+    assert batch.codes("gender")[4] == MISSING_CODE
+    assert "gender" not in batch[4]
+    values, complete = batch.floats("weight")
+    assert complete and list(values) == [80.0, 80.0, 60.0, 72.5, 55.0]
+    assert isinstance(batch.get("weight", 2), int)
+
+    unhashable = PatientBatch.from_dicts([{"age": {"years": 3}, "weight": "heavy"}], Vocabulary())
+    assert unhashable.codes("age")[0] == EXCEPTION_CODE
+    assert unhashable.floats("weight")[1] is False
+    assert unhashable.to_dicts() == [{"age": {"years": 3}, "weight": "heavy"}]
+
+def test_shared_vocabulary():
+    vocabulary = Vocabulary()
+    first = PatientBatch.from_dicts(PATIENTS[:2], vocabulary)
+    second = PatientBatch.from_dicts(PATIENTS[2:], vocabulary)
+    flu = vocabulary.lookup("flu")
+    assert first.codes("diagnosis")[0] == second.codes("diagnosis")[-1] == flu
+    # Equal lists share a code but decode to independent lists
+    assert first.codes("allergies")[0] == first.codes("allergies")[1]
+    first[0]["allergies"].append("latex")
+    assert first[1]["allergies"] == ["sulfa"]
+    with pytest.raises(KeyError):
+        first.codes("weight")
+
+def test_late_fields_are_flagged_absent():
+    rows = [{"diagnosis": "flu"}] * 10_000 + [{"name": "late", "weight": 1.5},
+                                              {"name": 7, "weight": "x"}]
+    batch = PatientBatch.from_dicts(rows, Vocabulary())
+    assert batch.to_dicts() == rows
+    assert batch.take([0, 10_000, 10_001]).to_dicts() == [rows[0], rows[10_000], rows[10_001]]
+    assert batch.copy().to_dicts() == rows
+    for field in ("name", "weight"):
+        assert len(batch._columns[field].exceptions) == 1
+    assert batch.floats("weight")[1] is False
+    complete = PatientBatch.from_dicts(rows[10_000:10_001], Vocabulary())
+    assert complete.floats("weight")[1] is True
+
+def test_vocabulary_scope_and_reset():
+    shared = patient_records.SHARED_VOCABULARY
+    outside = PatientBatch.from_dicts(PATIENTS[:1])
+    with vocabulary_scope() as scoped:
+        inside = PatientBatch.from_dicts(PATIENTS)
+        assert inside.vocabulary is scoped is not shared
+        assert scoped.lookup("hypertension") is not None
+    assert patient_records.SHARED_VOCABULARY is shared
+    assert outside.vocabulary is shared and inside.to_dicts() == PATIENTS
+
+    try:
+        assert reset_shared_vocabulary() is shared
+        fresh = PatientBatch.from_dicts(PATIENTS[:1]).vocabulary
+        assert fresh is not shared and fresh.lookup("asthma") is None
+        assert outside.to_dicts() == PATIENTS[:1]
+    finally:
+        patient_records.SHARED_VOCABULARY = shared
+
+def test_patient_record_mapping():
+    record = PatientRecord(PATIENTS[4])
+    assert dict(record) == PATIENTS[4]
+    assert list(record)[:2] == ["name", "age"]
+    assert record.get("gender") is None and "gender" not in record
+    record["gender"] = "female"
+    del record["notes"]
+    assert record.to_dict() == {**{k: v for k, v in PATIENTS[4].items() if k != "notes"},
+                                "gender": "female"}
+    copy = record.copy()
+    copy["age"] = "50"
+    assert isinstance(copy, PatientRecord) and record["age"] == "abc"
+    with pytest.raises(KeyError):
+        del record["notes"]
+    with pytest.raises(AttributeError):
+        record.unknown = 1
+
+@pytest.mark.parametrize("engine", ["dict", "polars"])
+def test_clean_batch(cleaner, engine):
+    expected = cleaner.clean_patient_data(PATIENTS, engine=engine)
+    cleaned = cleaner.clean_patient_data(PatientBatch.from_dicts(PATIENTS), engine=engine)
+    assert isinstance(cleaned, PatientBatch)
+    assert cleaned.to_dicts() == expected
+
+@pytest.mark.parametrize("engine", ["dict", "numpy"])
+@pytest.mark.parametrize("cache_size", [0, 16])
+def test_dose_batch(dosage, engine, cache_size):
+    orders = random_orders(500) + PATIENTS
+    cache = dosage.DosageCache(cache_size) if cache_size else None
+    expected, expected_total = dosage.calculate_all_dosages(orders)
+    batch = PatientBatch.from_dicts(orders)
+    dosed, total = dosage.calculate_all_dosages(batch, engine, cache)
+    assert isinstance(dosed, PatientBatch)
+    assert dosed.to_dicts() == expected
+    assert total == pytest.approx(expected_total, rel=1e-12)
+    assert batch.to_dicts() == orders
+
+def test_dose_batch_falls_back_per_record(dosage):
+    orders = [{"name": "a", "weight": "70", "medication": "epinephrine"},
+              {"name": "b", "weight": 60.0, "medication": "amiodarone", "is_first_dose": 1}]
+    expected, _ = dosage.calculate_all_dosages(orders)
+    assert dosage.calculate_all_dosages(PatientBatch.from_dicts(orders))[0].to_dicts() == expected
+
+    with pytest.raises(ValueError, match="missing 'weight'"):
+        dosage.calculate_all_dosages(PatientBatch.from_dicts([{"name": "a",
+                                                              "medication": "epinephrine"}]))
+    empty, total = dosage.calculate_all_dosages(PatientBatch(), "numpy")
+    assert len(empty) == 0 and total == 0
+
+def test_clean_then_dose_batch(cleaner, dosage):
+    expected, _ = dosage.calculate_all_dosages(cleaner.clean_patient_data(PATIENTS))
+    dosed, _ = dosage.calculate_all_dosages(
+        cleaner.clean_patient_data(PatientBatch.from_dicts(PATIENTS)), "numpy")
+    assert dosed.to_dicts() == expected
+
+def test_memory_per_record(dosage):
+    dosed, _ = dosage.calculate_all_dosages(PatientBatch.from_dicts(random_orders(5000)),
+                                            "numpy")
+
+    # Footprint of the same records as dictionaries, strings included
+    tracemalloc.start()
+    try:
+        dictionaries, _ = dosage.calculate_all_dosages(random_orders(5000))
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert dictionaries == dosed.to_dicts()
+    assert dosed.nbytes() * 8 <= dict_bytes
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for sharded, multi-process cleaning in patient_data_cleaner.py
+
+This script tests that:
+1. Directories and globs expand to a sorted list of shards
+2. Merged output is deterministic and de-duplicated across shards
+3. A failing or crashing shard does not lose the other shards' records
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from conftest import load_script
+
+def write_shards(directory, count=4, size=20):
+    """Write overlapping JSONL shards; neighbouring shards share 15 patients."""
+    for k in range(count):
+        records = [{"name": f"patient {i}", "age": str(10 + i % 40), "gender": "f",
+                    "diagnosis": "flu"} for i in range(k * 5, k * 5 + size)]
+        (directory / f"shard_{k}.jsonl").write_text("\n".join(json.dumps(r) for r in records))
+
+_original_clean_shard = load_script("1_patient_data_cleaner.py")._clean_shard
+
+def crashing_clean_shard(shard_path, spill_path, engine):
+    """Kill the worker process outright for shards named 'crash'; delay 'slow' ones."""
+    if "crash" in os.path.basename(shard_path):
+        os._exit(1)
+    if "slow" in os.path.basename(shard_path):
+        time.sleep(1)
+    return _original_clean_shard(shard_path, spill_path, engine)
+
+def test_expand_shards(cleaner, tmp_path):
+    write_shards(tmp_path)
+    (tmp_path / "notes.txt").write_text("ignore me")
+    expected = [str(tmp_path / f"shard_{k}.jsonl") for k in range(4)]
+    assert cleaner.expand_shards(str(tmp_path)) == expected
+    assert cleaner.expand_shards(str(tmp_path / "shard_*.jsonl")) == expected
+    assert cleaner.expand_shards("single.json") == ["single.json"]
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_sharded_matches_single_pass(cleaner, tmp_path, workers):
+    """Sharded output equals cleaning the concatenated shards in order."""
+    write_shards(tmp_path)
+    shards = cleaner.expand_shards(str(tmp_path))
+    everything = [r for shard in shards for r in cleaner.iter_patient_records(shard)]
+
+    stats = []
+    merged = list(cleaner.iter_clean_shards(shards, workers=workers, shard_stats=stats))
+    assert merged == cleaner.clean_patient_data(everything)
+    assert [s["shard"] for s in stats] == shards
+    assert sum(s["records_read"] for s in stats) == len(everything)
+
+def test_failed_shard_keeps_others(cleaner, tmp_path):
+    """A malformed shard is reported; the other shards are still merged."""
+    write_shards(tmp_path, count=2)
+    (tmp_path / "shard_1a.json").write_text('[{"name": ')
+    stats = []
+    merged = list(cleaner.iter_clean_shards(cleaner.expand_shards(str(tmp_path)),
+                                            workers=2, shard_stats=stats))
+    assert [s["status"] for s in stats] == ["ok", "ok", "failed"]
+    assert len(merged) > 0
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="patched worker function must be inherited by fork")
+def test_worker_crash_keeps_others(cleaner, tmp_path, monkeypatch):
+    """A worker that dies takes down only its own shard."""
+    write_shards(tmp_path, count=3)
+    (tmp_path / "shard_1_crash.jsonl").write_text('{"name": "x", "age": "40"}')
+    shards = cleaner.expand_shards(str(tmp_path))
+    expected = list(cleaner.iter_clean_shards([s for s in shards if "crash" not in os.path.basename(s)], workers=2))
+
+    monkeypatch.setattr(cleaner, "_clean_shard", crashing_clean_shard)
+    stats = []
+    merged = list(cleaner.iter_clean_shards(shards, workers=2, shard_stats=stats, max_retries=1))
+    assert merged == expected
+    assert [s["status"] for s in stats] == ["ok", "ok", "failed", "ok"]
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="patched worker function must be inherited by fork")
+def test_crash_is_charged_to_the_crashing_shard(cleaner, tmp_path, monkeypatch):
+    """A shard still running when another shard kills the pool is not charged."""
+    (tmp_path / "a_slow.jsonl").write_text('{"name": "ann", "age": "40"}')
+    (tmp_path / "b_crash.jsonl").write_text('{"name": "bob", "age": "50"}')
+    (tmp_path / "c.jsonl").write_text('{"name": "cy", "age": "60"}')
+    monkeypatch.setattr(cleaner, "_clean_shard", crashing_clean_shard)
+    stats = []
+    merged = list(cleaner.iter_clean_shards(cleaner.expand_shards(str(tmp_path)), workers=3,
+                                            shard_stats=stats, max_retries=2))
+    assert [s["status"] for s in stats] == ["ok", "failed", "ok"]
+    assert [p["name"] for p in merged] == ["Ann", "Cy"]
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="patched worker function must be inherited by fork")
+def test_only_the_crashed_shard_runs_alone(cleaner, tmp_path, monkeypatch):
+    """After a crash the other shards share one new pool instead of one pool each."""
+    (tmp_path / "a_crash.jsonl").write_text('{"name": "al", "age": "40"}')
+    for name in "bcdef":
+        (tmp_path / f"{name}.jsonl").write_text(json.dumps({"name": name, "age": "50"}))
+    pools = []
+    executor = cleaner.ProcessPoolExecutor
+
+    def recording_executor(max_workers):
+        pools.append(max_workers)
+        return executor(max_workers=max_workers)
+
+    monkeypatch.setattr(cleaner, "_clean_shard", crashing_clean_shard)
+    monkeypatch.setattr(cleaner, "ProcessPoolExecutor", recording_executor)
+    stats = []
+    merged = list(cleaner.iter_clean_shards(cleaner.expand_shards(str(tmp_path)), workers=2,
+                                            shard_stats=stats, max_retries=1))
+    assert [s["status"] for s in stats] == ["failed"] + ["ok"] * 5
+    assert [p["name"] for p in merged] == list("BCDEF")
+    # The first pool and its replacement, plus two runs of the crashing shard alone
+    assert pools == [2, 2, 1, 1]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming mode of patient_data_cleaner.py
+
+This script tests that:
+1. JSON arrays and JSON Lines files are parsed one record at a time
+2. Streaming cleaning produces the same records as clean_patient_data
+3. The streaming writer round-trips both output formats
+4. Malformed arrays are reported without buffering the rest of the input
+"""
+
+import io
+import json
+import pytest
+
+PATIENTS = [
+    {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "hypertension"},
+    {"name": "sarah johnson", "age": "17", "gender": "female", "diagnosis": "influenza"},
+    {"name": "robert williams", "age": "45", "gender": "male", "diagnosis": "diabetes"},
+    {"name": "JOHN SMITH", "age": 32, "gender": "male", "diagnosis": "hypertension"},
+    {"name": "no age", "age": "unknown", "gender": "female", "diagnosis": "flu"},
+    {"name": "ana lópez", "age": "61", "gender": "female", "diagnosis": "asthma, mild [chronic]"},
+]
+
+def test_clean_patient_data(cleaner):
+    """Cleaning rules: titles, integer ages, 18+ only, no duplicates."""
+    cleaned = cleaner.clean_patient_data(PATIENTS)
+    assert [p["name"] for p in cleaned] == ["John Smith", "Robert Williams", "Ana López"]
+    assert all(isinstance(p["age"], int) and p["age"] >= 18 for p in cleaned)
+    assert cleaner.clean_patient_data([]) == []
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_json_array(cleaner, tmp_path, chunk_size):
+    """Incremental parsing matches json.load for any chunk size."""
+    path = tmp_path / "patients.json"
+    path.write_text(json.dumps(PATIENTS, indent=4))
+    assert list(cleaner.iter_patient_records(str(path), chunk_size=chunk_size)) == PATIENTS
+
+def test_iter_json_lines(cleaner, tmp_path):
+    """JSON Lines input is detected and blank lines are skipped."""
+    path = tmp_path / "patients.jsonl"
+    path.write_text("\n".join(json.dumps(p) for p in PATIENTS) + "\n\n")
+    assert list(cleaner.iter_patient_records(str(path))) == PATIENTS
+
+def test_empty_and_malformed_arrays(cleaner, tmp_path):
+    """Empty arrays yield nothing; truncated arrays raise."""
+    empty = tmp_path / "empty.json"
+    empty.write_text("  [ ]  ")
+    assert list(cleaner.iter_patient_records(str(empty))) == []
+
+    truncated = tmp_path / "truncated.json"
+    truncated.write_text(json.dumps(PATIENTS)[:-20])
+    with pytest.raises(ValueError):
+        list(cleaner.iter_patient_records(str(truncated), chunk_size=16))
+
+@pytest.mark.parametrize("chunk_size", range(1, 13))
+def test_tokens_split_across_chunks(cleaner, tmp_path, chunk_size):
+    """Values cut off at a chunk boundary are completed, not reported as errors."""
+    records = [{"w": -float("inf"), "x": 1.5e-07, "ok": True, "no": False, "n": None,
+                "s": "\u00e9\\\"", "t": "x" * 40}, float("nan")]
+    path = tmp_path / "tokens.json"
+    path.write_text(json.dumps(records))
+    parsed = list(cleaner.iter_patient_records(str(path), chunk_size=chunk_size))
+    assert json.dumps(parsed) == json.dumps(records)
+
+def test_malformed_element_fails_fast(cleaner):
+    """A syntax error is raised without reading the rest of the file."""
+    class CountingReader(io.StringIO):
+        chars = 0
+        def read(self, size=-1):
+            chunk = super().read(size)
+            self.chars += len(chunk)
+            return chunk
+
+    file = CountingReader('[{"name": "a",, "age": 30}, ' + json.dumps(PATIENTS * 2000)[1:])
+    with pytest.raises(json.JSONDecodeError):
+        list(cleaner._iter_json_array(file, 64))
+    assert file.chars <= 128
+
+def test_streaming_matches_batch(cleaner):
+    """The generator yields exactly what clean_patient_data returns."""
+    streamed = list(cleaner.iter_clean_patients(iter(PATIENTS)))
+    assert streamed == cleaner.clean_patient_data(PATIENTS)
+
+@pytest.mark.parametrize("filename", ["cleaned.json", "cleaned.jsonl"])
+def test_write_patient_stream_round_trip(cleaner, tmp_path, filename):
+    """Written files can be read back by both loaders."""
+    path = str(tmp_path / filename)
+    expected = cleaner.clean_patient_data(PATIENTS)
+    count = cleaner.write_patient_stream(cleaner.iter_clean_patients(PATIENTS), path)
+    assert count == len(expected)
+    assert list(cleaner.iter_patient_records(path)) == expected
+    assert cleaner.load_patient_data(path) == expected
+
+def test_input_not_mutated(cleaner):
+    """Cleaning returns new dicts and leaves the input untouched."""
+    original = [dict(p) for p in PATIENTS]
+    cleaner.clean_patient_data(PATIENTS)
+    assert PATIENTS == original
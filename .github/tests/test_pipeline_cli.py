@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the unified pipeline command line (pipeline/cli.py)
+
+This script tests that:
+1. Chained clean -> dose output matches running the scripts' functions
+2. Record commands write JSON Lines to standard output without -o
+3. cohort and generate run with explicit input and output paths
+4. Only record commands can be chained
+5. Record commands start without importing Polars, NumPy or pandas
+"""
+
+import json
+import subprocess
+import sys
+
+import polars as pl
+import pytest
+
+from conftest import PROJECT_ROOT
+from pipeline import cli
+
+ORDERS = [
+    {"name": "john smith", "age": "32", "weight": 80.0, "medication": "epinephrine",
+     "is_first_dose": False},
+    {"name": "john smith", "age": "32", "weight": 80.0, "medication": "epinephrine",
+     "is_first_dose": False},
+    {"name": "sarah johnson", "age": "17", "weight": 60.0, "medication": "amiodarone",
+     "is_first_dose": True},
+    {"name": "ana lopez", "age": "45", "weight": 60.0, "medication": "amiodarone",
+     "is_first_dose": True},
+]
+
+@pytest.fixture
+def orders_json(tmp_path):
+    path = tmp_path / "orders.json"
+    path.write_text(json.dumps(ORDERS))
+    return path
+
+@pytest.mark.parametrize("engine", ['dict', 'numpy'])
+def test_clean_then_dose(tmp_path, orders_json, cleaner, dosage, engine):
+    output = tmp_path / "doses.json"
+    assert cli.main(['clean', str(orders_json), 'then', 'dose', '--engine', engine,
+                     '-o', str(output)]) == 0
+
+    expected, _ = dosage.calculate_all_dosages(cleaner.clean_patient_data(ORDERS))
+    assert json.loads(output.read_text()) == expected
+    assert [row['name'] for row in expected] == ["John Smith", "Ana Lopez"]
+
+def test_record_command_writes_json_lines_to_stdout(orders_json, capsys, cleaner):
+    assert cli.main(['clean', str(orders_json)]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == cleaner.clean_patient_data(ORDERS)
+
+def test_record_command_reports_bad_input(tmp_path, orders_json, capsys):
+    assert cli.main(['dose', str(tmp_path / "missing.json")]) == 1
+    assert "Error:" in capsys.readouterr().err
+
+def test_cohort_output(tmp_path, patients_csv, cohort):
+    output = tmp_path / "cohorts.parquet"
+    cache_dir = str(tmp_path / "cache")
+    assert cli.main(['cohort', str(patients_csv), '--cache-dir', cache_dir,
+                     '-o', str(output)]) == 0
+    expected = cohort.analyze_patient_cohorts(str(patients_csv), cache_dir)
+    assert pl.read_parquet(output).equals(expected)
+
+def test_generate(tmp_path):
+    output = tmp_path / "patients.csv"
+    assert cli.main(['generate', '--rows', '100', '--workers', '1', '-o', str(output)]) == 0
+    assert pl.read_csv(output).height == 100
+
+@pytest.mark.parametrize("argv", [
+    ['cohort', 'patients.csv', 'then', 'dose'],
+    ['clean', 'patients.json', 'then'],
+    ['clean', 'patients.json', '-o', 'out.json', 'then', 'dose'],
+    ['clean', 'patients.json', 'then', 'dose', 'orders.json'],
+    ['dose', 'orders.json', '--engine', 'numpy', '--cache-size', '64'],
+])
+def test_invalid_chains(argv):
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(argv)
+    assert excinfo.value.code == 2
+
+def test_record_commands_skip_heavy_imports(tmp_path, orders_json):
+    output = tmp_path / "doses.jsonl"
+    code = (
+        "import sys\n"
+        "from pipeline.cli import main\n"
+        f"assert main(['clean', {str(orders_json)!r}, 'then', 'dose', "
+        f"'-o', {str(output)!r}]) == 0\n"
+        "heavy = {'polars', 'numpy', 'pandas'} & set(sys.modules)\n"
+        "assert not heavy, heavy\n"
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, check=True,
+                   capture_output=True)
+    assert len(output.read_text().splitlines()) == 2
+
+def test_module_entry_point_help():
+    result = subprocess.run([sys.executable, '-m', 'pipeline', '--help'], cwd=PROJECT_ROOT,
+                            capture_output=True, text=True, check=True)
+    for command in cli.COMMANDS:
+        assert command in result.stdout
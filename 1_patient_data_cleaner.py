@@ -21,6 +21,9 @@ Input JSON format:
         ...
     ]
 
+    JSON Lines input (one patient object per line, ``.jsonl``) is also
+    accepted in streaming mode.
+
 Output:
 - Cleaned list of patient dictionaries
 - Each patient should have:
@@ -34,28 +37,568 @@ Example:
     Input: {"name": "john smith", "age": "32", "gender": "male", "diagnosis": "flu"}
     Output: {"name": "John Smith", "age": 32, "gender": "male", "diagnosis": "flu"}
 
+Engines:
+    The default 'dict' engine applies the rules record by record. The 'polars'
+    engine applies the same rules as vectorized expressions over a lazy frame
+    and returns identical records, which is much faster on large batches.
+
+Sharded Mode:
+    When the input is a directory or glob of JSON/JSONL shards, the shards are
+    cleaned in parallel by a process pool and merged in sorted shard order with
+    a global duplicate check, so output is deterministic. A shard whose worker
+    crashes is reported as failed without losing the other shards' records.
+
+Streaming Mode:
+    Large exports can be cleaned one record at a time, so parsing, cleaning
+    and writing use flat memory regardless of input size. Records are parsed
+    incrementally, cleaned through a generator and written back out as they
+    are produced. The duplicate check is the exception: its in-memory index
+    grows with the number of distinct records (choose the disk-backed or
+    Bloom filter mode to bound it).
+
+Compact Batches:
+    clean_patient_data also accepts a PatientBatch (patient_records.py), a
+    columnar batch with dictionary-encoded categorical fields, and returns
+    the cleaned records as a PatientBatch sharing its vocabulary. Records are
+    converted one at a time on the way through, never as a whole list.
+
+Arrow Interchange:
+    Input and output files with an Arrow IPC extension (.arrow, .feather,
+    .ipc) are read and written with patient_arrow.py: output is written one
+    record batch at a time, and input is memory-mapped and read batch by
+    batch without parsing, so a downstream stage (e.g. the dosage calculator)
+    picks up cleaned records without another JSON round trip.
+
+Bulk Coercion:
+    With --coerce (or --quarantine PATH), ages and weights are first parsed a
+    whole batch at a time by patient_coercion.py: strings such as "32.0",
+    " 45 " and "45 yrs" become integer ages, "154 lbs" becomes a weight in
+    kilograms, and values that are empty, unparseable, in an unknown unit or
+    out of range are rejected instead of being set to 0. Rejected records are
+    dropped and, with --quarantine, appended to a JSON Lines file with a
+    reason code; counts per field and reason are printed after cleaning.
+    Coercion is not available for sharded input.
+
 Usage:
     python patient_data_cleaner.py
+    python patient_data_cleaner.py patients.json --stream --output cleaned.jsonl
+    python patient_data_cleaner.py patients.json --engine polars
+    python patient_data_cleaner.py "exports/*.jsonl" --workers 32 -o cleaned.jsonl
+    python patient_data_cleaner.py patients.json --stream -o cleaned.arrow
+    python patient_data_cleaner.py feed.jsonl --stream --quarantine rejected.jsonl -o cleaned.jsonl
 """
 
+import argparse
+import contextlib
+import glob
+import itertools
 import json
+import operator
 import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import instrumentation
+import patient_coercion
+from patient_dedup import (DEDUP_MODES, KEY_FIELDS, PatientDeduplicator, normalize_field,
+                           patient_fingerprint)
+from patient_records import PatientBatch
+
+# Minimum age (inclusive) for a patient to be kept
+MIN_AGE = 18
+
+# Number of characters read per step when streaming a JSON array
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# A JSON syntax error this close to the end of the streaming buffer may just
+# be a token cut off by the chunk boundary (the longest is '-Infinity')
+_JSON_TRUNCATION_MARGIN = 16
+
+# File extensions treated as JSON Lines (one record per line)
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+# File extensions treated as Arrow IPC (see patient_arrow.py)
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Formats accepted by write_patient_stream
+OUTPUT_FORMATS = ('json', 'jsonl', 'arrow')
+
+# Available cleaning engines: per-record Python loop or vectorized Polars
+CLEANING_ENGINES = ('dict', 'polars')
+
+# Records per Polars batch when the polars engine is used in streaming mode
+POLARS_BATCH_SIZE = 100_000
+
+# Range of Polars Int64 columns
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+
+# ASCII characters str.split() and int() treat as whitespace
+_ASCII_SPACE = '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+
+# Text the polars engine handles with expressions (see _clean_batch_polars)
+_ASCII_TEXT = r'^[\x00-\x7f]*$'
+_PLAIN_INTEGER = r'^[\t\n\x0b\x0c\r\x1c-\x1f ]*[+-]?[0-9]{1,18}[\t\n\x0b\x0c\r\x1c-\x1f ]*$'
+
+def _infer_format(filepath):
+    """Return 'jsonl' or 'arrow' for those file extensions, otherwise 'json'."""
+    if filepath.lower().endswith(ARROW_EXTENSIONS):
+        return 'arrow'
+    return 'jsonl' if filepath.lower().endswith(JSONL_EXTENSIONS) else 'json'
 
 def load_patient_data(filepath):
     """
     Load patient data from a JSON file.
     
     Args:
-        filepath (str): Path to the JSON file
+        filepath (str): Path to the JSON (or ``.jsonl`` JSON Lines, or
+            ``.arrow`` Arrow IPC) file
         
     Returns:
         list: List of patient dictionaries
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        json.JSONDecodeError: If the file is not valid JSON
     """
     # BUG: No error handling for file not found
+    # FIX: Errors are raised to the caller and reported in main()
+    with instrumentation.stage('load') as stage, open(filepath, 'r') as file:
+        fmt = _infer_format(filepath)
+        if fmt == 'arrow':
+            from patient_arrow import iter_arrow_patients
+            patients = list(iter_arrow_patients(filepath))
+        elif fmt == 'jsonl':
+            patients = list(_iter_json_lines(file))
+        else:
+            patients = json.load(file)
+        stage.records = len(patients)
+        stage.bytes = os.fstat(file.fileno()).st_size
+    return patients
+
+def _iter_json_array(file, chunk_size):
+    """
+    Incrementally parse a JSON array, yielding one element at a time.
+
+    Only the current element plus one chunk of look-ahead is held in memory.
+    Malformed input is reported as soon as the error is read, not after
+    buffering the rest of the file: more input is only read when the error
+    could be a value cut off by the chunk boundary.
+
+    Args:
+        file: Open text file positioned at the start of the array
+        chunk_size (int): Number of characters to read per step
+
+    Yields:
+        object: Each decoded array element
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def read_more():
+        # Drop the consumed prefix and append the next chunk
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def peek():
+        # Skip whitespace and return the next character ("" at end of input)
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                return ""
+            read_more()
+
+    if peek() != "[":
+        raise ValueError("Expected a JSON array of patient records")
+    pos += 1
+    if peek() == "]":
+        return
+
+    while True:
+        # raw_decode does not skip leading whitespace itself
+        peek()
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as error:
+            # An unterminated string may just be missing its closing quote's chunk
+            truncated = (error.pos >= len(buffer) - _JSON_TRUNCATION_MARGIN
+                         or error.msg.startswith('Unterminated string'))
+            if eof or not truncated:
+                raise
+            read_more()
+            continue
+        # A value ending exactly at the buffer edge may be truncated (e.g. numbers)
+        if end == len(buffer) and not eof:
+            read_more()
+            continue
+
+        pos = end
+        yield record
+
+        separator = peek()
+        if separator == ",":
+            pos += 1
+        elif separator == "]":
+            return
+        else:
+            raise ValueError(f"Malformed JSON array: unexpected {separator!r} after record")
+
+def _iter_json_lines(file):
+    """
+    Parse a JSON Lines file, yielding one record per non-blank line.
+
+    Args:
+        file: Open text file
+
+    Yields:
+        object: Each decoded record
+    """
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def iter_patient_records(filepath, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Stream patient records from a JSON array or JSON Lines file.
+
+    The format is detected from the first non-whitespace character, so both
+    ``[{...}, {...}]`` and one-object-per-line files are accepted. Arrow IPC
+    files (by extension) are memory-mapped and read one batch at a time.
+
+    Args:
+        filepath (str): Path to the JSON, JSON Lines or Arrow IPC file
+        chunk_size (int): Number of characters read per step for JSON arrays
+
+    Yields:
+        dict: Patient dictionaries in file order
+    """
+    if _infer_format(filepath) == 'arrow':
+        from patient_arrow import iter_arrow_patients
+        yield from iter_arrow_patients(filepath)
+        return
+
     with open(filepath, 'r') as file:
-        return json.load(file)
+        first = file.read(1)
+        while first and first.isspace():
+            first = file.read(1)
+        file.seek(0)
 
-def clean_patient_data(patients):
+        if first == "[":
+            yield from _iter_json_array(file, chunk_size)
+        else:
+            yield from _iter_json_lines(file)
+
+def _parse_age(value):
+    """Convert an age with int(), using 0 if it is invalid."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def clean_patient_record(patient):
+    """
+    Apply the cleaning rules to a single patient record.
+
+    Args:
+        patient (dict): Raw patient dictionary
+
+    Returns:
+        dict or None: Cleaned copy of the patient, or None if under 18
+    """
+    cleaned = dict(patient)
+
+    # BUG: Typo in key 'nage' instead of 'name'
+    # FIX: Write the capitalized name back to 'name'
+    name = patient.get('name')
+    cleaned['name'] = '' if name is None else str(name).title()
+
+    # BUG: Wrong method name (fill_na vs fillna)
+    # FIX: Plain dicts have no fillna; convert with int() and use 0 if invalid
+    cleaned['age'] = _parse_age(patient.get('age'))
+
+    # BUG: Wrong comparison operator (= vs ==)
+    # BUG: Logic error - keeps patients under 18 instead of filtering them out
+    # FIX: Keep only patients whose age is at least 18
+    if cleaned['age'] < MIN_AGE:
+        return None
+
+    return cleaned
+
+def _strict_series(name, values):
+    """
+    The values as a Polars series that keeps their Python types, or None.
+
+    None is returned when the values mix types (e.g. ints and strings) and
+    Polars would have to convert some of them.
+    """
+    import polars as pl
+
+    try:
+        return pl.Series(name, values, strict=True)
+    except (TypeError, OverflowError, pl.exceptions.PolarsError):
+        return None
+
+def _fill_rows(series, rows, values, convert):
+    """Set the given rows of a series to convert(values[row])."""
+    if not rows:
+        return series
+    return series.scatter(rows, [convert(values[row]) for row in rows])
+
+def _title_names(names, values):
+    """
+    Title-case a name column as clean_patient_record does.
+
+    ASCII names use str.to_titlecase (identical to str.title() for ASCII);
+    other names go through str.title().
+    """
+    import polars as pl
+
+    if names is None or names.dtype not in (pl.String, pl.Null):
+        return pl.Series('name', [_title_name(value) for value in values], dtype=pl.String)
+    if names.dtype == pl.Null:
+        return pl.Series('name', [''] * len(names), dtype=pl.String)
+    name = pl.col('name')
+    titled = names.to_frame().select(
+        pl.when(name.is_null()).then(pl.lit(''))
+        .when(name.str.contains(_ASCII_TEXT)).then(name.str.to_titlecase())
+    ).to_series()
+    return _fill_rows(titled, titled.is_null().arg_true().to_list(), values, _title_name)
+
+def _parse_age_column(ages, values):
+    """
+    Parse an age column with int() semantics (invalid -> 0), as _parse_age.
+
+    Integers, booleans, finite floats and plain integer strings are cast by
+    Polars, and strings without any digit are 0; the remaining strings
+    ("1_000", "45.5", "45 yrs") and non-finite floats go through
+    _parse_age.
+
+    Returns:
+        Series or None: Int64 ages, or None if a parsed age does not fit
+        in 64 bits
+    """
+    import polars as pl
+
+    age = pl.col('age')
+    dtype = None if ages is None else ages.dtype
+    if dtype in (pl.Int64, pl.Boolean, pl.Null):
+        return ages.cast(pl.Int64).fill_null(0)
+    if dtype == pl.Float64:
+        parsed = ages.to_frame().select(
+            pl.when(age.is_null()).then(pl.lit(0))
+            .when(age.is_finite() & (age.abs() < 2.0 ** 63)).then(age.cast(pl.Int64))
+        ).to_series()
+    elif dtype == pl.String:
+        parsed = ages.to_frame().select(
+            pl.when(age.str.contains(_PLAIN_INTEGER))
+            .then(age.str.strip_chars(_ASCII_SPACE).str.to_integer(strict=False))
+            .when(age.is_null() | ~age.str.contains(r'\d')).then(pl.lit(0))
+        ).to_series()
+    else:
+        parsed = pl.Series('age', [None] * len(values), dtype=pl.Int64)
+    rows = parsed.is_null().arg_true().to_list()
+    fallback = [_parse_age(values[row]) for row in rows]
+    if any(not _INT64_MIN <= age <= _INT64_MAX for age in fallback):
+        return None
+    return parsed.scatter(rows, fallback) if rows else parsed
+
+def _normalized_keys(keys, values):
+    """
+    Normalize one key field the way patient_fingerprint does.
+
+    ASCII strings, integers and booleans are normalized by Polars
+    expressions; other values go through normalize_field.
+    """
+    import polars as pl
+
+    dtype = None if keys is None else keys.dtype
+    if dtype == pl.Null:
+        return pl.Series([''] * len(keys), dtype=pl.String)
+    if dtype in (pl.Int64, pl.Boolean):
+        return keys.cast(pl.String).str.to_lowercase().fill_null('')
+    if dtype != pl.String:
+        return pl.Series([normalize_field(value) for value in values], dtype=pl.String)
+    key = pl.col(keys.name)
+    normalized = keys.to_frame().select(
+        pl.when(key.is_null()).then(pl.lit(''))
+        .when(key.str.contains(_ASCII_TEXT))
+        .then(key.str.replace_all(f'[{_ASCII_SPACE}]+', ' ').str.strip_chars(' ')
+              .str.to_lowercase())
+    ).to_series()
+    return _fill_rows(normalized, normalized.is_null().arg_true().to_list(), values,
+                      normalize_field)
+
+def _title_name(name):
+    """The cleaned form of a name: title case, '' if missing."""
+    return '' if name is None else str(name).title()
+
+def _clean_batch_exact(patients):
+    """clean_patient_record plus in-batch fingerprint de-duplication."""
+    seen = set()
+    cleaned = []
+    for patient in patients:
+        record = clean_patient_record(patient)
+        if record is None:
+            continue
+        fingerprint = patient_fingerprint(record)
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            cleaned.append(record)
+    return cleaned
+
+def _clean_batch_polars(patients):
+    """
+    Apply the cleaning rules to a batch with vectorized Polars expressions.
+
+    Produces exactly the records, in the same order, that running
+    clean_patient_record over the batch and dropping repeated fingerprints
+    would. Each field is loaded into a Polars column that keeps its Python
+    types; names are title-cased, ages parsed (int() semantics), under-18
+    rows filtered out and duplicates removed with ``unique`` on the same
+    normalized key fields the fingerprint index uses, all as column
+    expressions. Only values whose Polars result could differ from Python's
+    (non-ASCII text, unusual age strings, columns of mixed types) are
+    converted in Python, row by row.
+
+    Records sharing the same fields with plain column types are returned
+    straight from the frame; otherwise the kept records are copied from the
+    input, so absent fields stay absent and values keep their types. A
+    batch with an age beyond 64 bits is cleaned record by record.
+
+    Args:
+        patients (list): List of raw patient dictionaries
+
+    Returns:
+        list: Cleaned, de-duplicated patient dictionaries
+    """
+    import polars as pl
+
+    if not patients:
+        return []
+
+    first = tuple(patients[0])
+    uniform = all(map(first.__eq__, map(tuple, patients)))
+    fields = list(first) if uniform else list(dict.fromkeys(
+        field for patient in patients for field in patient))
+    for field in ('name', 'age'):
+        if field not in fields:
+            fields.append(field)
+    values = {}
+    for field in dict.fromkeys([*fields, *KEY_FIELDS]):
+        if uniform and field in first:
+            values[field] = list(map(operator.itemgetter(field), patients))
+        else:
+            values[field] = [patient.get(field) for patient in patients]
+    columns = {field: _strict_series(field, column) for field, column in values.items()}
+
+    ages = _parse_age_column(columns['age'], values['age'])
+    if ages is None:
+        return _clean_batch_exact(patients)
+    columns['name'] = _title_names(columns['name'], values['name']).alias('name')
+    columns['age'] = ages.alias('age')
+    values['name'] = columns['name']
+
+    key_columns = [f'__key_{field}' for field in KEY_FIELDS]
+    keys = [_normalized_keys(columns[field], values[field]).alias(key)
+            for field, key in zip(KEY_FIELDS, key_columns)]
+
+    plain = (pl.String, pl.Int64, pl.Float64, pl.Boolean, pl.Null)
+    direct = uniform and all(columns[field] is not None and columns[field].dtype in plain
+                             for field in fields)
+    output = [columns[field] for field in fields] if direct else [
+        pl.Series('__row', range(len(patients)), dtype=pl.Int64), columns['name'], ages]
+    kept = (
+        pl.DataFrame([*output, *keys]).lazy()
+        .filter(pl.col('age') >= MIN_AGE)
+        .unique(subset=key_columns, keep='first', maintain_order=True)
+        .drop(key_columns)
+        .collect()
+    )
+    if direct:
+        return kept.to_dicts()
+
+    cleaned = []
+    for row, name, age in kept.iter_rows():
+        record = dict(patients[row])
+        record['name'] = name
+        record['age'] = age
+        cleaned.append(record)
+    return cleaned
+
+def _iter_batches(items, size):
+    """Yield lists of up to `size` items from an iterable."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def iter_clean_patients(patients, deduplicator=None, engine='dict',
+                        batch_size=POLARS_BATCH_SIZE, coercer=None):
+    """
+    Clean patient records lazily, yielding each kept record as it is produced.
+
+    Args:
+        patients (iterable): Iterable of raw patient dictionaries
+        deduplicator (PatientDeduplicator): Duplicate index to use; an
+            in-memory fingerprint set is created if omitted. Pass one in to
+            choose a disk-backed or Bloom filter mode, or to read its
+            statistics afterwards.
+        engine (str): 'dict' to clean record by record, or 'polars' to
+            clean batches of `batch_size` records with vectorized expressions
+        batch_size (int): Records per batch for the polars engine and the
+            coercer
+        coercer (ColumnCoercer): Optional bulk age/weight parser
+            (patient_coercion.py) applied before cleaning; the records it
+            rejects are quarantined instead of cleaned
+
+    Yields:
+        dict: Cleaned, de-duplicated patient dictionaries in input order
+
+    Records are held only while they are cleaned, but the default in-memory
+    deduplicator keeps one fingerprint per distinct record.
+    """
+    if engine not in CLEANING_ENGINES:
+        raise ValueError(f"Unknown cleaning engine {engine!r}; expected one of {CLEANING_ENGINES}")
+    if deduplicator is None:
+        deduplicator = PatientDeduplicator()
+    is_duplicate = instrumentation.timed_calls('dedup', deduplicator.is_duplicate)
+    if coercer is not None:
+        patients = coercer.iter_coerce(patients, batch_size)
+
+    if engine == 'polars':
+        # Each batch is de-duplicated by Polars; the index catches repeats across batches
+        for batch in _iter_batches(patients, batch_size):
+            for cleaned in _clean_batch_polars(batch):
+                if not is_duplicate(cleaned):
+                    yield cleaned
+        return
+
+    for patient in patients:
+        cleaned = clean_patient_record(patient)
+        if cleaned is None:
+            continue
+
+        # BUG: Wrong method name (drop_duplcates vs drop_duplicates)
+        # FIX: Dicts have no drop_duplicates; check a fingerprint index instead
+        if is_duplicate(cleaned):
+            continue
+
+        yield cleaned
+
+def clean_patient_data(patients, deduplicator=None, engine='dict', coercer=None):
     """
     Clean patient data by:
     - Capitalizing names
@@ -64,57 +607,408 @@ def clean_patient_data(patients):
     - Removing duplicates
     
     Args:
-        patients (list): List of patient dictionaries
+        patients (list or PatientBatch): Patient dictionaries or a batch
+        deduplicator (PatientDeduplicator): Optional duplicate index
+            (see iter_clean_patients)
+        engine (str): 'dict' (per-record loop) or 'polars' (vectorized);
+            both return identical records
+        coercer (ColumnCoercer): Optional bulk age/weight parser
+            (see iter_clean_patients)
         
     Returns:
-        list: Cleaned list of patient dictionaries
+        list or PatientBatch: Cleaned patients, as a PatientBatch (sharing
+        the input's vocabulary) if a batch was given
     """
-    cleaned_patients = []
-    
-    for patient in patients:
-        # BUG: Typo in key 'nage' instead of 'name'
-        patient['nage'] = patient['name'].title()
-        
-        # BUG: Wrong method name (fill_na vs fillna)
-        patient['age'] = patient['age'].fill_na(0)
-        
-        # BUG: Wrong method name (drop_duplcates vs drop_duplicates)
-        patient = patient.drop_duplcates()
-        
-        # BUG: Wrong comparison operator (= vs ==)
-        if patient['age'] = 18:
-            # BUG: Logic error - keeps patients under 18 instead of filtering them out
-            cleaned_patients.append(patient)
-    
-    # BUG: Missing return statement for empty list
-    if not cleaned_patients:
-        return None
-    
-    return cleaned_patients
+    batch = patients if isinstance(patients, PatientBatch) else None
+    if batch is not None:
+        patients = batch.dicts()
+    if coercer is not None:
+        patients = coercer.coerce(patients)
+    with instrumentation.stage('clean') as stage:
+        if engine == 'polars' and deduplicator is None:
+            cleaned = _clean_batch_polars(list(patients))
+        else:
+            cleaned = iter_clean_patients(patients, deduplicator, engine)
+        if batch is not None:
+            cleaned = PatientBatch.from_dicts(cleaned, batch.vocabulary)
+        else:
+            # BUG: Missing return statement for empty list
+            # FIX: Always return a list; an empty result is an empty list
+            cleaned = list(cleaned)
+        stage.records = len(cleaned)
+    return cleaned
 
-def main():
-    """Main function to run the script."""
-    # Get the directory of the current script
+def write_patient_stream(patients, filepath, fmt=None):
+    """
+    Write patient records to disk as they are produced.
+
+    Args:
+        patients (iterable): Iterable of patient dictionaries
+        filepath (str): Output path
+        fmt (str): 'json' for a JSON array, 'jsonl' for JSON Lines or
+            'arrow' for an Arrow IPC file (inferred from the file extension
+            when omitted)
+
+    Returns:
+        int: Number of records written
+    """
+    fmt = fmt or _infer_format(filepath)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    if fmt == 'arrow':
+        from patient_arrow import write_arrow_patients
+        return write_arrow_patients(patients, filepath)
+
+    with open(filepath, 'w') as file:
+        return write_patients(patients, file, fmt)
+
+def write_patients(patients, file, fmt='jsonl'):
+    """
+    Write patient records to an open text file as they are produced.
+
+    Args:
+        patients (iterable): Iterable of patient dictionaries
+        file (file): Writable text file, e.g. sys.stdout
+        fmt (str): 'json' for a JSON array or 'jsonl' for JSON Lines
+
+    Returns:
+        int: Number of records written
+    """
+    if fmt not in ('json', 'jsonl'):
+        raise ValueError(f"Unsupported format for a text stream: {fmt}")
+    count = 0
+    if fmt == 'jsonl':
+        for patient in patients:
+            file.write(json.dumps(patient))
+            file.write('\n')
+            count += 1
+    else:
+        file.write('[')
+        for patient in patients:
+            file.write(',\n    ' if count else '\n    ')
+            file.write(json.dumps(patient))
+            count += 1
+        file.write('\n]\n' if count else ']\n')
+    return count
+
+def expand_shards(spec):
+    """
+    Resolve an input argument to the list of shard files it names.
+
+    Args:
+        spec (str): A file, a directory of .json/.jsonl/.ndjson files, or a
+            glob pattern
+
+    Returns:
+        list: Sorted shard file paths (sorted so output order is stable)
+    """
+    if os.path.isdir(spec):
+        return sorted(os.path.join(spec, name) for name in os.listdir(spec)
+                      if name.lower().endswith(('.json',) + JSONL_EXTENSIONS))
+    if glob.has_magic(spec):
+        return sorted(path for path in glob.glob(spec) if os.path.isfile(path))
+    return [spec]
+
+def _clean_shard(shard_path, spill_path, engine):
+    """
+    Worker: clean one shard and spill the kept records to a JSON Lines file.
+
+    Duplicates are removed within the shard here; the parent removes
+    duplicates across shards when merging.
+
+    Returns:
+        dict: Per-shard statistics
+    """
+    start = time.perf_counter()
+    records_read = 0
+
+    def counted(records):
+        nonlocal records_read
+        for record in records:
+            records_read += 1
+            yield record
+
+    deduplicator = PatientDeduplicator()
+    cleaned = iter_clean_patients(counted(iter_patient_records(shard_path)), deduplicator, engine)
+    records_kept = write_patient_stream(cleaned, spill_path, 'jsonl')
+    duplicates = deduplicator.duplicates_dropped
+    return {
+        'shard': shard_path,
+        'status': 'ok',
+        'records_read': records_read,
+        'records_kept': records_kept,
+        'under_age': records_read - records_kept - duplicates,
+        'shard_duplicates': duplicates,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+def iter_clean_shards(shard_paths, engine='dict', workers=None, deduplicator=None,
+                      shard_stats=None, max_retries=2):
+    """
+    Clean shards in parallel and yield the merged, globally de-duplicated records.
+
+    Shards are cleaned by a process pool; each worker spills its shard's
+    records to a temporary file. Records are yielded in shard order (then
+    file order), so the output is the same for any worker count. If a
+    worker process dies, the pool cannot tell which shard killed it: the
+    shard being merged is rerun in a single-worker pool of its own without
+    being charged a retry, and the other unfinished shards are resubmitted
+    to one new pool. A shard whose own worker dies is retried up to
+    `max_retries` times and then reported as failed, as is a shard that
+    raises; the other shards are unaffected.
+
+    Args:
+        shard_paths (list): Shard files, in output order
+        engine (str): Cleaning engine used by the workers
+        workers (int): Number of worker processes (default: CPU count)
+        deduplicator (PatientDeduplicator): Global cross-shard index
+        shard_stats (list): If given, per-shard statistics dicts are
+            appended to it as each shard is merged
+        max_retries (int): Retries allowed per shard after its own worker crashes
+
+    Yields:
+        dict: Cleaned patient dictionaries
+    """
+    if deduplicator is None:
+        deduplicator = PatientDeduplicator()
+    if shard_stats is None:
+        shard_stats = []
+
+    spill_dir = tempfile.mkdtemp(prefix='patient_shards_')
+    spill_paths = [os.path.join(spill_dir, f'{i:06d}.jsonl') for i in range(len(shard_paths))]
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers)
+    isolated = {}  # shard index -> single-worker pool running it after a pool crash
+    try:
+        futures = [pool.submit(_clean_shard, path, spill, engine)
+                   for path, spill in zip(shard_paths, spill_paths)]
+        retries = [0] * len(shard_paths)
+
+        def run_isolated(j):
+            isolated[j] = ProcessPoolExecutor(max_workers=1)
+            futures[j] = isolated[j].submit(_clean_shard, shard_paths[j], spill_paths[j], engine)
+
+        for i, shard_path in enumerate(shard_paths):
+            while True:
+                try:
+                    stats = futures[i].result()
+                    break
+                except BrokenProcessPool as e:
+                    if i in isolated:
+                        # The shard's own worker died, so the shard crashed it
+                        isolated.pop(i).shutdown(wait=False)
+                        retries[i] += 1
+                        if retries[i] > max_retries:
+                            stats = {'shard': shard_path, 'status': 'failed',
+                                     'error': f"worker crashed: {e}"}
+                            break
+                        run_isolated(i)
+                        continue
+                    # The shared pool is unusable and any of its unfinished shards may
+                    # have crashed it: rerun this one alone, uncharged, and the rest in a
+                    # new shared pool (a crash there isolates the next shard in turn)
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                    for j in range(i + 1, len(shard_paths)):
+                        if _needs_rerun(futures[j]):
+                            futures[j] = pool.submit(_clean_shard, shard_paths[j],
+                                                     spill_paths[j], engine)
+                    run_isolated(i)
+                except Exception as e:
+                    stats = {'shard': shard_path, 'status': 'failed', 'error': str(e)}
+                    break
+            if i in isolated:
+                isolated.pop(i).shutdown(wait=True)
+
+            if stats['status'] == 'ok':
+                stats['global_duplicates'] = 0
+                for patient in iter_patient_records(spill_paths[i]):
+                    if deduplicator.is_duplicate(patient):
+                        stats['global_duplicates'] += 1
+                        continue
+                    yield patient
+                os.remove(spill_paths[i])
+            shard_stats.append(stats)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for own_pool in isolated.values():
+            own_pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+def _needs_rerun(future):
+    """Whether a shard's future was lost to a broken pool (or never ran)."""
+    if not future.done() or future.cancelled():
+        return True
+    return isinstance(future.exception(), BrokenProcessPool)
+
+def print_shard_summary(shard_stats):
+    """Print one line per shard and list any shards that failed."""
+    print("Shard Summary:")
+    for stats in shard_stats:
+        name = os.path.basename(stats['shard'])
+        if stats['status'] == 'ok':
+            print(f"  {name}: {stats['records_read']} read, {stats['records_kept']} kept, "
+                  f"{stats['under_age']} under {MIN_AGE}, "
+                  f"{stats['shard_duplicates'] + stats['global_duplicates']} duplicates "
+                  f"({stats['seconds']:.2f}s)")
+        else:
+            print(f"  {name}: FAILED - {stats['error']}", file=sys.stderr)
+
+def print_patient(patient):
+    """Print a single cleaned patient record."""
+    # BUG: Using 'name' key but we changed it to 'nage'
+    # FIX: The cleaned name is stored under 'name' again
+    print(f"Name: {patient['name']}, Age: {patient['age']}, Diagnosis: {patient['diagnosis']}")
+
+def add_cleaning_arguments(parser):
+    """Add the cleaning engine, duplicate index and coercion options to a parser."""
+    parser.add_argument('--engine', choices=CLEANING_ENGINES, default='dict',
+                        help="Cleaning engine: per-record Python or vectorized Polars "
+                             "(default: dict)")
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default='memory',
+                        help="Duplicate index: in-memory set, memory-mapped disk "
+                             "table, or Bloom filter (default: memory)")
+    parser.add_argument('--dedup-path',
+                        help="Disk table file for --dedup disk/bloom (replaced on each run "
+                             "unless --dedup-resume is given)")
+    parser.add_argument('--dedup-resume', action='store_true',
+                        help="Keep the fingerprints already in --dedup-path, dropping records "
+                             "seen by earlier runs")
+    parser.add_argument('--dedup-error-rate', type=float, default=0.001,
+                        help="Bloom filter false-positive rate (default: 0.001)")
+    parser.add_argument('--no-exact', dest='dedup_exact', action='store_false',
+                        help="With --dedup bloom, let the filter alone decide (no disk "
+                             "table; may wrongly drop records at the error rate)")
+    parser.add_argument('--expected-records', type=int, default=1_000_000,
+                        help="Sizing hint for the duplicate index")
+    patient_coercion.add_coercion_arguments(parser)
+
+def deduplicator_from_args(args):
+    """Create the duplicate index selected by add_cleaning_arguments options."""
+    return PatientDeduplicator(mode=args.dedup, path=args.dedup_path,
+                               expected_records=args.expected_records,
+                               error_rate=args.dedup_error_rate,
+                               exact=args.dedup_exact, resume=args.dedup_resume)
+
+def coercer_from_args(args):
+    """Create the age/weight coercer selected by add_cleaning_arguments options, or None."""
+    return patient_coercion.coercer_from_args(args)
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Construct the path to the data file
-    data_path = os.path.join(script_dir, 'data', 'raw', 'patients.json')
-    
+    parser = argparse.ArgumentParser(description="Clean and filter patient records.")
+    parser.add_argument('input', nargs='?',
+                        default=os.path.join(script_dir, 'data', 'raw', 'patients.json'),
+                        help="Patient JSON or JSON Lines file, or a directory or glob "
+                             "of shard files to clean in parallel")
+    parser.add_argument('-o', '--output',
+                        help="Write cleaned records to this file instead of printing them")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help="Output format (default: inferred from --output extension)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Process records one at a time with constant memory")
+    parser.add_argument('--workers', type=int,
+                        help="Worker processes for sharded input (default: CPU count)")
+    add_cleaning_arguments(parser)
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+def print_dedup_summary(deduplicator):
+    """Print how many records the duplicate index saw and dropped."""
+    stats = deduplicator.summary()
+    print(f"Duplicate check ({stats['mode']}): {stats['records_seen']} records seen, "
+          f"{stats['duplicates_dropped']} duplicates dropped")
+
+def print_coercion_summary(coercer):
+    """Print how many records the coercer rejected, per field and reason."""
+    if coercer is not None:
+        print(patient_coercion.format_summary(coercer))
+
+def emit_patients(patients, output=None, fmt=None):
+    """
+    Write cleaned records to `output`, or print them if no output is given.
+
+    Returns:
+        int: Number of records emitted
+    """
+    if output:
+        count = write_patient_stream(patients, output, fmt)
+        print(f"Wrote {count} cleaned patient records to {output}")
+        return count
+
+    print("Cleaned Patient Data:")
+    count = 0
+    for patient in patients:
+        print_patient(patient)
+        count += 1
+    return count
+
+def run(args):
+    """Clean patients as configured by parsed command-line arguments."""
+    deduplicator = deduplicator_from_args(args)
+    coercer = coercer_from_args(args)
+    shards = expand_shards(args.input)
+    sharded = len(shards) != 1 or shards[0] != args.input
+    if sharded and coercer is not None:
+        print("Error: --coerce and --quarantine are not supported for sharded input",
+              file=sys.stderr)
+        sys.exit(1)
+
     # BUG: No error handling for load_patient_data failure
-    patients = load_patient_data(data_path)
-    
-    # Clean the patient data
-    cleaned_patients = clean_patient_data(patients)
-    
+    # FIX: Report unreadable input and exit with a non-zero status
+    try:
+        with deduplicator, coercer or contextlib.nullcontext():
+            if sharded:
+                if not shards:
+                    raise FileNotFoundError(f"no patient shards match {args.input}")
+                shard_stats = []
+                cleaned = iter_clean_shards(shards, args.engine, args.workers,
+                                            deduplicator, shard_stats)
+                with instrumentation.stage('clean') as stage:
+                    count = stage.records = emit_patients(cleaned, args.output, args.format)
+                print_shard_summary(shard_stats)
+                print_dedup_summary(deduplicator)
+                if any(stats['status'] != 'ok' for stats in shard_stats):
+                    sys.exit(1)
+                return count
+
+            if args.stream:
+                cleaned = iter_clean_patients(iter_patient_records(args.input), deduplicator,
+                                              args.engine, coercer=coercer)
+                with instrumentation.stage('clean') as stage:
+                    count = stage.records = emit_patients(cleaned, args.output, args.format)
+                print_dedup_summary(deduplicator)
+                print_coercion_summary(coercer)
+                return count
+
+            patients = load_patient_data(args.input)
+
+            # Clean the patient data
+            cleaned_patients = clean_patient_data(patients, deduplicator, args.engine, coercer)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not read patient data from {args.input}: {e}", file=sys.stderr)
+        sys.exit(1)
+
     # BUG: No check if cleaned_patients is None
-    # Print the cleaned patient data
-    print("Cleaned Patient Data:")
-    for patient in cleaned_patients:
-        # BUG: Using 'name' key but we changed it to 'nage'
-        print(f"Name: {patient['name']}, Age: {patient['age']}, Diagnosis: {patient['diagnosis']}")
+    # FIX: clean_patient_data always returns a list, so report an empty result
+    if not cleaned_patients and not args.output:
+        print("No patient records remain after cleaning.")
+        print_coercion_summary(coercer)
+        return cleaned_patients
+
+    emit_patients(cleaned_patients, args.output, args.format)
+    print_dedup_summary(deduplicator)
+    print_coercion_summary(coercer)
     
     # Return the cleaned data (useful for testing)
     return cleaned_patients
 
+def main(argv=None):
+    """Main function to run the script."""
+    args = parse_args(argv)
+    with instrumentation.session_from_args('clean', args):
+        return run(args)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
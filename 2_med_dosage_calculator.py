@@ -35,6 +35,10 @@ Input Format:
         "allergies": ["penicillin"]
     }
 
+    Orders may also come from an Arrow IPC file (.arrow/.feather/.ipc, see
+    patient_arrow.py), e.g. the cleaner's output, which is memory-mapped and
+    read without parsing.
+
 Output:
     {
         "name": "John Smith",
@@ -44,43 +48,102 @@ Output:
         "is_first_dose": false,
         "loading_dose_applied": false,
         "final_dosage": 0.7,
-        "warnings": ["Monitor for arrhythmias"]
+        "warnings": ["Monitor for arrhythmias"],
+        "contraindications": []
     }
 
+Allergy Screening:
+    Each order's 'allergies' are checked against the medication. An allergy
+    contraindicates a medication if it names the medication (any spelling) or
+    one of its allergy classes, e.g. an "aspirin" allergy flags ibuprofen.
+    Conflicting allergies are listed under 'contraindications'.
+
 Medication Factors (mg/kg):
     epinephrine:  0.01  (Anaphylaxis)
     amiodarone:   5.00  (Cardiac arrest)
     lorazepam:    0.05  (Seizures)
     fentanyl:     0.001 (Pain)
     ...
+
+    The full table, with loading-dose flags, warnings, aliases (brand names
+    and common misspellings) and allergy classes, lives in
+    data/formulary.json. Pass --formulary to use a different JSON or TOML
+    rule file.
+
+Engines:
+    The default 'dict' engine calculates one patient at a time. The 'numpy'
+    engine turns the records into column arrays, integer-codes the medication
+    names and computes every dosage (and the total) with vectorized NumPy in a
+    single pass. calculate_dosage_table returns the results as a NumPy
+    structured array instead of a list of dictionaries.
+
+Compact Batches:
+    calculate_all_dosages also accepts a PatientBatch (patient_records.py)
+    and returns a copy of it with the dosage columns added, computed column
+    by column: each distinct medication is looked up once, allergies are
+    screened once per distinct (medication, allergies) pair, and no
+    per-record dictionaries or copies are made. Either engine may be used.
+
+Weight Coercion:
+    calculate_dosage expects weights in kilograms. With --coerce (or
+    --quarantine PATH), weights are first parsed in bulk by
+    patient_coercion.py: numeric strings, padded values and "lb"/"lbs"
+    weights are converted to kilograms, and orders whose weight is missing,
+    empty, unparseable or out of range are left out (and appended to the
+    quarantine file with a reason code) instead of failing the whole run.
+
+Usage:
+    python med_dosage_calculator.py
+    python med_dosage_calculator.py meds.json --engine numpy
+    python med_dosage_calculator.py cleaned.arrow
+    python med_dosage_calculator.py feed.json --quarantine rejected_orders.jsonl
 """
 
+import argparse
+import collections
+import decimal
 import json
+import math
 import os
+import sys
+import time
+
+import instrumentation
+import patient_coercion
+from formulary import DEFAULT_FORMULARY_PATH, load_formulary
+from patient_records import EXCEPTION_CODE, MISSING_CODE, PatientBatch
+
+# Medication rules (factors, loading doses, warnings, aliases) are loaded from
+# the formulary rule file and compiled once at startup
+FORMULARY = load_formulary(DEFAULT_FORMULARY_PATH)
 
 # Dosage factors for different medications (mg per kg of body weight)
 # These are standard dosing factors based on medical guidelines
-DOSAGE_FACTORS = {
-    "epinephrine": 0.01,  # Anaphylaxis
-    "amiodarone": 5.00,   # Cardiac arrest
-    "lorazepam": 0.05,    # Seizures
-    "fentanyl": 0.001,    # Pain
-    "lisinopril": 0.5,    # ACE inhibitor for blood pressure
-    "metformin": 10.0,    # Diabetes medication
-    "oseltamivir": 2.5,   # Antiviral for influenza
-    "sumatriptan": 1.0,   # Migraine medication
-    "albuterol": 0.1,     # Asthma medication
-    "ibuprofen": 5.0,     # Pain/inflammation
-    "sertraline": 1.5,    # Antidepressant
-    "levothyroxine": 0.02 # Thyroid medication
-}
+DOSAGE_FACTORS = FORMULARY.dosage_factors()
 
 # Medications that use loading doses for first administration
 # BUG: Missing commas between list items
-LOADING_DOSE_MEDICATIONS = [
-    "amiodarone"
-    "lorazepam"
-    "fentynal"
+# FIX: Loading-dose medications now come from the formulary as a set
+# (O(1) membership, and the "fentynal" typo is gone)
+LOADING_DOSE_MEDICATIONS = FORMULARY.loading_dose_medications()
+
+# Loading dose multiplier applied to the base dosage on first administration
+LOADING_DOSE_MULTIPLIER = 2
+
+# Available dosage engines: per-record Python or vectorized NumPy
+DOSAGE_ENGINES = ('dict', 'numpy')
+
+# File extensions read as Arrow IPC instead of JSON
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Field layout of the structured array returned by calculate_dosage_table
+DOSAGE_TABLE_DTYPE = [
+    ('weight', 'f8'),
+    ('medication', 'i2'),  # code into medication_names(); unknown names get the last code
+    ('is_first_dose', '?'),
+    ('base_dosage', 'f8'),
+    ('loading_dose_applied', '?'),
+    ('final_dosage', 'f8'),
 ]
 
 def load_patient_data(filepath):
@@ -88,131 +151,828 @@ def load_patient_data(filepath):
     Load patient data from a JSON file.
     
     Args:
-        filepath (str): Path to the JSON file
+        filepath (str): Path to the JSON file, or an Arrow IPC file
+            (.arrow/.feather/.ipc) written by an earlier stage
         
     Returns:
         list: List of patient dictionaries
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        json.JSONDecodeError: If the file is not valid JSON
     """
     # BUG: No error handling for file not found
-    with open(filepath, 'r') as file:
-        return json.load(file)
+    # FIX: Errors are raised to the caller and reported in main()
+    with instrumentation.stage('load') as stage, open(filepath, 'r') as file:
+        if filepath.lower().endswith(ARROW_EXTENSIONS):
+            from patient_arrow import iter_arrow_patients
+            patients = list(iter_arrow_patients(filepath))
+        else:
+            patients = json.load(file)
+        stage.records = len(patients)
+        stage.bytes = os.fstat(file.fileno()).st_size
+    return patients
 
-def calculate_dosage(patient):
+def use_formulary(path=DEFAULT_FORMULARY_PATH):
     """
-    Calculate medication dosage for a patient.
-    
+    Load a formulary rule file and make it the active medication table.
+
+    DOSAGE_FACTORS and LOADING_DOSE_MEDICATIONS are rebuilt to match.
+
     Args:
-        patient (dict): Patient dictionary with 'weight', 'medication', and 'is_first_dose' keys
-        
+        path (str): JSON or TOML rule file
+
     Returns:
-        dict: Patient dictionary with added dosage information
+        Formulary: The newly active formulary
+    """
+    global FORMULARY, DOSAGE_FACTORS, LOADING_DOSE_MEDICATIONS
+    FORMULARY = load_formulary(path)
+    DOSAGE_FACTORS = FORMULARY.dosage_factors()
+    LOADING_DOSE_MEDICATIONS = FORMULARY.loading_dose_medications()
+    return FORMULARY
+
+def get_warnings(medication):
+    """
+    Return the monitoring warnings for a medication.
+
+    Args:
+        medication (str): Medication name, alias or common misspelling
+
+    Returns:
+        list: Warning messages (empty if none apply)
+    """
+    # BUG: Typos in medication names
+    # FIX: Warnings are precomputed per medication in the formulary, which
+    # also resolves misspellings and brand names to the right medication
+    rule = FORMULARY.get(medication)
+    return list(rule.warnings) if rule is not None else []
+
+def screen_contraindications(patients):
+    """
+    Screen a batch of orders for allergy contraindications.
+
+    The formulary's allergy index (and its cache of interned allergy
+    strings) is shared across calls, so repeated census screens reuse it.
+
+    Args:
+        patients (list): Patient dictionaries with 'medication' and 'allergies'
+
+    Returns:
+        list: One list of conflicting allergies per patient
+    """
+    return FORMULARY.allergy_index.screen(patients)
+
+def _require(patient, key):
+    """Return patient[key], raising ValueError if the key is missing."""
+    if patient.get(key) is None:
+        raise ValueError(f"Patient {patient.get('name', '<unknown>')!r} is missing '{key}'")
+    return patient[key]
+
+def compute_dosage(medication, weight, is_first_dose):
+    """
+    The pure part of calculate_dosage: factor lookup and dosage math.
+
+    Args:
+        medication (str): Medication name (aliases are resolved)
+        weight (float): Patient weight in kg
+        is_first_dose (bool): Whether this is the first administration
+
+    Returns:
+        tuple: (rule or None, base_dosage, loading_dose_applied, final_dosage)
     """
-    # Create a copy of the patient data to avoid modifying the original
-    patient_with_dosage = patient.copy()
-    
-    # Extract patient information
-    # BUG: No check if 'weight' key exists
-    weight = patient['weight']
-    # BUG: No check if 'medication' key exists
-    medication = patient['medication'] # This bug is diabolical
-    
     # Get the medication factor
     # BUG: Adding 's' to medication name, which doesn't match DOSAGE_FACTORS keys
-    factor = DOSAGE_FACTORS.get(medication + 's', 0)
+    # FIX: Look up the medication name as-is in the compiled formulary
+    rule = FORMULARY.get(medication)
+    factor = rule.factor if rule is not None else 0
     
     # Calculate base dosage
     # BUG: Using addition instead of multiplication
-    base_dosage = weight + factor
+    # FIX: Base dosage is weight (kg) times factor (mg/kg)
+    base_dosage = weight * factor
     
-    # Determine if loading dose should be applied
-    # BUG: No check if 'is_first_dose' key exists
-    is_first_dose = patient.get('is_first_dose', False)
     loading_dose_applied = False
     final_dosage = base_dosage
     
     # Apply loading dose if it's the first dose and the medication uses loading doses
     # BUG: Incorrect condition - should check if medication is in LOADING_DOSE_MEDICATIONS
-    if is_first_dose and medication in LOADING_DOSE_MEDICATIONS:
+    # FIX: Use the rule's precompiled loading-dose flag
+    if is_first_dose and rule is not None and rule.loading_dose:
         loading_dose_applied = True
         # BUG: Using addition instead of multiplication for loading dose
-        final_dosage = base_dosage + base_dosage
+        # FIX: Loading dose is the base dosage times the loading multiplier
+        final_dosage = base_dosage * LOADING_DOSE_MULTIPLIER
+
+    return rule, base_dosage, loading_dose_applied, final_dosage
+
+def _dosage_fields(base_dosage, loading_dose_applied, final_dosage):
+    """The dosage fields calculate_dosage adds to a record."""
+    return {'base_dosage': base_dosage, 'loading_dose_applied': loading_dose_applied,
+            'final_dosage': final_dosage}
+
+class DosageCache:
+    """
+    Bounded LRU (optionally TTL) cache of compute_dosage results.
+
+    Keyed on (medication, weight, is_first_dose) with the exact weight, so
+    by default cached results are identical to uncached ones. With
+    weight_resolution set, weights are rounded to that many kg (to the
+    resolution's decimal places, so 0.1 kg buckets give 70.3, not
+    70.30000000000001) and the dosage is computed from the rounded weight;
+    calculate_dosage then records that weight as 'dosing_weight' next to
+    the patient's 'weight'.
+
+    Each entry also keeps the dosage fields calculate_dosage adds to a
+    record, so a hit only has to merge them into the patient's fields.
+
+    The cache clears itself when the active formulary changes (for example
+    after use_formulary), so results never outlive the factor table they
+    were computed from.
+
+    Attributes:
+        hits, misses, evictions, expirations, invalidations (int): Counters
+    """
+
+    def __init__(self, maxsize=4096, ttl=None, weight_resolution=None):
+        """
+        Args:
+            maxsize (int): Maximum number of cached entries
+            ttl (float): Seconds an entry stays valid (None: no expiry)
+            weight_resolution (float): Weight bucket size in kg (None: exact)
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weight_resolution = weight_resolution
+        # Decimal places of the bucket size, e.g. 1 for 0.5 kg, 0 for 5 kg
+        self._weight_digits = (max(0, -decimal.Decimal(repr(weight_resolution)).as_tuple().exponent)
+                               if weight_resolution else None)
+        self._entries = collections.OrderedDict()
+        self._formulary = FORMULARY
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def clear(self):
+        """Drop every entry."""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def dosing_weight(self, weight):
+        """Return the weight a dosage is computed from (rounded if weight_resolution is set)."""
+        if self.weight_resolution:
+            return round(round(weight / self.weight_resolution) * self.weight_resolution,
+                         self._weight_digits)
+        return weight
+
+    def lookup(self, medication, weight, is_first_dose):
+        """
+        Return compute_dosage(medication, weight, is_first_dose), cached.
+
+        Returns:
+            tuple: (rule or None, base_dosage, loading_dose_applied, final_dosage)
+        """
+        return self._entry(medication, weight, is_first_dose)[0]
+
+    def lookup_fields(self, medication, weight, is_first_dose):
+        """
+        Return the rule and the dosage fields calculate_dosage adds, cached.
+
+        Returns:
+            tuple: (rule or None, dict of 'dosing_weight' (bucketed caches
+            only), 'base_dosage', 'loading_dose_applied' and 'final_dosage');
+            the dict is shared between hits and must not be modified
+        """
+        value, fields = self._entry(medication, weight, is_first_dose)
+        return value[0], fields
+
+    def _entry(self, medication, weight, is_first_dose):
+        """Return the cached (compute_dosage result, dosage fields) for an order."""
+        if self._formulary is not FORMULARY:
+            self._entries.clear()
+            self._formulary = FORMULARY
+            self.invalidations += 1
+
+        weight = self.dosing_weight(weight)
+        key = (medication, weight, is_first_dose)
+        now = time.monotonic() if self.ttl is not None else 0.0
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value, fields = entry
+            if self.ttl is None or now - stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, fields
+            del self._entries[key]
+            self.expirations += 1
+
+        self.misses += 1
+        value = compute_dosage(medication, weight, is_first_dose)
+        fields = _dosage_fields(*value[1:])
+        if self.weight_resolution:
+            # The dosage was computed from the rounded weight; say so
+            fields = {'dosing_weight': weight, **fields}
+        self._entries[key] = (now, value, fields)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return value, fields
+
+    def stats(self):
+        """Return the cache counters and current size as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+def calculate_dosage(patient, cache=None):
+    """
+    Calculate medication dosage for a patient.
+    
+    Args:
+        patient (dict): Patient dictionary with 'weight', 'medication', and 'is_first_dose' keys
+        cache (DosageCache): Optional cache for the patient-independent math
+        
+    Returns:
+        dict: Patient dictionary with added dosage information
+
+    Raises:
+        ValueError: If 'weight' or 'medication' is missing or weight is not numeric
+    """
+    # Extract patient information
+    # BUG: No check if 'weight' key exists
+    # BUG: No check if 'medication' key exists
+    # FIX: _require raises a clear ValueError when either is missing
+    weight = float(_require(patient, 'weight'))
+    medication = _require(patient, 'medication') # This bug is diabolical
+    
+    # Determine if loading dose should be applied
+    # BUG: No check if 'is_first_dose' key exists
+    # FIX: Missing 'is_first_dose' defaults to False
+    is_first_dose = bool(patient.get('is_first_dose', False))
+
+    if cache is not None:
+        rule, fields = cache.lookup_fields(medication, weight, is_first_dose)
+    else:
+        rule, base_dosage, loading_dose_applied, final_dosage = compute_dosage(
+            medication, weight, is_first_dose)
+        fields = _dosage_fields(base_dosage, loading_dose_applied, final_dosage)
     
-    # Add dosage information to the patient record
-    patient_with_dosage['base_dosage'] = base_dosage
-    patient_with_dosage['loading_dose_applied'] = loading_dose_applied
-    patient_with_dosage['final_dosage'] = final_dosage
+    # Build a new record to avoid modifying the original: the patient's
+    # fields plus the dosage information
+    patient_with_dosage = {**patient, **fields}
     
     # Add warnings based on medication
-    warnings = []
-    # BUG: Typos in medication names
-    if medication == "epinephrin":
-        warnings.append("Monitor for arrhythmias")
-    elif medication == "amiodarone":
-        warnings.append("Monitor for hypotension")
-    elif medication == "fentynal":
-        warnings.append("Monitor for respiratory depression")
-    
-    patient_with_dosage['warnings'] = warnings
+    patient_with_dosage['warnings'] = list(rule.warnings) if rule is not None else []
+
+    # Flag allergies that contraindicate this medication
+    patient_with_dosage['contraindications'] = FORMULARY.allergy_index.conflicts(
+        rule, patient.get('allergies'))
     
     return patient_with_dosage
 
-def calculate_all_dosages(patients):
+def _medication_codes():
+    """
+    Integer-code the formulary's medications.
+
+    Returns:
+        tuple: (names, factors, loading flags) where code i refers to
+        names[i] (the formulary rule code); the extra final code stands for
+        unknown medications (factor 0, no loading dose)
+    """
+    import numpy as np
+
+    rules = FORMULARY.rules
+    names = FORMULARY.names + (None,)
+    factors = np.array([rule.factor for rule in rules] + [0.0])
+    loading = np.array([rule.loading_dose for rule in rules] + [False])
+    return names, factors, loading
+
+def calculate_dosage_table(patients):
+    """
+    Calculate dosages for all patients at once with vectorized NumPy.
+
+    Medication names are integer-coded (one dictionary lookup per distinct
+    name, not per record) and base, loading and final dosages are computed
+    as whole-column array operations.
+
+    Args:
+        patients (list): List of patient dictionaries
+
+    Returns:
+        tuple: (numpy structured array laid out as DOSAGE_TABLE_DTYPE,
+        total medication needed). The medication field holds integer
+        codes; decode them with medication_names(table). Each field is a
+        zero-copy column view, e.g. ``table['final_dosage']``.
+
+    Raises:
+        ValueError: If any patient is missing 'weight' or 'medication'
+    """
+    import numpy as np
+
+    names, factors, loading = _medication_codes()
+    unknown = len(names) - 1
+
+    n = len(patients)
+    medications = [_require(patient, 'medication') for patient in patients]
+    weights = np.fromiter((_require(patient, 'weight') for patient in patients),
+                          dtype=np.float64, count=n)
+    first_dose = np.fromiter((bool(patient.get('is_first_dose', False)) for patient in patients),
+                             dtype=bool, count=n)
+
+    # Look up each distinct name once, then broadcast the codes back to rows.
+    # Non-string medications are unknown to the formulary; map them to '' so
+    # np.unique never has to order a str against a number.
+    medications = [name if isinstance(name, str) else '' for name in medications]
+    distinct, inverse = np.unique(np.array(medications, dtype=object), return_inverse=True)
+    codes = np.array([getattr(FORMULARY.get(name), 'code', unknown) for name in distinct],
+                     dtype=np.int16)[inverse.reshape(-1)] if n else np.empty(0, dtype=np.int16)
+
+    table = np.empty(n, dtype=DOSAGE_TABLE_DTYPE)
+    table['weight'] = weights
+    table['medication'] = codes
+    table['is_first_dose'] = first_dose
+    np.multiply(weights, factors[codes], out=table['base_dosage'])
+    table['loading_dose_applied'] = first_dose & loading[codes]
+    table['final_dosage'] = np.where(table['loading_dose_applied'],
+                                     table['base_dosage'] * LOADING_DOSE_MULTIPLIER,
+                                     table['base_dosage'])
+    return table, math.fsum(table['final_dosage'].tolist())
+
+def medication_names(table):
+    """
+    Decode the medication codes of a dosage table back to names.
+
+    Args:
+        table: Structured array returned by calculate_dosage_table
+
+    Returns:
+        list: Medication names (None for unknown medications)
+    """
+    names = _medication_codes()[0]
+    return [names[code] for code in table['medication'].tolist()]
+
+def _calculate_all_dosages_numpy(patients):
+    """Vectorized calculate_all_dosages returning the same list of dicts."""
+    table, total = calculate_dosage_table(patients)
+    warnings_by_code = [rule.warnings for rule in FORMULARY.rules] + [()]
+    contraindications = screen_contraindications(patients)
+    patients_with_dosages = []
+    for patient, code, base, applied, final, conflicts in zip(
+            patients, table['medication'].tolist(), table['base_dosage'].tolist(),
+            table['loading_dose_applied'].tolist(), table['final_dosage'].tolist(),
+            contraindications):
+        patient_with_dosage = patient.copy()
+        patient_with_dosage['base_dosage'] = base
+        patient_with_dosage['loading_dose_applied'] = applied
+        patient_with_dosage['final_dosage'] = final
+        patient_with_dosage['warnings'] = list(warnings_by_code[code])
+        patient_with_dosage['contraindications'] = conflicts
+        patients_with_dosages.append(patient_with_dosage)
+    return patients_with_dosages, total
+
+class ExactSum:
+    """
+    Correctly rounded running sum of floats (Shewchuk's algorithm, as used
+    by math.fsum), kept as a short list of non-overlapping partials so sums
+    can be built incrementally and merged without losing precision.
+    """
+
+    __slots__ = ('partials',)
+
+    def __init__(self):
+        self.partials = []
+
+    def add(self, x):
+        """Add one float to the sum."""
+        partials = self.partials
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i:] = [x]
+
+    def merge(self, other):
+        """Add another ExactSum into this one."""
+        for partial in other.partials:
+            self.add(partial)
+
+    @property
+    def value(self):
+        """The correctly rounded sum."""
+        return math.fsum(self.partials)
+
+class MedicationAggregate:
+    """Running statistics for one medication (see DosageAggregator)."""
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'loading_doses')
+
+    def __init__(self):
+        self.count = 0
+        self.total = ExactSum()
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.loading_doses = 0
+
+    def add(self, final_dosage, loading_dose_applied):
+        self.count += 1
+        self.total.add(final_dosage)
+        self.minimum = min(self.minimum, final_dosage)
+        self.maximum = max(self.maximum, final_dosage)
+        self.loading_doses += bool(loading_dose_applied)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total.merge(other.total)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.loading_doses += other.loading_doses
+
+class DosageAggregator:
+    """
+    Streaming, mergeable per-medication dosage totals.
+
+    Keeps one MedicationAggregate per medication (aliases are folded into
+    the canonical name) instead of the per-patient results, so a pharmacy
+    stocking report can be produced from any number of orders in constant
+    memory. Aggregators built on different shards or processes can be
+    combined with merge().
+
+    Example:
+        aggregator = DosageAggregator().update(iter_dosages(patients))
+        for row in aggregator.report():
+            print(row['medication'], row['total_mg'])
+    """
+
+    def __init__(self):
+        self._by_medication = {}
+
+    def add(self, result):
+        """
+        Add one calculated dosage.
+
+        Args:
+            result (dict): A record returned by calculate_dosage
+        """
+        medication = result['medication']
+        rule = FORMULARY.get(medication)
+        key = rule.name if rule is not None else medication
+        aggregate = self._by_medication.get(key)
+        if aggregate is None:
+            aggregate = self._by_medication[key] = MedicationAggregate()
+        aggregate.add(result['final_dosage'], result['loading_dose_applied'])
+
+    def update(self, results):
+        """Add every result from an iterable; returns self."""
+        for result in results:
+            self.add(result)
+        return self
+
+    def merge(self, other):
+        """Fold another aggregator's totals into this one; returns self."""
+        for key, aggregate in other._by_medication.items():
+            mine = self._by_medication.get(key)
+            if mine is None:
+                mine = self._by_medication[key] = MedicationAggregate()
+            mine.merge(aggregate)
+        return self
+
+    @property
+    def count(self):
+        """Total number of orders aggregated."""
+        return sum(aggregate.count for aggregate in self._by_medication.values())
+
+    @property
+    def total(self):
+        """Total milligrams across all medications, correctly rounded."""
+        grand_total = ExactSum()
+        for aggregate in self._by_medication.values():
+            grand_total.merge(aggregate.total)
+        return grand_total.value
+
+    def report(self):
+        """
+        Build the per-medication stocking report.
+
+        Returns:
+            list: One dict per medication (sorted by name) with medication,
+            orders, total_mg, min_mg, max_mg, mean_mg and loading_doses
+        """
+        rows = []
+        for medication in sorted(self._by_medication, key=str):
+            aggregate = self._by_medication[medication]
+            total = aggregate.total.value
+            rows.append({
+                'medication': medication,
+                'orders': aggregate.count,
+                'total_mg': total,
+                'min_mg': aggregate.minimum,
+                'max_mg': aggregate.maximum,
+                'mean_mg': total / aggregate.count,
+                'loading_doses': aggregate.loading_doses,
+            })
+        return rows
+
+def _cache_counts(cache):
+    """Return a DosageCache's (hits, misses), or zeros without a cache."""
+    return (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+def _record_cache(cache, hits, misses):
+    """Report the cache lookups made since _cache_counts returned (hits, misses)."""
+    if cache is not None:
+        instrumentation.cache('dosage', cache.hits - hits, cache.misses - misses)
+
+def iter_dosages(patients, cache=None):
+    """
+    Calculate dosages lazily, one patient at a time.
+
+    Args:
+        patients (iterable): Patient dictionaries
+        cache (DosageCache): Optional result cache
+
+    Yields:
+        dict: Each patient with dosage information added
+    """
+    for patient in patients:
+        yield calculate_dosage(patient, cache)
+
+def aggregate_dosages(patients, cache=None):
+    """
+    Stream patients through the calculator into a DosageAggregator.
+
+    Per-patient results are discarded as soon as they are counted.
+
+    Returns:
+        DosageAggregator
+    """
+    with instrumentation.stage('dosage') as stage:
+        hits, misses = _cache_counts(cache)
+        aggregator = DosageAggregator().update(iter_dosages(patients, cache))
+        _record_cache(cache, hits, misses)
+        stage.records = aggregator.count
+    return aggregator
+
+def print_stock_report(aggregator):
+    """Print the pharmacy stocking report for an aggregator."""
+    print("Pharmacy Stocking Report:")
+    for row in aggregator.report():
+        print(f"  {row['medication']}: {row['orders']} orders, {row['total_mg']:.2f} mg total "
+              f"(min {row['min_mg']:.2f}, max {row['max_mg']:.2f}, "
+              f"{row['loading_doses']} loading doses)")
+
+def calculate_all_dosages(patients, engine='dict', cache=None):
     """
     Calculate dosages for all patients and sum the total.
     
     Args:
-        patients (list): List of patient dictionaries
+        patients (list or PatientBatch): Patient dictionaries or a batch
+        engine (str): 'dict' (per-record) or 'numpy' (vectorized); both
+            return the same records
+        cache (DosageCache): Optional result cache for the dict engine
         
     Returns:
-        tuple: (list of patient dicts with dosages, total medication needed)
+        tuple: (patients with dosages, total medication needed); the
+        patients are a list of dicts, or a PatientBatch if one was given
+    """
+    if engine not in DOSAGE_ENGINES:
+        raise ValueError(f"Unknown dosage engine {engine!r}; expected one of {DOSAGE_ENGINES}")
+    with instrumentation.stage('dosage') as stage:
+        hits, misses = _cache_counts(cache)
+        if isinstance(patients, PatientBatch):
+            results = _calculate_batch_dosages(patients, engine, cache)
+        elif engine == 'numpy':
+            results = _calculate_all_dosages_numpy(patients)
+        else:
+            results = _calculate_all_dosages_dict(patients, cache)
+        _record_cache(cache, hits, misses)
+        stage.records = len(results[0])
+    return results
+
+def _batch_dosage_inputs(batch):
+    """
+    Read the dosage inputs of a PatientBatch column-wise.
+
+    Returns:
+        tuple: (weights array, medication codes, is_first_dose codes,
+        allergies codes), or None if any order needs per-record handling
+        (missing or non-numeric weight, missing or unencodable medication,
+        unencodable flag or allergies), so that calculate_dosage raises the
+        usual errors.
     """
-    total_medication = 0
+    fields = set(batch.fields)
+    if not batch or not {'weight', 'medication'} <= fields:
+        return None
+    weights, numeric = batch.floats('weight')
+    medication_codes = batch.codes('medication')
+    if not numeric or min(medication_codes) < 0:
+        return None
+    if any(batch.vocabulary.decode(code) is None for code in set(medication_codes)):
+        return None
+    optional = []
+    for field in ('is_first_dose', 'allergies'):
+        codes = batch.codes(field) if field in fields else [MISSING_CODE] * len(batch)
+        if EXCEPTION_CODE in codes:
+            return None
+        optional.append(codes)
+    return (weights, medication_codes, *optional)
+
+def _calculate_batch_dosages(batch, engine, cache):
+    """calculate_all_dosages for a PatientBatch (see "Compact Batches")."""
+    inputs = _batch_dosage_inputs(batch)
+    if inputs is None:
+        results = [calculate_dosage(patient, cache) for patient in batch.dicts()]
+        return (PatientBatch.from_dicts(results, batch.vocabulary),
+                math.fsum(result['final_dosage'] for result in results))
+
+    weights, medication_codes, first_codes, allergy_codes = inputs
+    vocabulary = batch.vocabulary
+    medications = {code: vocabulary.decode(code) for code in set(medication_codes)}
+    rules = {code: FORMULARY.get(name) for code, name in medications.items()}
+    first_dose = {code: code != MISSING_CODE and bool(vocabulary.decode(code))
+                  for code in set(first_codes)}
+
+    if engine == 'numpy':
+        import numpy as np
+
+        codes = np.frombuffer(medication_codes, dtype=np.int32)
+        factors = np.zeros(max(rules) + 1)
+        loading = np.zeros(max(rules) + 1, dtype=bool)
+        for code, rule in rules.items():
+            if rule is not None:
+                factors[code], loading[code] = rule.factor, rule.loading_dose
+        # Shift codes by one so MISSING_CODE (-1) indexes the lookup table
+        first_lookup = np.zeros(max(first_dose) + 2, dtype=bool)
+        for code, flag in first_dose.items():
+            first_lookup[code + 1] = flag
+        first = first_lookup[np.asarray(first_codes, dtype=np.int64) + 1]
+
+        base = np.frombuffer(weights, dtype=np.float64) * factors[codes]
+        applied = first & loading[codes]
+        final = np.where(applied, base * LOADING_DOSE_MULTIPLIER, base)
+        base, applied, final = base.tolist(), applied.tolist(), final.tolist()
+    else:
+        lookup = cache.lookup if cache is not None else compute_dosage
+        base, applied, final = [], [], []
+        for weight, code, first_code in zip(weights, medication_codes, first_codes):
+            _, row_base, row_applied, row_final = lookup(medications[code], weight,
+                                                         first_dose[first_code])
+            base.append(row_base)
+            applied.append(row_applied)
+            final.append(row_final)
+
+    result = batch.copy()
+    if engine != 'numpy' and cache is not None and cache.weight_resolution:
+        result.set_floats('dosing_weight', [cache.dosing_weight(weight) for weight in weights])
+    result.set_floats('base_dosage', base)
+    applied_codes = (vocabulary.encode(False), vocabulary.encode(True))
+    result.set_codes('loading_dose_applied', [applied_codes[flag] for flag in applied])
+    result.set_floats('final_dosage', final)
+    warnings = {code: vocabulary.encode(list(rule.warnings) if rule is not None else [])
+                for code, rule in rules.items()}
+    result.set_codes('warnings', [warnings[code] for code in medication_codes])
+
+    # Allergy screening once per distinct (medication, allergies) pair
+    conflicts = {}
+    contraindications = []
+    for code, allergy_code in zip(medication_codes, allergy_codes):
+        key = (code, allergy_code)
+        if key not in conflicts:
+            allergies = None if allergy_code == MISSING_CODE else vocabulary.decode(allergy_code)
+            conflicts[key] = vocabulary.encode(
+                FORMULARY.allergy_index.conflicts(rules[code], allergies))
+        contraindications.append(conflicts[key])
+    result.set_codes('contraindications', contraindications)
+    return result, math.fsum(final)
+
+def _calculate_all_dosages_dict(patients, cache):
+    """Per-record engine of calculate_all_dosages."""
+    # Compensated running sum instead of naive float +=
+    total_medication = ExactSum()
     patients_with_dosages = []
     
     # Process all patients
     for patient in patients:
         # Calculate dosage for this patient
-        patient_with_dosage = calculate_dosage(patient)
+        patient_with_dosage = calculate_dosage(patient, cache)
         
         # Add to our list
         patients_with_dosages.append(patient_with_dosage)
         
         # Add to total medication
         # BUG: No check if 'final_dosage' key exists
-        total_medication += patient_with_dosage['final_dosage']
+        # FIX: calculate_dosage always sets 'final_dosage' (or raises)
+        total_medication.add(patient_with_dosage['final_dosage'])
     
-    return patients_with_dosages, total_medication
+    return patients_with_dosages, total_medication.value
 
-def main():
-    """Main function to run the script."""
-    # Get the directory of the current script
+def add_dosage_arguments(parser):
+    """Add the formulary, engine, cache and coercion options to a parser."""
+    parser.add_argument('--formulary', default=DEFAULT_FORMULARY_PATH,
+                        help="Medication rule file (JSON or TOML)")
+    parser.add_argument('--engine', choices=DOSAGE_ENGINES, default='dict',
+                        help="Dosage engine: per-record Python or vectorized NumPy "
+                             "(default: dict)")
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help="Memoize up to this many (medication, weight, first dose) "
+                             "results with the dict engine (default: off)")
+    patient_coercion.add_coercion_arguments(parser)
+
+def check_dosage_args(parser, args):
+    """Reject add_dosage_arguments option combinations argparse cannot express."""
+    if args.cache_size and args.engine == 'numpy':
+        parser.error("--cache-size only applies to the dict engine; "
+                     "the numpy engine computes every order directly")
+
+def coercer_from_args(args):
+    """Create the weight coercer selected by add_dosage_arguments options, or None."""
+    return patient_coercion.coercer_from_args(args, fields=('weight',), required=('weight',))
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Construct the path to the data file
-    data_path = os.path.join(script_dir, 'data', 'meds.json')
-    
+    parser = argparse.ArgumentParser(description="Calculate emergency medication dosages.")
+    # BUG: Data path pointed at data/meds.json, but the file lives in data/raw/
+    # FIX: Default to data/raw/meds.json
+    parser.add_argument('input', nargs='?',
+                        default=os.path.join(script_dir, 'data', 'raw', 'meds.json'),
+                        help="Patient medication orders JSON or Arrow IPC file")
+    add_dosage_arguments(parser)
+    parser.add_argument('--stock-report', action='store_true',
+                        help="Print per-medication totals instead of every patient")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    check_dosage_args(parser, args)
+    return args
+
+def run(args):
+    """Calculate dosages as configured by parsed command-line arguments."""
     # BUG: No error handling for load_patient_data failure
-    patients = load_patient_data(data_path)
+    # FIX: Report unreadable or invalid input and exit with a non-zero status
+    coercer = coercer_from_args(args)
+    try:
+        if args.formulary != DEFAULT_FORMULARY_PATH:
+            use_formulary(args.formulary)
+        patients = load_patient_data(args.input)
+        if coercer is not None:
+            with coercer:
+                patients = coercer.coerce(patients)
+            print(patient_coercion.format_summary(coercer))
     
-    # Calculate dosages for all patients
-    patients_with_dosages, total_medication = calculate_all_dosages(patients)
+        # Calculate dosages for all patients
+        cache = DosageCache(args.cache_size) if args.cache_size > 0 else None
+        if args.stock_report:
+            aggregator = aggregate_dosages(patients, cache)
+            print_stock_report(aggregator)
+            print(f"\nTotal medication needed: {aggregator.total:.2f} mg")
+            return aggregator
+        patients_with_dosages, total_medication = calculate_all_dosages(patients, args.engine, cache)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not calculate dosages from {args.input}: {e}", file=sys.stderr)
+        sys.exit(1)
     
     # Print the dosage information
     print("Medication Dosages:")
     for patient in patients_with_dosages:
         # BUG: No check if required keys exist
-        print(f"Name: {patient['name']}, Medication: {patient['medication']}, "
+        # FIX: calculate_dosage guarantees these keys; only 'name' may be absent
+        print(f"Name: {patient.get('name', '<unknown>')}, Medication: {patient['medication']}, "
               f"Base Dosage: {patient['base_dosage']:.2f} mg, "
               f"Final Dosage: {patient['final_dosage']:.2f} mg")
         if patient['loading_dose_applied']:
             print(f"  * Loading dose applied")
         if patient['warnings']:
             print(f"  * Warnings: {', '.join(patient['warnings'])}")
+        if patient['contraindications']:
+            print(f"  * CONTRAINDICATED: patient allergic to {', '.join(patient['contraindications'])}")
     
     print(f"\nTotal medication needed: {total_medication:.2f} mg")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Dosage cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['evictions']} evictions")
     
     # Return the results (useful for testing)
     return patients_with_dosages, total_medication
 
+def main(argv=None):
+    """Main function to run the script."""
+    args = parse_args(argv)
+    with instrumentation.session_from_args('dose', args):
+        return run(args)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,55 +1,1644 @@
+"""
+Patient Cohort Analysis
+
+Groups patients into WHO BMI ranges and reports mean glucose, patient count
+and mean age per range, using Polars lazy evaluation and streaming.
+
+BMI Ranges (values < 10 or > 60 are dropped as data errors):
+    Underweight: 10 <= BMI < 18.5
+    Normal:      18.5 <= BMI < 25
+    Overweight:  25 <= BMI < 30
+    Obese:       30 <= BMI <= 60
+
+Parquet Conversion Cache:
+    The input CSV is converted to Parquet once and reused. Converted files live
+    in a cache directory (--cache-dir, $COHORT_CACHE_DIR, or .cohort_cache) and
+    are keyed on the source file's content hash plus the conversion settings;
+    the hash itself is remembered per (path, size, mtime) so unchanged inputs
+    are not re-read. Conversion streams scan_csv(...).sink_parquet(...) with
+    explicit dtypes into a temporary file that is atomically renamed, so
+    concurrent runs never see or overwrite each other's partial output.
+
+Partitioned Dataset:
+    The data can also be written as a Hive-partitioned Parquet dataset
+    (diagnosis=<value>/age_band=<decade>/part-0.parquet) with rows sorted by
+    BMI inside each partition, so min/max row-group statistics let BMI filters
+    skip whole row groups. Queries with filters read only the partitions that
+    can match, e.g. a single diagnosis touches a third of the files.
+
+Incremental Aggregates:
+    For a table that grows by appended batch files, CohortAggregateStore keeps
+    per-range sums, counts and sums of squares for every merged batch in a
+    small JSON file. Updating folds in only batches it has not seen, and a bad
+    batch can be retracted by subtracting its stored partials; the reported
+    averages match a full recompute.
+
+Cohort Cube:
+    CohortCube groups the data once at the finest grain of several dimensions
+    (by default BMI range, age band, diagnosis and Outcome), keeping additive
+    components (row count, per-column count, sum, sum of squares, min, max).
+    Any coarser grouping and any mean/sum/count/min/max/var/std over those
+    columns is then answered from the small cached cube instead of another
+    pass over the data. Built cubes are saved next to the converted Parquet.
+
+Approximate Mode:
+    CohortSketch is built once per dataset and saved next to the converted
+    Parquet: a stratified sample per BMI range (the rows with the smallest
+    row hashes, so samples of separate batches merge into the sample of the
+    union), HyperLogLog registers for distinct patient counts, and exact
+    per-range counts and sums. Medians and other percentiles per BMI range are
+    answered from the sample in milliseconds with a 95% DKW confidence
+    interval; strata smaller than the sample are exact. Exact mode stays the
+    default (--approx opts in). Row hashes come from Polars, whose hash
+    values may change between releases, so each sketch records the Polars
+    version that built it: sketches from different versions refuse to
+    merge, and a saved sketch from another version is rebuilt.
+
+Out-of-Core Mode:
+    analyze_patient_cohorts_chunked() runs under an explicit memory budget.
+    The CSV is streamed to the cached Parquet once, then processed in row
+    slices of only the needed columns; each slice yields the additive per-range
+    partials used by the incremental store, which are summed and finalized.
+    The slice size is derived from the budget and halved whenever resident
+    memory grows past it, and the run reports its peak RSS, so inputs many
+    times larger than RAM can be analyzed on shared nodes.
+
+Result Cache:
+    analyze_patient_cohorts() stores each result as a small Parquet file in
+    <cache dir>/results, keyed on a fingerprint of the normalized query plan
+    (the lazy query, filters included, built over an empty frame and
+    serialized, so BMI bounds, breaks, labels and aggregations are all part
+    of it) and on the content hash of the input file. A repeated query reads
+    the stored result without scanning the data, and editing the input
+    changes its hash, so stale results are never returned. Reading a result
+    refreshes its modification time; once the directory grows past its size
+    bound (--result-cache-size) the least recently used results are deleted.
+    --no-result-cache bypasses the cache, and hits and misses are reported as
+    the "result" cache in --metrics/--prometheus output.
+
+Arrow Input:
+    An input with an Arrow IPC extension (.arrow, .feather, .ipc), such as
+    the generator's --format arrow output, is scanned in place: Polars
+    memory-maps the file, so the plain and out-of-core analyses skip both
+    CSV parsing and the Parquet conversion. Features that keep Parquet
+    artifacts (partitions, cube, sketch) convert it from the map without
+    parsing. Record files in the IPC stream format (as patient_arrow.py
+    writes them) cannot be scanned and are read into memory instead. Results
+    can also be written as Arrow (-o cohorts.arrow).
+
+Usage:
+    python cohort_analysis.py
+    python cohort_analysis.py patients_large.csv --cache-dir /tmp/cohort --compression lz4
+    python cohort_analysis.py --diagnosis Diabetes --age-min 40 --age-max 59
+    python cohort_analysis.py batch_0042.csv --store cohort_aggregates.json
+    python cohort_analysis.py --store cohort_aggregates.json --retract <batch id>
+    python cohort_analysis.py --group-by diagnosis --group-by age_band
+    python cohort_analysis.py --approx --quantile 0.5 --quantile 0.9
+    python cohort_analysis.py huge.csv --memory-budget 512MB
+    python cohort_analysis.py patients_large.csv -o cohorts.parquet
+    python cohort_analysis.py patients_large.arrow --memory-budget 512MB
+    python cohort_analysis.py --diagnosis Diabetes --result-cache-size 16MB
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from urllib.parse import quote
+
 import polars as pl
 
-def analyze_patient_cohorts(input_file: str) -> pl.DataFrame:
+import instrumentation
+
+# BMI outlier bounds (inclusive)
+BMI_MIN = 10
+BMI_MAX = 60
+
+# BMI range boundaries (left-closed) and labels
+BMI_BREAKS = [18.5, 25, 30]
+BMI_LABELS = ["Underweight", "Normal", "Overweight", "Obese"]
+
+# Explicit dtypes for the known input columns (others are inferred)
+PATIENT_SCHEMA = {
+    "Pregnancies": pl.Int64,
+    "Glucose": pl.Int64,
+    "BloodPressure": pl.Int64,
+    "SkinThickness": pl.Int64,
+    "Insulin": pl.Int64,
+    "BMI": pl.Float64,
+    "DiabetesPedigreeFunction": pl.Float64,
+    "Age": pl.Int64,
+    "Outcome": pl.Int64,
+    "diagnosis": pl.String,
+}
+
+# File extensions scanned as Arrow IPC (see patient_arrow.py)
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+ARROW_FILE_MAGIC = b"ARROW1"
+
+# Parquet conversion defaults
+DEFAULT_CACHE_DIR = os.environ.get("COHORT_CACHE_DIR", ".cohort_cache")
+DEFAULT_COMPRESSION = "zstd"
+DEFAULT_ROW_GROUP_SIZE = 256_000
+
+# Hive partition columns: diagnosis value and age band (decade start)
+PARTITION_COLUMNS = ["diagnosis", "age_band"]
+AGE_BAND_WIDTH = 10
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+DATASET_MANIFEST = "_manifest.json"
+
+# Additive statistics kept per BMI range by CohortAggregateStore
+AGGREGATE_FIELDS = ["patient_count", "glucose_count", "glucose_sum", "glucose_sumsq",
+                    "age_count", "age_sum", "age_sumsq"]
+
+# Default cube dimensions: a column name, a binning spec
+# {"column", "breaks", "labels"} or a fixed-width band spec {"column", "width"}
+DEFAULT_DIMENSIONS = {
+    "bmi_range": {"column": "BMI", "breaks": BMI_BREAKS, "labels": BMI_LABELS},
+    "age_band": {"column": "Age", "width": AGE_BAND_WIDTH},
+    "diagnosis": "diagnosis",
+    "Outcome": "Outcome",
+}
+DEFAULT_CUBE_COLUMNS = ["Glucose", "Age"]
+CUBE_AGGREGATIONS = ("count", "sum", "mean", "min", "max", "var", "std")
+
+# Measures reported by analyze_patient_cohorts
+DEFAULT_MEASURES = {
+    "avg_glucose": ("mean", "Glucose"),
+    "patient_count": ("count", None),
+    "avg_age": ("mean", "Age"),
+}
+
+# Approximate mode: rows sampled per BMI range, HyperLogLog precision
+# (2**14 registers, ~0.8% standard error), confidence of quantile bounds
+DEFAULT_SAMPLE_SIZE = 20_000
+HLL_PRECISION = 14
+QUANTILE_CONFIDENCE = 0.95
+DEFAULT_QUANTILES = [0.5, 0.9]
+SKETCH_COLUMNS = ["Glucose", "Age"]
+
+# Out-of-core mode: default budget, estimated bytes per row of working set
+# (three numeric columns plus bin/filter intermediates) and smallest slice
+DEFAULT_MEMORY_BUDGET = "1GB"
+CHUNK_BYTES_PER_ROW = 200
+MIN_CHUNK_ROWS = 10_000
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30, "TB": 1 << 40}
+
+# Bytes read per step when hashing the source file
+HASH_CHUNK_SIZE = 1 << 20
+
+# Per-cache-directory record of (path, size, mtime) -> content hash
+HASH_MANIFEST = "hashes.json"
+
+# Query-result cache: subdirectory of the cache directory and its size bound
+RESULT_CACHE_DIR = "results"
+DEFAULT_RESULT_CACHE_SIZE = "64MB"
+
+# Formats accepted by write_results (--format)
+RESULT_FORMATS = ("csv", "parquet", "json", "arrow")
+
+def _is_arrow(path: str) -> bool:
+    """Whether a path has an Arrow IPC file extension."""
+    return str(path).lower().endswith(ARROW_EXTENSIONS)
+
+def collect_streaming(query: pl.LazyFrame) -> pl.DataFrame:
+    """Collect a lazy query with the streaming engine on any Polars version."""
+    try:
+        return query.collect(engine="streaming")
+    except TypeError:  # Polars < 1.0
+        return query.collect(streaming=True)
+
+def bin_column(column: str, breaks: list, labels: list) -> pl.Expr:
     """
-    Analyze patient cohorts based on BMI ranges.
-    
+    Bin a numeric column into left-closed ranges [a, b) labelled in order.
+
+    Values below breaks[0] get labels[0]; values at or above breaks[-1] get
+    labels[-1]; nulls stay null. The result is an Enum so ranges sort in
+    label order.
+
     Args:
-        input_file: Path to the input CSV file
-        
+        column: Column to bin
+        breaks: Ascending boundaries (one fewer than labels)
+        labels: Range labels
+
     Returns:
-        DataFrame containing cohort analysis results with columns:
-        - bmi_range: The BMI range (e.g., "Underweight", "Normal", "Overweight", "Obese")
-        - avg_glucose: Mean glucose level by BMI range
-        - patient_count: Number of patients by BMI range
-        - avg_age: Mean age by BMI range
+        Expression producing the range label
+    """
+    if len(labels) != len(breaks) + 1:
+        raise ValueError("labels must have exactly one more entry than breaks")
+    value = pl.col(column)
+    expr = pl.when(value.is_null()).then(pl.lit(None, dtype=pl.String))
+    for upper, label in zip(breaks, labels):
+        expr = expr.when(value < upper).then(pl.lit(label))
+    return expr.otherwise(pl.lit(labels[-1])).cast(pl.Enum(labels))
+
+def file_content_hash(path: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """
+    Return the SHA-256 of a file, reusing a remembered hash if the file's
+    size and modification time have not changed.
+
+    Args:
+        path: File to hash
+        cache_dir: Directory holding the hash manifest
+
+    Returns:
+        Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    manifest_path = os.path.join(cache_dir, HASH_MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if key in manifest:
+        instrumentation.cache("file_hash", hits=1)
+        return manifest[key]
+
+    instrumentation.cache("file_hash", misses=1)
+    digest = hashlib.sha256()
+    with instrumentation.stage("hash", nbytes=stat.st_size), open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    # Drop stale entries for this path, then publish atomically
+    prefix = f"{os.path.abspath(path)}|"
+    manifest = {k: v for k, v in manifest.items() if not k.startswith(prefix)}
+    manifest[key] = content_hash
+    _atomic_write_text(manifest_path, json.dumps(manifest, indent=2))
+    return content_hash
+
+def _atomic_write_text(path: str, text: str) -> None:
+    """Write a text file via a temporary file and rename."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def convert_to_parquet(
+    input_file: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    compression: str = DEFAULT_COMPRESSION,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    force: bool = False,
+) -> str:
+    """
+    Convert a CSV (or Arrow IPC file) to Parquet through the conversion cache.
+
+    Args:
+        input_file: Source CSV or Arrow IPC file
+        cache_dir: Directory for cached Parquet files
+        compression: Parquet compression codec (e.g. "zstd", "lz4", "snappy")
+        row_group_size: Rows per Parquet row group
+        force: Reconvert even if a cached file exists
+
+    Returns:
+        Path of the cached Parquet file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    content_hash = file_content_hash(input_file, cache_dir)
+    parquet_path = os.path.join(
+        cache_dir, f"{content_hash[:32]}-{compression}-{row_group_size}.parquet")
+    if os.path.exists(parquet_path) and not force:
+        instrumentation.cache("parquet", hits=1)
+        return parquet_path
+
+    instrumentation.cache("parquet", misses=1)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".parquet.tmp")
+    os.close(fd)
+    try:
+        with instrumentation.stage("convert", nbytes=os.path.getsize(input_file)):
+            scan_patients(input_file).sink_parquet(
+                tmp_path, compression=compression, row_group_size=row_group_size)
+        os.replace(tmp_path, parquet_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return parquet_path
+
+def age_band_expr() -> pl.Expr:
+    """Age band (start of the decade) used as a partition key."""
+    return (pl.col("Age") // AGE_BAND_WIDTH * AGE_BAND_WIDTH).cast(pl.Int64).alias("age_band")
+
+def _partition_dir(diagnosis, age_band) -> str:
+    """Relative Hive directory for one partition."""
+    diagnosis = HIVE_NULL if diagnosis is None else quote(str(diagnosis), safe="")
+    age_band = HIVE_NULL if age_band is None else age_band
+    return os.path.join(f"diagnosis={diagnosis}", f"age_band={age_band}")
+
+def write_partitioned_dataset(
+    input_file: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    compression: str = DEFAULT_COMPRESSION,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    force: bool = False,
+) -> str:
+    """
+    Write (or reuse) the Hive-partitioned Parquet dataset for a CSV.
+
+    Each partition is streamed from the cached Parquet conversion, sorted
+    by BMI and written with row-group statistics, so memory is bounded by
+    the largest partition rather than the dataset. The partition keys and
+    the manifest's row counts and BMI ranges come from one streaming
+    aggregation up front. The dataset is built in a temporary directory and
+    renamed into place, and the manifest is written alongside.
+
+    Args:
+        input_file: Source CSV
+        cache_dir: Cache directory (shared with convert_to_parquet)
+        compression: Parquet compression codec
+        row_group_size: Rows per Parquet row group
+        force: Rebuild even if the dataset exists
+
+    Returns:
+        Path of the dataset directory
+    """
+    parquet_path = convert_to_parquet(input_file, cache_dir, compression, row_group_size)
+    dataset_dir = parquet_path[:-len(".parquet")] + ".dataset"
+    if os.path.exists(os.path.join(dataset_dir, DATASET_MANIFEST)) and not force:
+        instrumentation.cache("dataset", hits=1)
+        return dataset_dir
+
+    instrumentation.cache("dataset", misses=1)
+    source = pl.scan_parquet(parquet_path).with_columns(age_band_expr())
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, suffix=".dataset.tmp")
+    try:
+        with instrumentation.stage("partition", nbytes=os.path.getsize(parquet_path)) as stage:
+            stats = collect_streaming(
+                source.group_by(PARTITION_COLUMNS).agg(
+                    pl.len().alias("rows"), pl.col("BMI").min().alias("bmi_min"),
+                    pl.col("BMI").max().alias("bmi_max"))
+            ).sort(PARTITION_COLUMNS, nulls_last=True)
+            partitions = []
+            for row in stats.iter_rows(named=True):
+                diagnosis, age_band = row["diagnosis"], row["age_band"]
+                match = [pl.col(name).is_null() if value is None else pl.col(name) == value
+                         for name, value in zip(PARTITION_COLUMNS, (diagnosis, age_band))]
+                relative = os.path.join(_partition_dir(diagnosis, age_band), "part-0.parquet")
+                target = os.path.join(tmp_dir, relative)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                (source.filter(pl.all_horizontal(match))
+                       .drop(PARTITION_COLUMNS)
+                       .sort("BMI", nulls_last=True)
+                       .sink_parquet(target, compression=compression,
+                                     row_group_size=row_group_size, statistics=True))
+                partitions.append({"path": relative, **row})
+            stage.records = sum(partition["rows"] for partition in partitions)
+
+        with open(os.path.join(tmp_dir, DATASET_MANIFEST), "w") as f:
+            json.dump({"source": os.path.basename(parquet_path), "partitions": partitions},
+                      f, indent=2)
+        if os.path.exists(dataset_dir):
+            shutil.rmtree(dataset_dir)
+        os.replace(tmp_dir, dataset_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return dataset_dir
+
+def _normalize_filters(filters: dict | None) -> dict:
+    """
+    Validate query filters.
+
+    Each key is a column name. Values may be a scalar (equality), a list or
+    set (membership) or a 2-tuple (inclusive range; None for an open end).
+    """
+    normalized = {}
+    for column, value in (filters or {}).items():
+        if isinstance(value, tuple):
+            if len(value) != 2:
+                raise ValueError(f"Range filter for {column!r} must be (low, high)")
+            normalized[column] = ("range", value)
+        elif isinstance(value, (list, set, frozenset)):
+            normalized[column] = ("in", sorted(value, key=str))
+        else:
+            normalized[column] = ("eq", value)
+    return normalized
+
+def _filter_expr(column: str, kind: str, value) -> pl.Expr:
+    """Row-level predicate for one normalized filter."""
+    col = pl.col(column)
+    if kind == "eq":
+        return col == value
+    if kind == "in":
+        return col.is_in(value)
+    low, high = value
+    expr = pl.lit(True)
+    if low is not None:
+        expr = expr & (col >= low)
+    if high is not None:
+        expr = expr & (col <= high)
+    return expr
+
+def _partition_matches(partition: dict, filters: dict) -> bool:
+    """Whether a manifest partition can contain rows matching the filters."""
+    for column, (kind, value) in filters.items():
+        if column == "diagnosis":
+            diagnosis = partition["diagnosis"]
+            if kind == "eq" and diagnosis != value:
+                return False
+            if kind == "in" and diagnosis not in value:
+                return False
+        elif column == "Age" and kind != "in":
+            band = partition["age_band"]
+            if band is None:
+                continue
+            low, high = (value, value) if kind == "eq" else value
+            if low is not None and band + AGE_BAND_WIDTH - 1 < low:
+                return False
+            if high is not None and band > high:
+                return False
+        elif column == "BMI" and kind == "range":
+            low, high = value
+            if partition["bmi_min"] is None:
+                return False
+            if low is not None and partition["bmi_max"] < low:
+                return False
+            if high is not None and partition["bmi_min"] > high:
+                return False
+    return True
+
+def scan_cohort_dataset(dataset_dir: str, filters: dict | None = None) -> pl.LazyFrame:
+    """
+    Lazily scan only the dataset partitions that can match the filters.
+
+    Partitions are pruned with the manifest (diagnosis, age band and the
+    partition's BMI range); within the remaining files Polars pushes the
+    row filters down to the Parquet row-group statistics.
+
+    Args:
+        dataset_dir: Directory written by write_partitioned_dataset
+        filters: See _normalize_filters, e.g.
+            {"diagnosis": "Diabetes", "Age": (40, 59), "BMI": (10, 60)}
+
+    Returns:
+        LazyFrame including the diagnosis and age_band partition columns
     """
-    # Convert CSV to Parquet for efficient processing
-    pl.read_csv(input_file).write_parquet("patients_large.parquet")
-    
-    # Create a lazy query to analyze cohorts
-    cohort_results = pl.scan_parquet("patients_large.parquet").pipe(
-        lambda df: df.filter((pl.col("BMI") >= 10) & (pl.col("BMI") <= 60))
+    filters = _normalize_filters(filters)
+    with instrumentation.stage("scan") as stage:
+        with open(os.path.join(dataset_dir, DATASET_MANIFEST)) as f:
+            manifest = json.load(f)
+        files = [os.path.join(dataset_dir, partition["path"])
+                 for partition in manifest["partitions"]
+                 if _partition_matches(partition, filters)]
+        if instrumentation.enabled():
+            stage.records = len(files)
+            stage.bytes = sum(os.path.getsize(path) for path in files)
+            instrumentation.count("partitions_pruned", len(manifest["partitions"]) - len(files))
+
+    if not files:
+        schema = pl.read_parquet_schema(os.path.join(dataset_dir, manifest["partitions"][0]["path"]))
+        schema.update({"diagnosis": pl.String, "age_band": pl.Int64})
+        return pl.LazyFrame(schema=schema)
+
+    query = pl.scan_parquet(files, hive_partitioning=True,
+                            hive_schema={"diagnosis": pl.String, "age_band": pl.Int64})
+    for column, (kind, value) in filters.items():
+        query = query.filter(_filter_expr(column, kind, value))
+    return query
+
+def cohort_query(source: pl.LazyFrame) -> pl.LazyFrame:
+    """The BMI-range aggregation run by analyze_patient_cohorts."""
+    return source.pipe(
+        lambda df: df.filter((pl.col("BMI") >= BMI_MIN) & (pl.col("BMI") <= BMI_MAX))
     ).pipe(
         lambda df: df.select(["BMI", "Glucose", "Age"])
     ).pipe(
         lambda df: df.with_columns(
-            pl.col("BMI").cut(
-                breaks=[10, 18.5, 25, 30, 60],
-                labels=["Underweight", "Normal", "Overweight", "Obese"],
-                left_closed=True
-            ).alias("bmi_range")
+            bin_column("BMI", BMI_BREAKS, BMI_LABELS).alias("bmi_range")
         )
     ).pipe(
-        lambda df: df.groupby("bmi_range").agg([
+        lambda df: df.group_by("bmi_range").agg([
             pl.col("Glucose").mean().alias("avg_glucose"),
-            pl.count().alias("patient_count"),
+            pl.len().alias("patient_count"),
             pl.col("Age").mean().alias("avg_age")
         ])
-    ).collect(streaming=True)
-    
-    return cohort_results
-
-def main():
-    # Input file
-    input_file = "patients_large.csv"
-    
+    ).sort("bmi_range")
+
+def query_fingerprint(filters: dict | None = None) -> str:
+    """
+    Fingerprint of the normalized analyze_patient_cohorts query plan.
+
+    The plan (filters in column order, then cohort_query) is built over an
+    empty frame with PATIENT_SCHEMA and serialized, so it covers the
+    filters, BMI bounds, bin breaks and labels and aggregations, but not
+    where the data lives or whether it is partitioned.
+    """
+    plan = pl.LazyFrame(schema=PATIENT_SCHEMA)
+    for column, (kind, value) in sorted(_normalize_filters(filters).items()):
+        plan = plan.filter(_filter_expr(column, kind, value))
+    digest = hashlib.blake2b(pl.__version__.encode(), digest_size=16)
+    digest.update(cohort_query(plan).serialize())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    On-disk LRU cache of analysis results, one small Parquet file per key.
+
+    Recency is the file modification time, which get() refreshes, so
+    processes sharing the directory share one LRU order. Writes are atomic.
+    """
+
+    def __init__(self, directory: str, max_bytes=DEFAULT_RESULT_CACHE_SIZE):
+        """
+        Args:
+            directory: Directory holding the cached results
+            max_bytes: Size bound in bytes or as a size string ("64MB")
+        """
+        self.directory = directory
+        self.max_bytes = parse_size(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def get(self, key: str) -> pl.DataFrame | None:
+        """Return the cached result for key, or None."""
+        path = self._path(key)
+        try:
+            results = pl.read_parquet(path)
+            os.utime(path)
+        except (OSError, pl.exceptions.PolarsError):
+            self.misses += 1
+            instrumentation.cache("result", misses=1)
+            return None
+        self.hits += 1
+        instrumentation.cache("result", hits=1)
+        return results
+
+    def put(self, key: str, results: pl.DataFrame) -> None:
+        """Store a result, then evict least recently used ones over the bound."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".parquet.tmp")
+        os.close(fd)
+        try:
+            results.write_parquet(tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def _entries(self) -> list:
+        """(mtime, size, path) of every cached result, oldest first."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".parquet"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # evicted by another process
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self, keep: str | None = None) -> int:
+        """
+        Delete least recently used results until the cache fits its bound.
+
+        Args:
+            keep: Key never evicted (the result just stored)
+
+        Returns:
+            Number of results deleted
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        keep_path = None if keep is None else self._path(keep)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def clear(self) -> None:
+        """Delete every cached result."""
+        if os.path.isdir(self.directory):
+            for _, _, path in self._entries():
+                os.remove(path)
+
+    def stats(self) -> dict:
+        """hits, misses and evictions of this instance; entries and bytes on disk."""
+        entries = self._entries() if os.path.isdir(self.directory) else []
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+def analyze_patient_cohorts(
+    input_file: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    compression: str = DEFAULT_COMPRESSION,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    filters: dict | None = None,
+    partitioned: bool = False,
+    result_cache: ResultCache | None = None,
+    use_result_cache: bool = True,
+) -> pl.DataFrame:
+    """
+    Analyze patient cohorts based on BMI ranges.
+
+    Args:
+        input_file: Path to the input CSV file, or an Arrow IPC file to scan
+            in place
+        cache_dir: Directory for the cached Parquet conversion
+        compression: Parquet compression codec for the conversion
+        row_group_size: Rows per Parquet row group for the conversion
+        filters: Optional row filters, e.g. {"diagnosis": "Diabetes",
+            "Age": (40, 59)}; see scan_cohort_dataset. Implies partitioned.
+        partitioned: Read from the partitioned dataset instead of the single
+            converted file
+        result_cache: Result cache to use (default: <cache_dir>/results with
+            the default size bound)
+        use_result_cache: False to bypass the result cache entirely
+
+    Returns:
+        DataFrame containing cohort analysis results with columns:
+        - bmi_range: The BMI range (e.g., "Underweight", "Normal", "Overweight", "Obese")
+        - avg_glucose: Mean glucose level by BMI range
+        - patient_count: Number of patients by BMI range
+        - avg_age: Mean age by BMI range
+    """
+    if use_result_cache:
+        if result_cache is None:
+            result_cache = ResultCache(os.path.join(cache_dir, RESULT_CACHE_DIR))
+        os.makedirs(cache_dir, exist_ok=True)
+        key = f"{file_content_hash(input_file, cache_dir)[:32]}-{query_fingerprint(filters)}"
+        results = result_cache.get(key)
+        if results is not None:
+            return results
+
+    # Convert CSV to Parquet for efficient processing (cached across runs)
+    scanned_bytes = 0
+    if filters or partitioned:
+        dataset_dir = write_partitioned_dataset(input_file, cache_dir, compression,
+                                                row_group_size)
+        source = scan_cohort_dataset(dataset_dir, filters)
+    elif _is_arrow(input_file):
+        source = scan_patients(input_file)
+        if instrumentation.enabled():
+            scanned_bytes = os.path.getsize(input_file)
+    else:
+        parquet_path = convert_to_parquet(input_file, cache_dir, compression, row_group_size)
+        source = pl.scan_parquet(parquet_path)
+        if instrumentation.enabled():
+            scanned_bytes = os.path.getsize(parquet_path)
+
+    # Polars fuses the Parquet scan into the aggregation, so both are timed here
+    with instrumentation.stage("aggregate", nbytes=scanned_bytes) as stage:
+        results = collect_streaming(cohort_query(source))
+        stage.records = results["patient_count"].sum()
+    if use_result_cache:
+        result_cache.put(key, results)
+    return results
+
+def scan_patients(path: str) -> pl.LazyFrame:
+    """Lazily scan a patient batch stored as CSV, Parquet or Arrow IPC."""
+    if path.endswith(".parquet"):
+        return pl.scan_parquet(path)
+    if _is_arrow(path):
+        with open(path, "rb") as f:
+            is_file_format = f.read(len(ARROW_FILE_MAGIC)) == ARROW_FILE_MAGIC
+        if is_file_format:
+            return pl.scan_ipc(path)
+        # Polars cannot scan the IPC stream format (patient_arrow.py output)
+        return pl.read_ipc_stream(path).lazy()
+    return pl.scan_csv(path, schema_overrides=PATIENT_SCHEMA)
+
+def range_aggregates(source: pl.LazyFrame) -> dict:
+    """
+    Compute the additive per-range statistics of some patient rows.
+
+    Args:
+        source: Patient rows (at least BMI, Glucose and Age)
+
+    Returns:
+        {bmi_range: {field: value}} for every range present, with the fields
+        in AGGREGATE_FIELDS (null glucose/age values are not counted)
+    """
+    query = source.filter(
+        (pl.col("BMI") >= BMI_MIN) & (pl.col("BMI") <= BMI_MAX)
+    ).select(
+        bin_column("BMI", BMI_BREAKS, BMI_LABELS).cast(pl.String).alias("bmi_range"),
+        pl.col("Glucose"),
+        pl.col("Age"),
+    ).group_by("bmi_range").agg(
+        pl.len().alias("patient_count"),
+        pl.col("Glucose").count().alias("glucose_count"),
+        pl.col("Glucose").sum().alias("glucose_sum"),
+        (pl.col("Glucose") ** 2).sum().alias("glucose_sumsq"),
+        pl.col("Age").count().alias("age_count"),
+        pl.col("Age").sum().alias("age_sum"),
+        (pl.col("Age") ** 2).sum().alias("age_sumsq"),
+    )
+    return {row.pop("bmi_range"): row for row in collect_streaming(query).to_dicts()}
+
+def batch_aggregates(path: str) -> dict:
+    """Per-range statistics (see range_aggregates) of one CSV or Parquet batch."""
+    with instrumentation.stage("aggregate", nbytes=os.path.getsize(path)) as stage:
+        ranges = range_aggregates(scan_patients(path))
+        stage.records = sum(entry["patient_count"] for entry in ranges.values())
+    return ranges
+
+def merge_range_aggregates(totals: dict, ranges: dict, sign: int = 1) -> dict:
+    """
+    Add (sign=1) or subtract (sign=-1) per-range statistics into totals.
+
+    Ranges whose patient count drops to zero are removed. Returns totals.
+    """
+    for label, stats in ranges.items():
+        current = totals.setdefault(label, dict.fromkeys(AGGREGATE_FIELDS, 0))
+        for field in AGGREGATE_FIELDS:
+            current[field] += sign * (stats[field] or 0)
+        if current["patient_count"] == 0:
+            del totals[label]
+    return totals
+
+def results_from_totals(totals: dict, spread: bool = False) -> pl.DataFrame:
+    """
+    Turn per-range statistics into the analyze_patient_cohorts result.
+
+    Args:
+        totals: {bmi_range: {field: value}} as from range_aggregates
+        spread: Also report population standard deviations
+            (std_glucose, std_age) from the sums of squares
+
+    Returns:
+        DataFrame with the analyze_patient_cohorts columns
+    """
+    def mean(total, count):
+        return total / count if count else None
+
+    def std(total, sumsq, count):
+        if not count:
+            return None
+        return math.sqrt(max(0.0, sumsq / count - (total / count) ** 2))
+
+    rows = []
+    for label in BMI_LABELS:
+        t = totals.get(label)
+        if t is None:
+            continue
+        row = {
+            "bmi_range": label,
+            "avg_glucose": mean(t["glucose_sum"], t["glucose_count"]),
+            "patient_count": t["patient_count"],
+            "avg_age": mean(t["age_sum"], t["age_count"]),
+        }
+        if spread:
+            row["std_glucose"] = std(t["glucose_sum"], t["glucose_sumsq"], t["glucose_count"])
+            row["std_age"] = std(t["age_sum"], t["age_sumsq"], t["age_count"])
+        rows.append(row)
+
+    schema = {"bmi_range": pl.Enum(BMI_LABELS), "avg_glucose": pl.Float64,
+              "patient_count": pl.UInt32, "avg_age": pl.Float64}
+    if spread:
+        schema.update({"std_glucose": pl.Float64, "std_age": pl.Float64})
+    return pl.DataFrame(rows, schema=schema)
+
+class CohortAggregateStore:
+    """
+    Persisted, mergeable BMI-range aggregates over appended batch files.
+
+    The store file records the partial statistics of each merged batch
+    (keyed by the batch's content hash unless an id is given) and their
+    running totals. Integer columns are summed as Python ints, so merging and
+    retracting are exact.
+
+    Example:
+        store = CohortAggregateStore("cohort_aggregates.json")
+        store.update(["batch_001.csv", "batch_002.csv"])
+        store.results()            # same columns as analyze_patient_cohorts
+        store.retract(batch_id)    # undo a bad load
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSON store file (created on the first save)
+        """
+        self.path = path
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {"batches": {}, "totals": {}}
+        self.batches = state["batches"]
+        self.totals = state["totals"]
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        _atomic_write_text(self.path, json.dumps(
+            {"batches": self.batches, "totals": self.totals}, indent=2))
+
+    def append(self, path: str, batch_id: str | None = None) -> str | None:
+        """
+        Merge one batch file into the store.
+
+        Args:
+            path: CSV or Parquet batch
+            batch_id: Identifier for later retraction (default: content hash)
+
+        Returns:
+            The batch id, or None if the batch was already merged
+        """
+        if batch_id is None:
+            batch_id = file_content_hash(path, os.path.dirname(os.path.abspath(self.path)))[:32]
+        if batch_id in self.batches:
+            return None
+        ranges = batch_aggregates(path)
+        self.batches[batch_id] = {"source": os.path.abspath(path), "ranges": ranges}
+        merge_range_aggregates(self.totals, ranges)
+        self._save()
+        return batch_id
+
+    def update(self, paths: list) -> list:
+        """
+        Merge every batch file not already in the store.
+
+        Returns:
+            Ids of the newly merged batches
+        """
+        merged = [self.append(path) for path in paths]
+        return [batch_id for batch_id in merged if batch_id is not None]
+
+    def retract(self, batch_id: str) -> None:
+        """
+        Remove a previously merged batch.
+
+        Raises:
+            KeyError: If the batch is not in the store
+        """
+        if batch_id not in self.batches:
+            raise KeyError(f"Batch {batch_id!r} is not in {self.path}")
+        merge_range_aggregates(self.totals, self.batches.pop(batch_id)["ranges"], -1)
+        self._save()
+
+    def results(self, spread: bool = False) -> pl.DataFrame:
+        """
+        Cohort statistics over all merged batches.
+
+        Args:
+            spread: Also report population standard deviations
+                (std_glucose, std_age) from the sums of squares
+
+        Returns:
+            DataFrame with the analyze_patient_cohorts columns
+        """
+        return results_from_totals(self.totals, spread)
+
+def dimension_expr(name: str, spec) -> pl.Expr:
+    """
+    Build the grouping expression for one cube dimension.
+
+    Args:
+        name: Output column name
+        spec: Column name, {"column", "breaks", "labels"} binning spec or
+            {"column", "width"} fixed-width band spec
+
+    Returns:
+        Expression aliased to name
+    """
+    if isinstance(spec, str):
+        return pl.col(spec).alias(name)
+    if "breaks" in spec:
+        return bin_column(spec["column"], spec["breaks"], spec["labels"]).alias(name)
+    if "width" in spec:
+        width = spec["width"]
+        return (pl.col(spec["column"]) // width * width).alias(name)
+    raise ValueError(f"Invalid dimension spec for {name!r}: {spec!r}")
+
+class CohortCube:
+    """
+    Finest-grain cohort aggregates that answer coarser rollups without
+    rescanning the data.
+
+    Example:
+        cube = CohortCube.build("patients_large.csv")
+        cube.rollup(["bmi_range"])                     # analyze_patient_cohorts
+        cube.rollup(["diagnosis", "Outcome"],
+                    {"avg_glucose": ("mean", "Glucose"),
+                     "glucose_sd": ("std", "Glucose")},
+                    filters={"age_band": [40, 50]})
+    """
+
+    def __init__(self, table: pl.DataFrame, dimensions: list, columns: list):
+        """
+        Use CohortCube.build() rather than calling this.
+
+        Args:
+            table: One row per finest-grain cell with component columns
+            dimensions: Dimension column names in the table
+            columns: Measure columns with components in the table
+        """
+        self.table = table
+        self.dimensions = list(dimensions)
+        self.columns = list(columns)
+        self._rollups = {}
+
+    @staticmethod
+    def components(columns: list) -> list:
+        """Additive component aggregations for the given measure columns."""
+        exprs = [pl.len().alias("__rows")]
+        for column in columns:
+            value = pl.col(column)
+            exprs += [
+                value.count().alias(f"{column}__count"),
+                value.sum().alias(f"{column}__sum"),
+                (value.cast(pl.Float64) ** 2).sum().alias(f"{column}__sumsq"),
+                value.min().alias(f"{column}__min"),
+                value.max().alias(f"{column}__max"),
+            ]
+        return exprs
+
+    @classmethod
+    def from_frame(cls, source: pl.LazyFrame, dimensions: dict | None = None,
+                   columns: list | None = None) -> "CohortCube":
+        """
+        Build a cube from a lazy frame in one streaming pass.
+
+        Rows with BMI outside [BMI_MIN, BMI_MAX] are dropped, as in
+        analyze_patient_cohorts.
+
+        Args:
+            source: Patient rows
+            dimensions: {name: spec} (see dimension_expr); DEFAULT_DIMENSIONS
+            columns: Columns that measures may aggregate; DEFAULT_CUBE_COLUMNS
+        """
+        dimensions = DEFAULT_DIMENSIONS if dimensions is None else dimensions
+        columns = DEFAULT_CUBE_COLUMNS if columns is None else columns
+        query = source.filter(
+            (pl.col("BMI") >= BMI_MIN) & (pl.col("BMI") <= BMI_MAX)
+        ).group_by(
+            [dimension_expr(name, spec) for name, spec in dimensions.items()]
+        ).agg(cls.components(columns))
+        return cls(collect_streaming(query), list(dimensions), columns)
+
+    @classmethod
+    def build(
+        cls,
+        input_file: str,
+        dimensions: dict | None = None,
+        columns: list | None = None,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        force: bool = False,
+    ) -> "CohortCube":
+        """
+        Build (or load the saved) cube for a patient CSV.
+
+        The cube is saved as Parquet in cache_dir, keyed on the source
+        file's content hash and the cube definition.
+
+        Args:
+            input_file: Source CSV
+            dimensions: See from_frame
+            columns: See from_frame
+            cache_dir: Conversion cache directory
+            force: Rebuild even if a saved cube exists
+        """
+        dimensions = DEFAULT_DIMENSIONS if dimensions is None else dimensions
+        columns = DEFAULT_CUBE_COLUMNS if columns is None else columns
+        parquet_path = convert_to_parquet(input_file, cache_dir)
+        definition = json.dumps({"dimensions": dimensions, "columns": columns}, sort_keys=True)
+        digest = hashlib.sha256(definition.encode()).hexdigest()[:16]
+        cube_path = parquet_path[:-len(".parquet")] + f".cube-{digest}.parquet"
+
+        if os.path.exists(cube_path) and not force:
+            instrumentation.cache("cube", hits=1)
+            return cls(pl.read_parquet(cube_path), list(dimensions), columns)
+
+        instrumentation.cache("cube", misses=1)
+        with instrumentation.stage("aggregate", nbytes=os.path.getsize(parquet_path)) as stage:
+            cube = cls.from_frame(pl.scan_parquet(parquet_path), dimensions, columns)
+            stage.records = cube.table["__rows"].sum()
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".parquet.tmp")
+        os.close(fd)
+        try:
+            cube.table.write_parquet(tmp_path)
+            os.replace(tmp_path, cube_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return cube
+
+    def _measure(self, name: str, aggregation: str, column: str | None) -> pl.Expr:
+        """Finalize one measure from summed components."""
+        if aggregation not in CUBE_AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation {aggregation!r}; expected one of "
+                             f"{CUBE_AGGREGATIONS}")
+        if column is None:
+            if aggregation != "count":
+                raise ValueError(f"Measure {name!r}: only 'count' works without a column")
+            return pl.col("__rows").cast(pl.UInt32).alias(name)
+        if column not in self.columns:
+            raise ValueError(f"Measure {name!r}: column {column!r} is not in the cube "
+                             f"(built with {self.columns})")
+
+        count = pl.col(f"{column}__count")
+        total = pl.col(f"{column}__sum")
+        sumsq = pl.col(f"{column}__sumsq")
+        if aggregation == "count":
+            expr = count
+        elif aggregation == "sum":
+            expr = total
+        elif aggregation == "mean":
+            expr = pl.when(count > 0).then(total / count)
+        elif aggregation in ("min", "max"):
+            expr = pl.col(f"{column}__{aggregation}")
+        else:
+            # Sample variance (ddof=1), as Polars' var/std
+            var = pl.when(count > 1).then(
+                ((sumsq - total.cast(pl.Float64) ** 2 / count) / (count - 1)).clip(0))
+            expr = var if aggregation == "var" else var.sqrt()
+        return expr.alias(name)
+
+    def rollup(self, dimensions: list, measures: dict | None = None,
+               filters: dict | None = None) -> pl.DataFrame:
+        """
+        Aggregate the cube to a coarser grouping.
+
+        Args:
+            dimensions: Cube dimensions to keep (empty for a grand total)
+            measures: {output name: (aggregation, column)}, aggregation one
+                of CUBE_AGGREGATIONS and column None only for a row count;
+                defaults to the analyze_patient_cohorts measures
+            filters: {dimension: value or list of values} applied to the
+                cube cells before rolling up
+
+        Returns:
+            DataFrame sorted by the kept dimensions
+        """
+        measures = DEFAULT_MEASURES if measures is None else measures
+        unknown = set(dimensions) - set(self.dimensions)
+        if unknown:
+            raise ValueError(f"Unknown dimensions {sorted(unknown)}; cube has {self.dimensions}")
+        key = (tuple(dimensions),
+               tuple(sorted((k, tuple(v)) for k, v in measures.items())),
+               repr(sorted((filters or {}).items())))
+        if key in self._rollups:
+            instrumentation.cache("rollup", hits=1)
+            return self._rollups[key]
+        instrumentation.cache("rollup", misses=1)
+
+        cells = self.table.lazy()
+        for dimension, value in (filters or {}).items():
+            if dimension not in self.dimensions:
+                raise ValueError(f"Cannot filter on {dimension!r}; cube has {self.dimensions}")
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            cells = cells.filter(pl.col(dimension).is_in(list(values)))
+
+        summed = [pl.col("__rows").sum()]
+        for column in self.columns:
+            summed += [pl.col(f"{column}__{part}").sum() for part in ("count", "sum", "sumsq")]
+            summed += [pl.col(f"{column}__min").min(), pl.col(f"{column}__max").max()]
+        grouped = (cells.group_by(dimensions).agg(summed).sort(dimensions) if dimensions
+                   else cells.select(summed))
+        result = grouped.select(
+            *dimensions,
+            *(self._measure(name, *spec) for name, spec in measures.items()),
+        ).collect()
+        self._rollups[key] = result
+        return result
+
+def _hll_estimate(registers: list) -> float:
+    """HyperLogLog cardinality estimate with the small-range correction."""
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return estimate
+
+class CohortSketch:
+    """
+    Mergeable per-BMI-range summaries for approximate cohort statistics.
+
+    Attributes:
+        sample: Sampled rows (all input columns, bmi_range and the __h
+            priority hash); per range, the sample_size rows with the smallest
+            hashes
+        stats: {bmi_range: {"rows", "<column>_count", "<column>_sum"}}
+        registers: {bmi_range: list of 2**HLL_PRECISION HyperLogLog registers}
+        sample_size: Rows kept per range
+        polars_version: Polars version whose row hashes the sketch holds
+    """
+
+    def __init__(self, sample: pl.DataFrame, stats: dict, registers: dict,
+                 sample_size: int = DEFAULT_SAMPLE_SIZE, polars_version: str | None = None):
+        self.sample = sample
+        self.stats = stats
+        self.registers = registers
+        self.sample_size = sample_size
+        self.polars_version = pl.__version__ if polars_version is None else polars_version
+
+    @classmethod
+    def from_frame(cls, source: pl.LazyFrame,
+                   sample_size: int = DEFAULT_SAMPLE_SIZE) -> "CohortSketch":
+        """
+        Build a sketch from patient rows in streaming passes.
+
+        Args:
+            source: Patient rows
+            sample_size: Rows sampled per BMI range
+        """
+        columns = source.collect_schema().names()
+        rows = source.filter(
+            (pl.col("BMI") >= BMI_MIN) & (pl.col("BMI") <= BMI_MAX)
+        ).with_columns(
+            bin_column("BMI", BMI_BREAKS, BMI_LABELS).cast(pl.String).alias("bmi_range"),
+            pl.struct(columns).hash(seed=0).alias("__h"),
+            pl.struct(columns).hash(seed=1).alias("__hll"),
+        )
+
+        sample = collect_streaming(
+            rows.drop("__hll").group_by("bmi_range").agg(
+                pl.all().bottom_k_by("__h", sample_size)
+            ).explode(pl.exclude("bmi_range"))
+        ).sort("bmi_range", "__h")
+
+        stats_frame = collect_streaming(rows.group_by("bmi_range").agg(
+            pl.len().alias("rows"),
+            *[pl.col(c).count().alias(f"{c}_count") for c in SKETCH_COLUMNS],
+            *[pl.col(c).sum().alias(f"{c}_sum") for c in SKETCH_COLUMNS],
+        ))
+        stats = {row.pop("bmi_range"): row for row in stats_frame.to_dicts()}
+
+        # Register index from the top bits, rank from the leading zeros of the rest
+        low_bits = 64 - HLL_PRECISION
+        rest = pl.col("__hll") & ((1 << low_bits) - 1)
+        register_frame = collect_streaming(rows.select(
+            "bmi_range",
+            (pl.col("__hll") // (1 << low_bits)).alias("register"),
+            (rest.bitwise_leading_zeros() - HLL_PRECISION + 1).alias("rank"),
+        ).group_by("bmi_range", "register").agg(pl.col("rank").max()))
+        registers = {}
+        for label, register, rank in register_frame.iter_rows():
+            registers.setdefault(label, [0] * (1 << HLL_PRECISION))[register] = rank
+        return cls(sample, stats, registers, sample_size)
+
+    @classmethod
+    def build(
+        cls,
+        input_file: str,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        force: bool = False,
+    ) -> "CohortSketch":
+        """
+        Build (or load the saved) sketch for a patient CSV.
+
+        The sample (Parquet) and the counts and registers (JSON) are saved
+        next to the converted Parquet, keyed on its name and the sample size.
+        A saved sketch built by another Polars version is rebuilt.
+        """
+        parquet_path = convert_to_parquet(input_file, cache_dir)
+        prefix = parquet_path[:-len(".parquet")] + f".sketch-{sample_size}"
+        if os.path.exists(prefix + ".json") and not force:
+            sketch = cls.load(prefix)
+            if sketch.polars_version == pl.__version__:
+                return sketch
+        sketch = cls.from_frame(pl.scan_parquet(parquet_path), sample_size)
+        sketch.save(prefix)
+        return sketch
+
+    def save(self, prefix: str) -> None:
+        """Write <prefix>.parquet (sample) and <prefix>.json (the rest)."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(prefix) or ".",
+                                        suffix=".parquet.tmp")
+        os.close(fd)
+        try:
+            self.sample.write_parquet(tmp_path)
+            os.replace(tmp_path, prefix + ".parquet")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # JSON last: its presence marks a complete sketch
+        _atomic_write_text(prefix + ".json", json.dumps({
+            "sample_size": self.sample_size,
+            "polars_version": self.polars_version,
+            "stats": self.stats,
+            "registers": self.registers,
+        }))
+
+    @classmethod
+    def load(cls, prefix: str) -> "CohortSketch":
+        """Read a sketch written by save()."""
+        with open(prefix + ".json") as f:
+            state = json.load(f)
+        # Sketches saved before the version was recorded match no version
+        return cls(pl.read_parquet(prefix + ".parquet"), state["stats"],
+                   state["registers"], state["sample_size"],
+                   state.get("polars_version", "unknown"))
+
+    def merge(self, other: "CohortSketch") -> "CohortSketch":
+        """
+        Combine sketches of two disjoint batches into the sketch of both.
+
+        Both sketches must use the same sample size and come from the same
+        Polars version (row hashes are not stable across versions). The
+        merged sample is exactly what a sketch of the union would sample.
+        """
+        if other.sample_size != self.sample_size:
+            raise ValueError("Cannot merge sketches with different sample sizes")
+        if other.polars_version != self.polars_version:
+            raise ValueError(f"Cannot merge sketches hashed by Polars {self.polars_version} "
+                             f"and {other.polars_version}; rebuild one of them")
+        sample = pl.concat([self.sample, other.sample], how="diagonal_relaxed").group_by(
+            "bmi_range").agg(pl.all().bottom_k_by("__h", self.sample_size)).explode(
+            pl.exclude("bmi_range")).sort("bmi_range", "__h")
+
+        stats = {label: dict(values) for label, values in self.stats.items()}
+        for label, values in other.stats.items():
+            if label in stats:
+                for field, value in values.items():
+                    stats[label][field] = (stats[label][field] or 0) + (value or 0)
+            else:
+                stats[label] = dict(values)
+
+        registers = {label: list(values) for label, values in self.registers.items()}
+        for label, values in other.registers.items():
+            if label in registers:
+                registers[label] = [max(a, b) for a, b in zip(registers[label], values)]
+            else:
+                registers[label] = list(values)
+        return CohortSketch(sample.select(self.sample.columns), stats, registers,
+                            self.sample_size, self.polars_version)
+
+    def quantiles(self, quantiles: list = DEFAULT_QUANTILES,
+                  columns: list = SKETCH_COLUMNS,
+                  confidence: float = QUANTILE_CONFIDENCE) -> pl.DataFrame:
+        """
+        Approximate cohort statistics per BMI range.
+
+        Counts and means are exact (from the stored sums). Each quantile
+        comes with a (low, high) interval from the Dvoretzky-Kiefer-Wolfowitz
+        bound: with probability `confidence` every sample quantile is within
+        eps = sqrt(ln(2 / (1 - confidence)) / (2n)) in rank of the truth,
+        where n is the number of sampled rows. Ranges whose rows all fit in
+        the sample are exact (eps = 0).
+
+        Args:
+            quantiles: Quantiles in [0, 1]
+            columns: Sampled columns to summarize
+            confidence: Coverage of the quantile intervals
+
+        Returns:
+            DataFrame with bmi_range, avg_glucose, patient_count, avg_age,
+            distinct_patients and, per column and quantile, e.g. glucose_p50,
+            glucose_p50_low, glucose_p50_high
+        """
+        rows = []
+        for label in BMI_LABELS:
+            stats = self.stats.get(label)
+            if stats is None:
+                continue
+            row = {
+                "bmi_range": label,
+                "avg_glucose": (stats["Glucose_sum"] / stats["Glucose_count"]
+                                if stats["Glucose_count"] else None),
+                "patient_count": stats["rows"],
+                "avg_age": stats["Age_sum"] / stats["Age_count"] if stats["Age_count"] else None,
+                "distinct_patients": round(_hll_estimate(self.registers[label])),
+            }
+            sampled = self.sample.filter(pl.col("bmi_range") == label)
+            exact = sampled.height >= stats["rows"]
+            for column in columns:
+                values = sampled[column].drop_nulls()
+                eps = 0.0 if exact or values.is_empty() else math.sqrt(
+                    math.log(2 / (1 - confidence)) / (2 * values.len()))
+                for q in quantiles:
+                    name = f"{column.lower()}_p{q * 100:g}"
+                    row[name] = values.quantile(q)
+                    if eps == 0.0:
+                        row[f"{name}_low"] = row[f"{name}_high"] = row[name]
+                    else:
+                        row[f"{name}_low"] = values.quantile(max(0.0, q - eps), "lower")
+                        row[f"{name}_high"] = values.quantile(min(1.0, q + eps), "higher")
+            rows.append(row)
+        result = pl.DataFrame(rows)
+        if result.height:
+            result = result.with_columns(pl.col("bmi_range").cast(pl.Enum(BMI_LABELS)),
+                                         pl.col("patient_count").cast(pl.UInt32))
+        return result
+
+def approximate_cohorts(
+    input_file: str,
+    quantiles: list = DEFAULT_QUANTILES,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+) -> pl.DataFrame:
+    """
+    Approximate cohort statistics (with percentiles) from the saved sketch.
+
+    Args:
+        input_file: Source CSV
+        quantiles: Quantiles to report for Glucose and Age
+        sample_size: Rows sampled per BMI range
+        cache_dir: Conversion cache directory
+
+    Returns:
+        See CohortSketch.quantiles
+    """
+    return CohortSketch.build(input_file, sample_size, cache_dir).quantiles(quantiles)
+
+def parse_size(size) -> int:
+    """
+    Parse a byte size such as 512MB, 1.5GB or 1048576.
+
+    Raises:
+        ValueError: If the size cannot be parsed or is not positive
+    """
+    if isinstance(size, (int, float)):
+        value = int(size)
+    else:
+        text = str(size).strip().upper().replace("IB", "B")
+        number = text.rstrip("KMGTB")
+        unit = text[len(number):]
+        if unit in ("K", "M", "G", "T"):
+            unit += "B"
+        try:
+            value = int(float(number) * SIZE_UNITS[unit])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid size {size!r}; use e.g. 512MB or 2GB") from None
+    if value <= 0:
+        raise ValueError(f"Size must be positive, got {size!r}")
+    return value
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def analyze_patient_cohorts_chunked(
+    input_file: str,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    chunk_rows: int | None = None,
+) -> tuple[pl.DataFrame, dict]:
+    """
+    Analyze patient cohorts in bounded-memory chunks.
+
+    Args:
+        input_file: Path to the input CSV or Arrow IPC file
+        memory_budget: Working-memory budget above the starting RSS, in
+            bytes or as a size string ("512MB")
+        cache_dir: Directory for the cached Parquet conversion
+        chunk_rows: Initial rows per chunk (default: derived from the budget)
+
+    Returns:
+        (results, stats): results as analyze_patient_cohorts returns; stats
+        with budget_bytes, chunks, rows, chunk_rows (final slice size),
+        baseline_rss_bytes and peak_rss_bytes
+    """
+    budget = parse_size(memory_budget)
+    baseline = current_rss()
+    if _is_arrow(input_file):
+        source = scan_patients(input_file)
+    else:
+        source = pl.scan_parquet(convert_to_parquet(input_file, cache_dir))
+    source = source.select("BMI", "Glucose", "Age")
+    total_rows = source.select(pl.len()).collect().item()
+    if chunk_rows is None:
+        chunk_rows = max(MIN_CHUNK_ROWS, budget // CHUNK_BYTES_PER_ROW)
+
+    totals = {}
+    offset = chunks = 0
+    while offset < total_rows:
+        with instrumentation.stage("aggregate") as stage:
+            chunk = source.slice(offset, chunk_rows).collect()
+            merge_range_aggregates(totals, range_aggregates(chunk.lazy()))
+            stage.records = chunk.height
+        offset += chunk.height
+        chunks += 1
+        del chunk
+        # Shrink the slice if the working set outgrew the budget
+        if current_rss() - baseline > budget and chunk_rows > MIN_CHUNK_ROWS:
+            chunk_rows = max(MIN_CHUNK_ROWS, chunk_rows // 2)
+
+    stats = {
+        "budget_bytes": budget,
+        "chunks": chunks,
+        "rows": offset,
+        "chunk_rows": chunk_rows,
+        "baseline_rss_bytes": baseline,
+        "peak_rss_bytes": peak_rss(),
+    }
+    return results_from_totals(totals), stats
+
+def write_results(results: pl.DataFrame, path: str, fmt: str | None = None) -> None:
+    """
+    Write analysis results as CSV, Parquet, JSON (rows as objects) or Arrow IPC.
+
+    Args:
+        results: Any result frame returned by the analysis functions
+        path: Output file
+        fmt: One of RESULT_FORMATS (default: from the file extension, else CSV)
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower() or "csv"
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result format {fmt!r}; expected one of {RESULT_FORMATS}")
+    if fmt == "csv":
+        results.write_csv(path)
+    elif fmt == "parquet":
+        results.write_parquet(path)
+    elif fmt == "arrow":
+        results.write_ipc(path)
+    else:
+        results.write_json(path)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add every analysis option except the input file to a parser."""
+    parser.add_argument("-o", "--output",
+                        help="Also write the results to this file")
+    parser.add_argument("--format", choices=RESULT_FORMATS,
+                        help="Output format (default: from the --output extension)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory for cached Parquet conversions")
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION,
+                        help="Parquet compression codec (default: zstd)")
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE,
+                        help="Rows per Parquet row group")
+    parser.add_argument("--diagnosis", action="append",
+                        help="Only include this diagnosis (repeatable)")
+    parser.add_argument("--age-min", type=int, help="Minimum age (inclusive)")
+    parser.add_argument("--age-max", type=int, help="Maximum age (inclusive)")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="Read from the partitioned dataset")
+    parser.add_argument("--store",
+                        help="Merge the input into this incremental aggregate store "
+                             "and report the store's totals")
+    parser.add_argument("--retract", metavar="BATCH_ID",
+                        help="Remove a batch from the --store instead of merging")
+    parser.add_argument("--group-by", action="append", choices=list(DEFAULT_DIMENSIONS),
+                        help="Report the cohort cube rolled up to these dimensions "
+                             "(repeatable)")
+    parser.add_argument("--approx", action="store_true",
+                        help="Approximate statistics with percentiles from a saved sketch")
+    parser.add_argument("--quantile", type=float, action="append",
+                        help="Quantile to report with --approx (repeatable; "
+                             "default: 0.5 and 0.9)")
+    parser.add_argument("--sample-size", type=int,
+                        help="Rows sampled per BMI range for --approx "
+                             f"(default: {DEFAULT_SAMPLE_SIZE})")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Recompute instead of reading or storing a cached result")
+    parser.add_argument("--result-cache-size", default=DEFAULT_RESULT_CACHE_SIZE,
+                        help="Size bound of the query-result cache (default: 64MB)")
+    parser.add_argument("--memory-budget",
+                        help="Process in bounded chunks within this working-memory "
+                             "budget (e.g. 512MB) and report peak RSS")
+
+def check_args(parser: argparse.ArgumentParser, args) -> None:
+    """Reject option combinations add_arguments cannot express."""
+    modes = [flag for flag, value in (("--store", args.store), ("--approx", args.approx),
+                                      ("--memory-budget", args.memory_budget),
+                                      ("--group-by", args.group_by)) if value]
+    if len(modes) > 1:
+        parser.error(f"{' and '.join(modes)} cannot be combined")
+    if args.group_by and (args.age_min is not None or args.age_max is not None):
+        parser.error("--age-min/--age-max cannot be combined with --group-by; "
+                     "group by age_band instead")
+    # These modes read the whole input and do not support filters or the dataset
+    if modes and modes[0] != "--group-by" and (args.diagnosis or args.age_min is not None
+                                               or args.age_max is not None):
+        parser.error(f"--diagnosis/--age-min/--age-max cannot be combined with {modes[0]}")
+    if modes and args.partitioned:
+        parser.error(f"--partitioned cannot be combined with {modes[0]}")
+    if args.retract and not args.store:
+        parser.error("--retract requires --store")
+    for flag, value in (("--quantile", args.quantile), ("--sample-size", args.sample_size)):
+        if value is not None and not args.approx:
+            parser.error(f"{flag} requires --approx")
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Analyze patient cohorts by BMI range.")
+    parser.add_argument("input", nargs="?", default="patients_large.csv",
+                        help="Patient CSV or Arrow IPC file (default: patients_large.csv)")
+    add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    check_args(parser, args)
+    return args
+
+def filters_from_args(args) -> dict:
+    """Build analyze_patient_cohorts filters from command-line arguments."""
+    filters = {}
+    if args.diagnosis:
+        filters["diagnosis"] = list(args.diagnosis)
+    if args.age_min is not None or args.age_max is not None:
+        filters["Age"] = (args.age_min, args.age_max)
+    return filters
+
+def _run_analysis(args) -> pl.DataFrame:
+    """Run and print the analysis selected by parsed command-line arguments."""
     # Run analysis
-    results = analyze_patient_cohorts(input_file)
-    
+    if args.store:
+        store = CohortAggregateStore(args.store)
+        if args.retract:
+            store.retract(args.retract)
+        else:
+            batch_id = store.append(args.input)
+            print(f"Merged batch {batch_id}" if batch_id else "Batch already merged")
+        results = store.results()
+        print("\nCohort Analysis Summary:")
+        print(results)
+        return results
+
+    if args.approx:
+        sample_size = DEFAULT_SAMPLE_SIZE if args.sample_size is None else args.sample_size
+        results = approximate_cohorts(args.input, args.quantile or DEFAULT_QUANTILES,
+                                      sample_size, args.cache_dir)
+        print("\nApproximate Cohort Summary:")
+        print(results)
+        return results
+
+    if args.memory_budget:
+        results, stats = analyze_patient_cohorts_chunked(args.input, args.memory_budget,
+                                                         args.cache_dir)
+        print("\nCohort Analysis Summary:")
+        print(results)
+        print(f"\nProcessed {stats['rows']:,} rows in {stats['chunks']} chunks; "
+              f"peak RSS {stats['peak_rss_bytes'] / (1 << 20):.1f} MB "
+              f"(budget {stats['budget_bytes'] / (1 << 20):.1f} MB above "
+              f"{stats['baseline_rss_bytes'] / (1 << 20):.1f} MB baseline)")
+        return results
+
+    if args.group_by:
+        results = CohortCube.build(args.input, cache_dir=args.cache_dir).rollup(
+            args.group_by, filters={"diagnosis": args.diagnosis} if args.diagnosis else None)
+        print("\nCohort Analysis Summary:")
+        print(results)
+        return results
+
+    result_cache = ResultCache(os.path.join(args.cache_dir, RESULT_CACHE_DIR),
+                               args.result_cache_size)
+    results = analyze_patient_cohorts(args.input, args.cache_dir, args.compression,
+                                      args.row_group_size, filters_from_args(args),
+                                      args.partitioned, result_cache,
+                                      not args.no_result_cache)
+
     # Print summary statistics
     print("\nCohort Analysis Summary:")
     print(results)
+    if not args.no_result_cache:
+        stats = result_cache.stats()
+        print(f"\nResult cache: {'hit' if stats['hits'] else 'miss'}; {stats['entries']} "
+              f"results, {stats['bytes'] / (1 << 10):.1f} KB of "
+              f"{stats['max_bytes'] / (1 << 20):.1f} MB, {stats['evictions']} evicted")
+    return results
+
+def run(args) -> pl.DataFrame:
+    """Run the selected analysis and write the results to --output, if given."""
+    results = _run_analysis(args)
+    if args.output:
+        write_results(results, args.output, args.format)
+        print(f"\nWrote {results.height} rows to {args.output}")
+    return results
+
+def main(argv=None):
+    args = parse_args(argv)
+    with instrumentation.session_from_args("cohort", args):
+        return run(args)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Pipeline Benchmarks
+
+Measures the three pipelines on generated data at increasing scales and
+compares results against a stored baseline to catch regressions.
+
+Cases (pipeline/variant):
+    clean/dict, clean/polars           clean_patient_data with each engine
+    clean/coerce                       clean/dict after bulk age coercion
+                                       (patient_coercion.py)
+    dose/dict, dose/dict-cache,        calculate_all_dosages with each engine
+    dose/numpy                         (dict-cache uses a DosageCache)
+    cohort/cold, cohort/warm           analyze_patient_cohorts with an empty
+                                       and a populated Parquet cache
+    cohort/cached                      a repeated query served by the result
+                                       cache (cold and warm bypass it)
+    cohort/chunked, cohort/approx      out-of-core and sketch-based modes
+
+Each (case, size) runs in a fresh process so peak RSS belongs to that case
+alone. Inputs are generated once per size (seeded) into --data-dir. The
+clean and dose cases stream their input from disk on every run (dose in
+batches of STREAM_BATCH_SIZE orders), so memory stays bounded even at 1e8
+records and their timings include parsing, as the cohort cases' timings
+include reading their CSV or Parquet. A case is timed --repeat times
+(reporting the best and median wall time and throughput in records per
+second), then run once more under tracemalloc to record peak traced
+allocations. dose/dict-cache keeps one DosageCache across its runs.
+
+Usage:
+    python benchmark.py run --sizes 1e3 1e4 1e5 -o results.json
+    python benchmark.py run --cases dose/numpy cohort/warm --sizes 1e6 1e7 1e8
+    python benchmark.py compare baseline.json results.json --threshold 0.10
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmark defaults
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_REPEAT = 3
+DEFAULT_DATA_DIR = ".bench_data"
+DEFAULT_SEED = 1234
+
+# Orders per calculate_all_dosages call when the dose cases stream their input
+STREAM_BATCH_SIZE = 10_000
+
+# Allowed relative growth before compare reports a regression
+DEFAULT_TIME_THRESHOLD = 0.10
+DEFAULT_MEMORY_THRESHOLD = 0.20
+
+CASES = {
+    'clean/dict': ('clean', {'engine': 'dict'}),
+    'clean/polars': ('clean', {'engine': 'polars'}),
+    'clean/coerce': ('clean', {'engine': 'dict', 'coerce': True}),
+    'dose/dict': ('dose', {'engine': 'dict'}),
+    'dose/dict-cache': ('dose', {'engine': 'dict', 'cache': True}),
+    'dose/numpy': ('dose', {'engine': 'numpy'}),
+    'cohort/cold': ('cohort', {'mode': 'exact', 'warm': False}),
+    'cohort/warm': ('cohort', {'mode': 'exact', 'warm': True}),
+    'cohort/cached': ('cohort', {'mode': 'exact', 'warm': True, 'result_cache': True}),
+    'cohort/chunked': ('cohort', {'mode': 'chunked', 'warm': True}),
+    'cohort/approx': ('cohort', {'mode': 'approx', 'warm': True}),
+}
+
+FIRST_NAMES = ['john', 'sarah', 'robert', 'maria', 'li', 'ahmed', 'priya', 'olga', 'kwame', 'ana']
+LAST_NAMES = ['smith', 'johnson', 'williams', 'garcia', 'chen', 'khan', 'patel', 'ivanova',
+              'mensah', 'silva']
+DIAGNOSES = ['hypertension', 'influenza', 'diabetes', 'asthma', 'migraine', 'pneumonia']
+ALLERGIES = ['penicillin', 'aspirin', 'sulfa', 'latex', 'nsaids', 'morphine']
+
+def parse_count(text):
+    """Parse a record count such as 1000, 1e6 or 100_000."""
+    value = float(str(text).replace('_', ''))
+    if value < 1 or value != int(value):
+        raise ValueError(f"Invalid record count {text!r}")
+    return int(value)
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _write_patients(path, records, seed):
+    """Raw patient records for the cleaner (some minors, bad ages, duplicates)."""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for _ in range(records):
+            age = rng.choice([str(rng.randint(1, 95)), str(rng.randint(18, 95)), 'unknown', ''])
+            f.write(json.dumps({
+                'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                'age': age,
+                'gender': rng.choice(['male', 'female']),
+                'diagnosis': rng.choice(DIAGNOSES),
+            }) + '\n')
+
+def _write_orders(path, records, seed):
+    """Medication orders for the dosage calculator (canonical names and aliases)."""
+    dosage = importlib.import_module('2_med_dosage_calculator')
+    spellings = [spelling for spelling, _ in dosage.FORMULARY.spellings()]
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for _ in range(records):
+            f.write(json.dumps({
+                'name': f"{rng.choice(FIRST_NAMES).title()} {rng.choice(LAST_NAMES).title()}",
+                'weight': round(rng.uniform(3, 150), 1),
+                'medication': rng.choice(spellings),
+                'is_first_dose': rng.random() < 0.3,
+                'allergies': rng.sample(ALLERGIES, rng.choice([0, 0, 1, 2])),
+            }) + '\n')
+
+def _write_health_data(path, records, seed):
+    """Cohort input from the synthetic data generator."""
+    generator = importlib.import_module('generate_large_health_data')
+    generator.generate(path, rows=records, seed=seed,
+                       chunk_rows=min(records, generator.DEFAULT_CHUNK_ROWS))
+
+INPUT_WRITERS = {
+    'clean': ('patients-{n}.jsonl', _write_patients),
+    'dose': ('orders-{n}.jsonl', _write_orders),
+    'cohort': ('health-{n}.csv', _write_health_data),
+}
+
+def prepare_input(pipeline, records, data_dir=DEFAULT_DATA_DIR, seed=DEFAULT_SEED):
+    """
+    Return the generated input file for a pipeline and size, creating it once.
+
+    Files are written under a temporary name and renamed, so an interrupted
+    run never leaves a truncated input behind.
+    """
+    pattern, writer = INPUT_WRITERS[pipeline]
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"s{seed}-" + pattern.format(n=records))
+    if not os.path.exists(path):
+        base, ext = os.path.splitext(path)
+        tmp_path = f"{base}.tmp{os.getpid()}{ext}"
+        try:
+            writer(tmp_path, records, seed)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+def _batches(records, size):
+    """Yield lists of up to `size` records."""
+    iterator = iter(records)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def _make_call(case, path, work_dir):
+    """Return a zero-argument callable running the case on its input file."""
+    pipeline, options = CASES[case]
+    cleaner = importlib.import_module('1_patient_data_cleaner')
+    if pipeline == 'clean':
+        coercion = importlib.import_module('patient_coercion') if options.get('coerce') else None
+
+        def run():
+            coercer = coercion.ColumnCoercer() if coercion else None
+            for _ in cleaner.iter_clean_patients(cleaner.iter_patient_records(path),
+                                                 engine=options['engine'], coercer=coercer):
+                pass
+        return run
+
+    if pipeline == 'dose':
+        dosage = importlib.import_module('2_med_dosage_calculator')
+        cache = dosage.DosageCache() if options.get('cache') else None
+
+        def run():
+            records = cleaner.iter_patient_records(path)
+            for batch in _batches(records, STREAM_BATCH_SIZE):
+                dosage.calculate_all_dosages(batch, engine=options['engine'], cache=cache)
+        return run
+
+    cohort = importlib.import_module('3_cohort_analysis')
+    cache_dir = os.path.join(work_dir, 'cache')
+    if options['warm']:
+        cohort.convert_to_parquet(path, cache_dir)
+
+    def run():
+        if not options['warm']:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        if options['mode'] == 'chunked':
+            return cohort.analyze_patient_cohorts_chunked(path, cache_dir=cache_dir)
+        if options['mode'] == 'approx':
+            return cohort.approximate_cohorts(path, cache_dir=cache_dir)
+        return cohort.analyze_patient_cohorts(
+            path, cache_dir=cache_dir, use_result_cache=options.get('result_cache', False))
+    if options['mode'] == 'approx' or options.get('result_cache'):
+        run()  # build the sketch or cache the result once; timings measure queries
+    return run
+
+def _measure(case, path, records, repeat, trace):
+    """Child process: time one case and report its metrics."""
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        call = _make_call(case, path, work_dir)
+        rss_before = peak_rss()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+        result = {
+            'case': case,
+            'records': records,
+            'repeat': repeat,
+            'best_seconds': min(timings),
+            'median_seconds': statistics.median(timings),
+            'throughput_rps': records / statistics.median(timings),
+            'input_rss_bytes': rss_before,
+            'peak_rss_bytes': peak_rss(),
+        }
+        if trace:
+            tracemalloc.start()
+            call()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['alloc_peak_bytes'] = peak
+            result['alloc_retained_bytes'] = current
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_benchmarks(cases=None, sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT,
+                   data_dir=DEFAULT_DATA_DIR, seed=DEFAULT_SEED, trace=True, log=None):
+    """
+    Run benchmark cases at each size.
+
+    Args:
+        cases (list): Case names from CASES (default: all)
+        sizes (list): Record counts
+        repeat (int): Timed runs per case and size
+        data_dir (str): Where generated inputs are kept between runs
+        seed (int): Seed for generated inputs
+        trace (bool): Also record tracemalloc peak allocations
+        log (callable): Called with one progress line per result
+
+    Returns:
+        dict: {'meta': environment description, 'results': list of dicts}
+    """
+    cases = list(CASES) if cases is None else cases
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise ValueError(f"Unknown cases {sorted(unknown)}; expected some of {list(CASES)}")
+
+    # Spawn keeps children free of the parent's Polars thread pool and memory
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for records in sizes:
+            for case in cases:
+                path = prepare_input(CASES[case][0], records, data_dir, seed)
+                result = pool.apply(_measure, (case, path, records, repeat, trace))
+                results.append(result)
+                if log:
+                    log(format_result(result))
+    return {'meta': environment(seed), 'results': results}
+
+def environment(seed=DEFAULT_SEED):
+    """Describe the machine and library versions a run was made with."""
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+    }
+    for name in ('polars', 'numpy'):
+        try:
+            meta[name] = importlib.import_module(name).__version__
+        except ImportError:
+            meta[name] = None
+    return meta
+
+def format_result(result):
+    """One human-readable line for a result."""
+    line = (f"{result['case']:<16} {result['records']:>12,} records  "
+            f"{result['median_seconds']:9.4f}s  {result['throughput_rps']:>14,.0f} rec/s  "
+            f"peak RSS {result['peak_rss_bytes'] / (1 << 20):8.1f} MB")
+    if 'alloc_peak_bytes' in result:
+        line += f"  alloc peak {result['alloc_peak_bytes'] / (1 << 20):8.1f} MB"
+    return line
+
+def compare_results(baseline, current, time_threshold=DEFAULT_TIME_THRESHOLD,
+                    memory_threshold=DEFAULT_MEMORY_THRESHOLD):
+    """
+    Compare two result sets case by case.
+
+    A case regresses if its median time grows by more than time_threshold,
+    or its peak RSS or traced allocation peak grows by more than
+    memory_threshold (relative to the baseline).
+
+    Args:
+        baseline (dict): Results written by run_benchmarks
+        current (dict): Results to check
+
+    Returns:
+        list: One dict per case in current with case, records, per-metric
+        ratios (current / baseline, None if not in the baseline) and
+        'regressions' (names of metrics over threshold)
+    """
+    thresholds = {
+        'median_seconds': time_threshold,
+        'peak_rss_bytes': memory_threshold,
+        'alloc_peak_bytes': memory_threshold,
+    }
+    previous = {(r['case'], r['records']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = previous.get((result['case'], result['records']))
+        row = {'case': result['case'], 'records': result['records'], 'regressions': []}
+        for metric, threshold in thresholds.items():
+            if before is None or not before.get(metric) or metric not in result:
+                row[metric] = None
+                continue
+            ratio = result[metric] / before[metric]
+            row[metric] = ratio
+            if ratio > 1 + threshold:
+                row['regressions'].append(metric)
+        rows.append(row)
+    return rows
+
+def print_comparison(rows):
+    """Print compare_results output as a table."""
+    def ratio(value):
+        return '       new' if value is None else f"{value:9.2f}x"
+
+    print(f"{'case':<16} {'records':>12}  {'time':>10} {'peak RSS':>10} {'alloc':>10}")
+    for row in rows:
+        flag = '  REGRESSION: ' + ', '.join(row['regressions']) if row['regressions'] else ''
+        print(f"{row['case']:<16} {row['records']:>12,}  {ratio(row['median_seconds'])} "
+              f"{ratio(row['peak_rss_bytes'])} {ratio(row['alloc_peak_bytes'])}{flag}")
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the patient data pipelines.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Run benchmarks and write JSON results")
+    run.add_argument('--cases', nargs='+', choices=list(CASES), help="Cases (default: all)")
+    run.add_argument('--sizes', nargs='+', type=parse_count, default=DEFAULT_SIZES,
+                     help="Record counts, e.g. 1e3 1e6 1e8")
+    run.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                     help="Directory for generated inputs (reused across runs)")
+    run.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    run.add_argument('--no-tracemalloc', action='store_true',
+                     help="Skip the extra traced run per case")
+    run.add_argument('-o', '--output', default='benchmark_results.json')
+
+    compare = commands.add_parser('compare', help="Compare results against a baseline")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_TIME_THRESHOLD,
+                         help="Allowed relative slowdown (default: 0.10)")
+    compare.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD,
+                         help="Allowed relative memory growth (default: 0.20)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'run':
+        results = run_benchmarks(args.cases, args.sizes, args.repeat, args.data_dir,
+                                 args.seed, not args.no_tracemalloc, log=print)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare_results(baseline, current, args.threshold, args.memory_threshold)
+    print_comparison(rows)
+    regressions = sum(1 for row in rows if row['regressions'])
+    print(f"\n{regressions} regression(s)" if regressions else "\nNo regressions")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Dosage Service
+
+Serves calculate_dosage from 2_med_dosage_calculator.py to many order-entry
+clients at once over a local asyncio JSON-lines socket.
+
+Protocol:
+    Each request is one JSON object per line; each response is one JSON
+    object per line, in the same order as the requests on that connection.
+
+    {"name": "John Smith", "weight": 80, "medication": "epinephrine", ...}
+        -> the order with dosage fields added (as calculate_dosage returns)
+        -> {"error": "..."} if the order is invalid or the service is full
+    {"op": "stats"}
+        -> request/batch counters and p50/p99 latency in milliseconds
+
+Micro-batching:
+    Requests are queued and grouped into batches that close when they reach
+    max_batch_size or when the oldest request has waited max_latency seconds.
+    Each batch is evaluated with the vectorized NumPy engine. When the queue
+    is full new requests are rejected immediately (backpressure) instead of
+    queueing without bound. Each connection may have max_pipelined requests
+    awaiting their responses; beyond that the service stops reading from the
+    connection until responses have been written, so a client that sends
+    without reading is slowed down by TCP rather than buffered in memory.
+
+Usage:
+    python dosage_service.py --port 8765
+    printf '{"weight": 70, "medication": "amiodarone", "is_first_dose": true}\\n' | nc localhost 8765
+"""
+
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import time
+
+dosage_calculator = importlib.import_module('2_med_dosage_calculator')
+
+# Default micro-batching limits
+MAX_BATCH_SIZE = 512
+MAX_LATENCY = 0.005
+MAX_QUEUE = 10_000
+
+# Requests one connection may have awaiting responses before reading pauses
+MAX_PIPELINED = 1024
+
+# Number of recent request latencies kept for percentile reporting
+LATENCY_WINDOW = 100_000
+
+class ServiceOverloaded(Exception):
+    """Raised when the request queue is full."""
+
+class LatencyRecorder:
+    """Keeps a sliding window of request latencies for percentile reporting."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = collections.deque(maxlen=window)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, q):
+        """Return the q-th percentile (0-100) in milliseconds, or None if empty."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+class DosageService:
+    """
+    Micro-batching front end for the dosage calculator.
+
+    Example:
+        service = DosageService()
+        await service.start()
+        result = await service.submit({"weight": 70, "medication": "fentanyl"})
+        await service.close()
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_latency=MAX_LATENCY,
+                 max_queue=MAX_QUEUE, engine='numpy', max_pipelined=MAX_PIPELINED):
+        """
+        Args:
+            max_batch_size (int): Largest number of orders evaluated together
+            max_latency (float): Longest time (seconds) the first order in a
+                batch waits for the batch to fill
+            max_queue (int): Queued orders allowed before rejecting new ones
+            engine (str): Dosage engine used for each batch
+            max_pipelined (int): Requests per connection awaiting responses
+                before the service stops reading from that connection
+        """
+        if max_pipelined < 1:
+            raise ValueError("max_pipelined must be at least 1")
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.engine = engine
+        self.max_pipelined = max_pipelined
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._batcher = None
+        # Batch being collected or evaluated, so close() can fail its orders
+        self._inflight = []
+        self.latency = LatencyRecorder()
+        self.counters = {'requests': 0, 'batches': 0, 'evaluated': 0, 'rejected': 0, 'errors': 0}
+
+    async def start(self):
+        """Start the background batching task."""
+        if self._batcher is None:
+            self._batcher = asyncio.create_task(self._run_batches())
+
+    async def close(self):
+        """Stop batching; queued and in-flight requests are failed."""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        pending = self._inflight
+        self._inflight = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(ServiceOverloaded("service stopped"))
+
+    async def submit(self, order):
+        """
+        Queue one order and wait for its dosage result.
+
+        Args:
+            order (dict): Patient order as accepted by calculate_dosage
+
+        Returns:
+            dict: The order with dosage fields added
+
+        Raises:
+            ServiceOverloaded: If the queue is full
+            ValueError: If the order is invalid
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((order, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            raise ServiceOverloaded("dosage service queue is full") from None
+        self.counters['requests'] += 1
+        return await future
+
+    async def _next_batch(self):
+        """Wait for one order, then collect more until the size or deadline is hit."""
+        self._inflight = batch = []
+        batch.append(await self._queue.get())
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _evaluate(self, orders):
+        """Run one batch; fall back to per-order evaluation to isolate bad orders."""
+        try:
+            results, _ = dosage_calculator.calculate_all_dosages(orders, engine=self.engine)
+            return results
+        except Exception:
+            # Service boundary: one bad order must not fail the whole batch
+            results = []
+            for order in orders:
+                try:
+                    results.append(dosage_calculator.calculate_dosage(order))
+                except Exception as e:
+                    results.append(e if isinstance(e, ValueError) else ValueError(str(e)))
+            return results
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            orders = [order for order, _, _ in batch]
+            results = await loop.run_in_executor(None, self._evaluate, orders)
+            self.counters['batches'] += 1
+            self.counters['evaluated'] += len(batch)
+
+            now = time.perf_counter()
+            for (_, future, started), result in zip(batch, results):
+                self.latency.record(now - started)
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    self.counters['errors'] += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._inflight = []
+
+    def stats(self):
+        """
+        Report service counters and latency percentiles.
+
+        Returns:
+            dict: requests, batches, evaluated, rejected, errors, queued,
+            mean_batch_size, p50_ms and p99_ms
+        """
+        batches = self.counters['batches']
+        return {
+            **self.counters,
+            'queued': self._queue.qsize(),
+            'mean_batch_size': self.counters['evaluated'] / batches if batches else 0.0,
+            'p50_ms': self.latency.percentile(50),
+            'p99_ms': self.latency.percentile(99),
+        }
+
+    async def _respond(self, line):
+        """Turn one request line into one response object."""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            return {'error': f"invalid JSON: {e}"}
+        if not isinstance(request, dict):
+            return {'error': "request must be a JSON object"}
+        if request.get('op') == 'stats':
+            return self.stats()
+        try:
+            return await self.submit(request)
+        except (ServiceOverloaded, ValueError) as e:
+            return {'error': str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve one client connection.
+
+        Requests on a connection are evaluated concurrently (so a single
+        pipelining client can fill a batch) but answered in order. At most
+        max_pipelined of them are in flight; reading waits for the rest.
+        """
+        pending = asyncio.Queue(maxsize=self.max_pipelined)
+
+        async def write_responses():
+            connected = True
+            while (task := await pending.get()) is not None:
+                response = await task
+                if not connected:
+                    # Keep consuming so the reader is never left blocked on put()
+                    continue
+                try:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+
+        responder = asyncio.create_task(write_responses())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.create_task(self._respond(line)))
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """
+        Start the batcher and listen for JSON-lines clients.
+
+        Returns:
+            asyncio.Server: The listening server (port 0 picks a free port)
+        """
+        await self.start()
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+class DosageClient:
+    """Minimal JSON-lines client for DosageService."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8765):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request_many(self, requests):
+        """Send several requests on this connection and return their responses."""
+        for request in requests:
+            self._writer.write(json.dumps(request).encode() + b'\n')
+        await self._writer.drain()
+        return [json.loads(await self._reader.readline()) for _ in requests]
+
+    async def request(self, request):
+        """Send one request and return its response."""
+        return (await self.request_many([request]))[0]
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Serve dosage calculations over JSON lines.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-latency-ms', type=float, default=MAX_LATENCY * 1000)
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE)
+    parser.add_argument('--max-pipelined', type=int, default=MAX_PIPELINED)
+    return parser.parse_args(argv)
+
+async def _serve_forever(args):
+    service = DosageService(args.max_batch_size, args.max_latency_ms / 1000, args.max_queue,
+                            max_pipelined=args.max_pipelined)
+    server = await service.serve(args.host, args.port)
+    print(f"Dosage service listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    """Main function to run the service."""
+    try:
+        asyncio.run(_serve_forever(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
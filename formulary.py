@@ -0,0 +1,328 @@
+"""
+Medication Formulary
+
+Loads the medication rules used by the dosage calculator from a JSON or TOML
+rule file and compiles them once into immutable per-medication records.
+
+Rule file format (JSON shown; TOML uses the same structure):
+
+    {
+        "medications": {
+            "epinephrine": {
+                "factor": 0.01,
+                "indication": "Anaphylaxis",
+                "loading_dose": false,
+                "warnings": ["Monitor for arrhythmias"],
+                "aliases": ["adrenaline", "EpiPen", "epinephrin"],
+                "allergy_classes": ["sulfites"]
+            },
+            ...
+        }
+    }
+
+Name normalization (case and whitespace) and alias resolution (brand names,
+common misspellings) are done at compile time: every accepted spelling is a
+key of one lookup dictionary, so a lookup is a single dict access. Other case
+and spacing variants are normalized on lookup; the dictionary never changes
+after compilation.
+
+Allergy screening uses an inverted index from allergen (allergy class or any
+spelling of the medication itself) to the medications it contraindicates;
+see AllergyIndex.
+
+Example:
+    formulary = load_formulary("data/formulary.json")
+    rule = formulary.get("Adrenaline")
+    rule.name, rule.factor, rule.warnings  # ('epinephrine', 0.01, (...))
+"""
+
+import json
+import os
+import sys
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+# Default rule file shipped with the project
+DEFAULT_FORMULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                      'data', 'formulary.json')
+
+# Keys allowed in a medication entry
+_RULE_KEYS = {'factor', 'indication', 'loading_dose', 'warnings', 'aliases', 'allergy_classes'}
+
+def normalize_name(name):
+    """Normalize a medication or allergen name: collapse whitespace and casefold."""
+    return ' '.join(str(name).split()).casefold()
+
+class MedicationRule:
+    """
+    Immutable, compiled rule for one medication.
+
+    Attributes:
+        name (str): Canonical medication name
+        code (int): Dense integer code (position in the formulary)
+        factor (float): Dosage factor in mg per kg
+        loading_dose (bool): Whether first doses use a loading dose
+        warnings (tuple): Monitoring warnings
+        allergy_classes (frozenset): Normalized allergen names/classes that
+            contraindicate this medication
+        indication (str): What the medication is used for
+    """
+
+    __slots__ = ('name', 'code', 'factor', 'loading_dose', 'warnings',
+                 'allergy_classes', 'indication')
+
+    def __init__(self, name, code, factor, loading_dose=False, warnings=(),
+                 allergy_classes=(), indication=''):
+        values = {
+            'name': name,
+            'code': code,
+            'factor': float(factor),
+            'loading_dose': bool(loading_dose),
+            'warnings': tuple(warnings),
+            'allergy_classes': frozenset(normalize_name(a) for a in allergy_classes),
+            'indication': indication,
+        }
+        for slot, value in values.items():
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return (f"MedicationRule(name={self.name!r}, factor={self.factor}, "
+                f"loading_dose={self.loading_dose}, warnings={self.warnings})")
+
+class Formulary:
+    """
+    Compiled set of medication rules with O(1) lookup by any accepted name.
+    """
+
+    def __init__(self, rules, aliases, source=None):
+        """
+        Use compile_formulary() or load_formulary() rather than calling this.
+
+        Args:
+            rules (tuple): MedicationRule objects ordered by code
+            aliases (dict): Every accepted spelling -> MedicationRule
+            source (str): Rule file the formulary was loaded from
+        """
+        self.rules = rules
+        self.source = source
+        self._lookup = aliases
+        self._allergy_index = None
+
+    def get(self, medication, default=None):
+        """
+        Look up a medication by canonical name, alias or misspelling.
+
+        Args:
+            medication (str): Name as it appears in an order
+
+        Returns:
+            MedicationRule or default
+        """
+        rule = self._lookup.get(medication)
+        if rule is None and isinstance(medication, str):
+            # Other spellings are normalized on every miss; the lookup never changes
+            rule = self._lookup.get(normalize_name(medication))
+        return default if rule is None else rule
+
+    def __getitem__(self, medication):
+        rule = self.get(medication)
+        if rule is None:
+            raise KeyError(medication)
+        return rule
+
+    def __contains__(self, medication):
+        return self.get(medication) is not None
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    @property
+    def names(self):
+        """Canonical medication names ordered by code."""
+        return tuple(rule.name for rule in self.rules)
+
+    def dosage_factors(self):
+        """Return {canonical name: factor}, the shape of DOSAGE_FACTORS."""
+        return {rule.name: rule.factor for rule in self.rules}
+
+    def loading_dose_medications(self):
+        """Return the canonical names of medications that use loading doses."""
+        return frozenset(rule.name for rule in self.rules if rule.loading_dose)
+
+    def spellings(self):
+        """Yield (spelling, rule) for every accepted medication spelling."""
+        return self._lookup.items()
+
+    @property
+    def allergy_index(self):
+        """Shared AllergyIndex for this formulary (built on first use)."""
+        if self._allergy_index is None:
+            self._allergy_index = AllergyIndex(self)
+        return self._allergy_index
+
+class AllergyIndex:
+    """
+    Inverted index from allergen to the medications it contraindicates.
+
+    A patient allergy conflicts with a medication if it names one of the
+    medication's allergy classes, or the medication itself under any of its
+    accepted spellings. Allergies already in normalized form cost one dict
+    lookup; other spellings are normalized on every miss rather than cached,
+    so free-text allergies from a long-running census do not accumulate.
+    """
+
+    def __init__(self, formulary):
+        """
+        Args:
+            formulary (Formulary): Compiled formulary to index
+        """
+        conflicts = {}
+        for rule in formulary:
+            for allergen in rule.allergy_classes:
+                conflicts.setdefault(allergen, set()).add(rule.code)
+        for spelling, rule in formulary.spellings():
+            conflicts.setdefault(normalize_name(spelling), set()).add(rule.code)
+
+        self.formulary = formulary
+        self._conflicts = {sys.intern(allergen): frozenset(codes)
+                           for allergen, codes in conflicts.items()}
+
+    def intern(self, allergy):
+        """Return the normalized, interned form of an allergy string."""
+        return sys.intern(normalize_name(allergy))
+
+    def medications_for(self, allergy):
+        """
+        Return the codes of medications an allergy contraindicates.
+
+        Args:
+            allergy (str): Allergy as written on the patient record
+
+        Returns:
+            frozenset: Medication codes (empty if none)
+        """
+        codes = self._conflicts.get(allergy)
+        if codes is None and isinstance(allergy, str):
+            codes = self._conflicts.get(normalize_name(allergy))
+        return frozenset() if codes is None else codes
+
+    def conflicts(self, medication, allergies):
+        """
+        Screen one order.
+
+        Args:
+            medication (str or MedicationRule): Ordered medication
+            allergies (iterable or str): Patient allergy strings, or a
+                single allergy
+
+        Returns:
+            list: The allergies that contraindicate the medication, in the
+            order given (empty if the order is safe or the medication is unknown)
+        """
+        rule = medication if isinstance(medication, MedicationRule) else self.formulary.get(medication)
+        if rule is None or not allergies:
+            return []
+        if isinstance(allergies, str):
+            allergies = (allergies,)
+        code = rule.code
+        return [allergy for allergy in allergies if code in self.medications_for(allergy)]
+
+    def screen(self, orders):
+        """
+        Screen a batch of orders (e.g. a whole ER census) at once.
+
+        Args:
+            orders (iterable): Dicts with 'medication' and optional 'allergies'
+
+        Returns:
+            list: One list of conflicting allergies per order
+        """
+        conflicts = self.conflicts
+        return [conflicts(order.get('medication'), order.get('allergies') or ())
+                for order in orders]
+
+def compile_formulary(spec, source=None):
+    """
+    Validate a parsed rule file and compile it into a Formulary.
+
+    Args:
+        spec (dict): Parsed rule file with a 'medications' mapping
+        source (str): Where the spec came from (for error messages)
+
+    Returns:
+        Formulary
+
+    Raises:
+        ValueError: If the spec is malformed or two medications claim the
+            same alias
+    """
+    where = f" in {source}" if source else ""
+    medications = spec.get('medications') if isinstance(spec, dict) else None
+    if not isinstance(medications, dict) or not medications:
+        raise ValueError(f"Formulary{where} must define a non-empty 'medications' table")
+
+    rules = []
+    lookup = {}
+    for code, (name, entry) in enumerate(medications.items()):
+        unknown = set(entry) - _RULE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)} for {name!r}{where}")
+        factor = entry.get('factor')
+        if isinstance(factor, bool) or not isinstance(factor, (int, float)) or factor < 0:
+            raise ValueError(f"{name!r}{where} needs a non-negative numeric 'factor'")
+
+        rule = MedicationRule(
+            name=name,
+            code=code,
+            factor=factor,
+            loading_dose=entry.get('loading_dose', False),
+            warnings=entry.get('warnings', ()),
+            allergy_classes=entry.get('allergy_classes', ()),
+            indication=entry.get('indication', ''),
+        )
+        rules.append(rule)
+
+        for spelling in [name, *entry.get('aliases', ())]:
+            # Register both the spelling as written and its normalized form
+            for key in {spelling, normalize_name(spelling)}:
+                if lookup.setdefault(key, rule) is not rule:
+                    raise ValueError(f"Name {spelling!r}{where} is claimed by both "
+                                     f"{lookup[key].name!r} and {name!r}")
+
+    return Formulary(tuple(rules), lookup, source)
+
+def load_formulary(path=DEFAULT_FORMULARY_PATH):
+    """
+    Load and compile a JSON or TOML rule file.
+
+    Args:
+        path (str): Path to a .json or .toml rule file
+
+    Returns:
+        Formulary
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        ValueError: If the file cannot be parsed or fails validation
+    """
+    if path.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("TOML formularies require Python 3.11+ (tomllib)")
+        with open(path, 'rb') as file:
+            spec = tomllib.load(file)
+    else:
+        with open(path, 'r') as file:
+            spec = json.load(file)
+    return compile_formulary(spec, source=path)
@@ -1,8 +1,48 @@
-import pandas as pd
+"""
+Synthetic Health Data Generator
+
+Generates the large patient table used by the cohort analysis (and as load
+test data for the other pipelines) without network access. Rows are drawn
+from a bundled seed distribution (data/seed_distribution.json): per-outcome
+quantile tables for each clinical column, approximating the Pima Indians
+Diabetes dataset, plus a diagnosis label.
+
+Generation:
+    The requested rows are split into fixed-size chunks. Each chunk gets its
+    own independent random stream from numpy's SeedSequence(seed).spawn(), is
+    generated in a process pool and written to its own part file; parts are
+    then joined in chunk order. The output is therefore byte-identical for a
+    given seed and chunk size, whatever the number of workers, and memory use
+    is bounded by the chunk size, so 100M+ rows are fine.
+
+Output formats:
+    csv          - one CSV file
+    parquet      - one Parquet file
+    arrow        - one uncompressed Arrow IPC (Feather v2) file, which the cohort
+                   analysis memory-maps instead of parsing
+    partitioned  - a directory of Hive partitions, diagnosis=<value>/part-<chunk>.parquet
+
+Usage:
+    python generate_large_health_data.py
+    python generate_large_health_data.py --rows 100000000 --workers 16 -o patients.parquet
+    python generate_large_health_data.py --format partitioned -o patients_dataset --seed 7
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
 import numpy as np
+import polars as pl
 
-# Source small dataset URL (synthetic diabetes data from UCI or similar)
-SOURCE_URL = "https://raw.githubusercontent.com/plotly/datasets/master/diabetes.csv"
+# Bundled seed distribution
+DEFAULT_DISTRIBUTION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'data', 'seed_distribution.json')
 
 # Number of rows to generate
 TARGET_ROWS = 5_000_000
@@ -10,34 +50,241 @@ TARGET_ROWS = 5_000_000
 # Output file
 OUTPUT_CSV = "patients_large.csv"
 
-def main():
-    print("Loading source data...")
-    df = pd.read_csv(SOURCE_URL)
-    original_len = len(df)
-    print(f"Original rows: {original_len}")
+# Generation defaults
+DEFAULT_SEED = 42
+DEFAULT_CHUNK_ROWS = 1_000_000
+OUTPUT_FORMATS = ('csv', 'parquet', 'arrow', 'partitioned')
+
+# Output column order
+COLUMNS = ["Pregnancies", "Glucose", "BloodPressure", "SkinThickness", "Insulin", "BMI",
+           "DiabetesPedigreeFunction", "Age", "Outcome", "diagnosis"]
+
+# Written into partitioned output directories; marks them as safe to replace
+GENERATOR_MANIFEST = "_generator.json"
+
+def load_distribution(path=DEFAULT_DISTRIBUTION):
+    """
+    Load and validate a seed distribution file.
+
+    Args:
+        path (str): JSON distribution file
+
+    Returns:
+        dict: The parsed distribution
+
+    Raises:
+        ValueError: If the file is malformed
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    probabilities = spec.get('probabilities')
+    if not probabilities or probabilities[0] != 0 or probabilities[-1] != 1:
+        raise ValueError(f"{path}: 'probabilities' must run from 0 to 1")
+    if not 0 <= spec.get('outcome_rate', -1) <= 1:
+        raise ValueError(f"{path}: 'outcome_rate' must be between 0 and 1")
+    for column in COLUMNS[:-2]:
+        entry = spec.get('columns', {}).get(column)
+        if entry is None:
+            raise ValueError(f"{path}: missing column {column!r}")
+        if (len(entry['quantiles']) != 2
+                or any(len(q) != len(probabilities) for q in entry['quantiles'])):
+            raise ValueError(f"{path}: {column!r} needs two quantile lists "
+                             f"(outcome 0 and 1) matching 'probabilities'")
+    diagnosis = spec.get('diagnosis', {})
+    if len(diagnosis.get('values', ())) != len(diagnosis.get('weights', ())):
+        raise ValueError(f"{path}: diagnosis values and weights differ in length")
+    return spec
+
+def chunk_layout(rows, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Split a row count into chunk sizes (all chunk_rows except the last)."""
+    if rows <= 0 or chunk_rows <= 0:
+        raise ValueError("rows and chunk_rows must be positive")
+    full, rest = divmod(rows, chunk_rows)
+    return [chunk_rows] * full + ([rest] if rest else [])
+
+def generate_chunk(distribution, rows, seed_sequence):
+    """
+    Generate one chunk of patients.
 
-    reps = TARGET_ROWS // original_len + 1
-    print(f"Replicating data {reps} times...")
+    Args:
+        distribution (dict): Seed distribution (see load_distribution)
+        rows (int): Rows to generate
+        seed_sequence (np.random.SeedSequence): This chunk's random stream
 
-    big_df = pd.concat([df] * reps, ignore_index=True)
-    big_df = big_df.head(TARGET_ROWS)
+    Returns:
+        pl.DataFrame: Rows in COLUMNS order
+    """
+    rng = np.random.default_rng(seed_sequence)
+    probabilities = np.asarray(distribution['probabilities'], dtype=float)
+    outcome = (rng.random(rows) < distribution['outcome_rate']).astype(np.int64)
 
-    # Add some noise to age and glucose to avoid exact duplicates
-    np.random.seed(42)
-    big_df['Age'] = big_df['Age'] + np.random.randint(-5, 6, size=TARGET_ROWS)
-    big_df['Glucose'] = big_df['Glucose'] + np.random.randint(-10, 11, size=TARGET_ROWS)
+    data = {}
+    for column in COLUMNS[:-2]:
+        entry = distribution['columns'][column]
+        u = rng.random(rows)
+        missing = rng.random(rows) < np.asarray(entry['zero_fraction'])[outcome]
+        values = np.empty(rows)
+        for label in (0, 1):
+            mask = outcome == label
+            values[mask] = np.interp(u[mask], probabilities, entry['quantiles'][label])
+        values[missing] = 0
+        decimals = entry['decimals']
+        data[column] = np.round(values, decimals) if decimals else np.rint(values).astype(np.int64)
+    data['Outcome'] = outcome
 
-    # Clip to realistic ranges
-    big_df['Age'] = big_df['Age'].clip(lower=0, upper=120)
-    big_df['Glucose'] = big_df['Glucose'].clip(lower=0)
+    diagnosis = distribution['diagnosis']
+    weights = np.asarray(diagnosis['weights'], dtype=float)
+    codes = rng.choice(len(weights), size=rows, p=weights / weights.sum())
+    data['diagnosis'] = np.asarray(diagnosis['values'], dtype=object)[codes]
+    return pl.DataFrame(data).select(COLUMNS)
 
-    # Add a fake diagnosis column
-    diagnoses = ['Diabetes', 'Pre-diabetes', 'No Diabetes']
-    big_df['diagnosis'] = np.random.choice(diagnoses, size=TARGET_ROWS, p=[0.3, 0.2, 0.5])
+def _write_chunk(index, rows, seed_sequence, distribution, fmt, target):
+    """
+    Worker: generate chunk `index` and write it under `target`.
 
-    print(f"Saving {TARGET_ROWS} rows to {OUTPUT_CSV}...")
-    big_df.to_csv(OUTPUT_CSV, index=False)
+    CSV, Parquet and Arrow chunks are written to target (CSV only chunk 0 has the
+    header); partitioned chunks write one file per diagnosis under the
+    target directory.
+
+    Returns:
+        int: Rows written
+    """
+    chunk = generate_chunk(distribution, rows, seed_sequence)
+    if fmt == 'csv':
+        chunk.write_csv(target, include_header=index == 0)
+    elif fmt == 'parquet':
+        chunk.write_parquet(target)
+    elif fmt == 'arrow':
+        chunk.write_ipc(target)
+    else:
+        for (diagnosis,), part in chunk.group_by('diagnosis', maintain_order=True):
+            directory = os.path.join(target, f"diagnosis={quote(str(diagnosis), safe='')}")
+            os.makedirs(directory, exist_ok=True)
+            part.drop('diagnosis').write_parquet(
+                os.path.join(directory, f"part-{index:05d}.parquet"))
+    return chunk.height
+
+def _infer_format(output):
+    """Pick the output format from the output path."""
+    if output.endswith('.parquet'):
+        return 'parquet'
+    if output.endswith('.csv'):
+        return 'csv'
+    if output.endswith(('.arrow', '.feather', '.ipc')):
+        return 'arrow'
+    return 'partitioned'
+
+def _check_replaceable(output, fmt):
+    """Refuse to replace a directory this generator did not write."""
+    if os.path.isdir(output):
+        if fmt != 'partitioned' or not (
+                os.path.exists(os.path.join(output, GENERATOR_MANIFEST)) or not os.listdir(output)):
+            raise ValueError(f"{output} is an existing directory not written by this generator")
+
+def generate(output=OUTPUT_CSV, rows=TARGET_ROWS, seed=DEFAULT_SEED,
+             chunk_rows=DEFAULT_CHUNK_ROWS, workers=None, fmt=None,
+             distribution_path=DEFAULT_DISTRIBUTION):
+    """
+    Generate a synthetic patient table.
+
+    Args:
+        output (str): Output file (csv/parquet/arrow) or directory (partitioned)
+        rows (int): Total rows
+        seed (int): Root seed
+        chunk_rows (int): Rows per chunk; part of the output's identity
+        workers (int): Worker processes (default: CPU count; 1 runs inline)
+        fmt (str): 'csv', 'parquet', 'arrow' or 'partitioned' (default: from output)
+        distribution_path (str): Seed distribution file
+
+    Returns:
+        dict: output, format, rows, chunks and seed
+    """
+    fmt = fmt or _infer_format(output)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {OUTPUT_FORMATS}")
+    _check_replaceable(output, fmt)
+    distribution = load_distribution(distribution_path)
+    sizes = chunk_layout(rows, chunk_rows)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    parent = os.path.dirname(os.path.abspath(output))
+    work_dir = tempfile.mkdtemp(prefix='.generate_', dir=parent)
+    try:
+        if fmt == 'partitioned':
+            targets = [work_dir] * len(sizes)
+        else:
+            targets = [os.path.join(work_dir, f"part-{i:05d}.{fmt}") for i in range(len(sizes))]
+        jobs = [(i, size, seeds[i], distribution, fmt, targets[i]) for i, size in enumerate(sizes)]
+
+        if workers == 1 or len(jobs) == 1:
+            written = [_write_chunk(*job) for job in jobs]
+        else:
+            # Spawn, not fork: forking after Polars has started its thread pool can deadlock
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                written = list(pool.map(_write_chunk, *zip(*jobs)))
+
+        if fmt == 'partitioned':
+            with open(os.path.join(work_dir, GENERATOR_MANIFEST), 'w') as f:
+                json.dump({'rows': rows, 'seed': seed, 'chunk_rows': chunk_rows}, f, indent=2)
+            if os.path.isdir(output):
+                shutil.rmtree(output)
+            os.replace(work_dir, output)
+            work_dir = None
+        else:
+            joined = os.path.join(work_dir, f"joined.{fmt}")
+            if fmt == 'csv':
+                with open(joined, 'wb') as out:
+                    for target in targets:
+                        with open(target, 'rb') as part:
+                            shutil.copyfileobj(part, out)
+            elif fmt == 'arrow':
+                pl.scan_ipc(targets).sink_ipc(joined)
+            else:
+                pl.scan_parquet(targets).sink_parquet(joined)
+            os.replace(joined, output)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {'output': output, 'format': fmt, 'rows': sum(written), 'chunks': len(sizes),
+            'seed': seed}
+
+def add_arguments(parser):
+    """Add the generator options to a parser."""
+    parser.add_argument('-o', '--output', default=OUTPUT_CSV,
+                        help=f"Output file or directory (default: {OUTPUT_CSV})")
+    parser.add_argument('--rows', type=int, default=TARGET_ROWS,
+                        help=f"Rows to generate (default: {TARGET_ROWS:,})")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="Root random seed")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Rows per chunk; output is reproducible for a given seed "
+                             "and chunk size")
+    parser.add_argument('--workers', type=int,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help="Output format (default: from the output path)")
+    parser.add_argument('--distribution', default=DEFAULT_DISTRIBUTION,
+                        help="Seed distribution JSON file")
+
+def parse_args(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Generate synthetic patient data offline.")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+def run(args):
+    """Generate data as configured by parsed command-line arguments."""
+    print(f"Generating {args.rows:,} rows (seed {args.seed}, {args.chunk_rows:,} rows per chunk)...")
+    summary = generate(args.output, args.rows, args.seed, args.chunk_rows, args.workers,
+                       args.format, args.distribution)
+    print(f"Saved {summary['rows']:,} rows to {summary['output']} ({summary['format']}, "
+          f"{summary['chunks']} chunks).")
     print("Done.")
+    return summary
+
+def main(argv=None):
+    return run(parse_args(argv))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,379 @@
+"""
+Pipeline Instrumentation
+
+Lightweight metrics and profiling hooks shared by the three scripts. Core
+functions report per-stage timings, record counts, bytes read and cache
+hits/misses; each script's main() can export them as a JSON-lines metrics
+file or in Prometheus text format, and wrap the run in a profiler.
+
+Recording is disabled by default. While disabled, stage() returns one shared
+no-op context manager and the other hooks return after a single flag check,
+so instrumented code pays a few hundred nanoseconds per stage (stages wrap
+whole loads, batches or queries, never single records).
+
+Stages:
+    load       reading input records
+    clean      cleaning (and de-duplicating) patient records
+    coerce     bulk age/weight parsing (patient_coercion.py)
+    dedup      duplicate-index lookups (timed only while recording)
+    dosage     dosage calculation
+    hash       hashing source files for the conversion cache
+    convert    CSV to Parquet conversion
+    partition  writing the partitioned dataset
+    scan       partition pruning; records/bytes are the files left to read
+    aggregate  Parquet scan and group-by (fused in Polars' streaming engine)
+
+Caches:
+    dosage (DosageCache lookups), file_hash, parquet, dataset, cube, rollup
+    and result (cohort analysis caches)
+
+Profiling:
+    --profile PATH samples the main thread's stack every millisecond and
+    writes collapsed stacks ("outer;inner count" per line), the input format
+    of flamegraph.pl, inferno and speedscope. --profiler cprofile writes a
+    cProfile stats file instead (for pstats, snakeviz or flameprof).
+
+Example:
+    with instrumentation.session("dose", metrics_path="metrics.jsonl"):
+        with instrumentation.stage("load") as s:
+            orders = load(path)
+            s.records = len(orders)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Profilers accepted by --profiler
+PROFILERS = ('sample', 'cprofile')
+
+# Seconds between stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.001
+
+# Prometheus metric name prefix
+METRIC_PREFIX = 'pipeline'
+
+_enabled = False
+_stages = {}
+_counters = {}
+_caches = {}
+
+class _NullStage:
+    """Shared stand-in for Stage while recording is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class Stage:
+    """
+    Times one execution of a stage. Set .records and .bytes inside the block.
+    """
+
+    __slots__ = ('name', 'records', 'bytes', '_start')
+
+    def __init__(self, name, records=0, nbytes=0):
+        self.name = name
+        self.records = records
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _add_stage(self.name, time.perf_counter() - self._start, self.records, self.bytes)
+        return False
+
+def _add_stage(name, seconds, records=0, nbytes=0, calls=1):
+    totals = _stages.get(name)
+    if totals is None:
+        totals = _stages[name] = {'calls': 0, 'seconds': 0.0, 'records': 0, 'bytes': 0}
+    totals['calls'] += calls
+    totals['seconds'] += seconds
+    totals['records'] += records or 0
+    totals['bytes'] += nbytes or 0
+
+def enabled():
+    """Whether metrics are being recorded."""
+    return _enabled
+
+def enable():
+    """Start recording metrics."""
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Stop recording metrics (recorded values are kept until reset())."""
+    global _enabled
+    _enabled = False
+
+def reset():
+    """Discard all recorded metrics."""
+    _stages.clear()
+    _counters.clear()
+    _caches.clear()
+
+def stage(name, records=0, nbytes=0):
+    """
+    Context manager timing one stage.
+
+    Args:
+        name (str): Stage name (see the module docstring)
+        records (int): Records processed (may also be set on the result)
+        nbytes (int): Bytes read (may also be set as .bytes on the result)
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return Stage(name, records, nbytes)
+
+def count(name, value=1):
+    """Add to a named event counter."""
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+def cache(name, hits=0, misses=0):
+    """Add cache hits and misses for a named cache."""
+    if _enabled:
+        totals = _caches.setdefault(name, {'hits': 0, 'misses': 0})
+        totals['hits'] += hits
+        totals['misses'] += misses
+
+def timed_calls(name, function):
+    """
+    Wrap a frequently called function so its calls accumulate into a stage.
+
+    Returns the function unchanged while recording is disabled, so callers
+    can wrap once before a loop at no cost.
+    """
+    if not _enabled:
+        return function
+    _add_stage(name, 0.0, calls=0)
+    totals = _stages[name]
+    perf_counter = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            totals['seconds'] += perf_counter() - start
+            totals['calls'] += 1
+            totals['records'] += 1
+
+    return wrapper
+
+def snapshot():
+    """
+    Return the recorded metrics.
+
+    Returns:
+        dict: stages ({name: calls, seconds, records, bytes,
+        records_per_second}), counters ({name: value}) and caches
+        ({name: hits, misses, hit_rate})
+    """
+    stages = {}
+    for name, totals in _stages.items():
+        stages[name] = dict(totals)
+        stages[name]['records_per_second'] = (totals['records'] / totals['seconds']
+                                              if totals['seconds'] else None)
+    caches = {}
+    for name, totals in _caches.items():
+        lookups = totals['hits'] + totals['misses']
+        caches[name] = {**totals, 'hit_rate': totals['hits'] / lookups if lookups else None}
+    return {'stages': stages, 'counters': dict(_counters), 'caches': caches}
+
+def write_jsonl(path, script, run_seconds=None):
+    """Append one JSON line describing this run's metrics to path."""
+    record = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'script': script,
+        'pid': os.getpid(),
+        'run_seconds': run_seconds,
+        **snapshot(),
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def to_prometheus(script, run_seconds=None):
+    """
+    Render the recorded metrics in Prometheus text exposition format.
+
+    Returns:
+        str: Metrics labelled with script and stage/counter/cache names
+    """
+    metrics = snapshot()
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            rendered = ','.join(f'{key}="{_label(val)}"'
+                                for key, val in {'script': script, **labels}.items())
+            lines.append(f"{METRIC_PREFIX}_{name}{{{rendered}}} {value}")
+
+    stages = metrics['stages'].items()
+    family('stage_seconds_total', 'counter', "Wall time spent in each stage.",
+           [({'stage': name}, s['seconds']) for name, s in stages])
+    family('stage_calls_total', 'counter', "Times each stage ran.",
+           [({'stage': name}, s['calls']) for name, s in stages])
+    family('stage_records_total', 'counter', "Records processed by each stage.",
+           [({'stage': name}, s['records']) for name, s in stages])
+    family('stage_bytes_total', 'counter', "Bytes read by each stage.",
+           [({'stage': name}, s['bytes']) for name, s in stages])
+    family('events_total', 'counter', "Named event counts.",
+           [({'event': name}, value) for name, value in metrics['counters'].items()])
+    caches = metrics['caches'].items()
+    family('cache_hits_total', 'counter', "Cache hits.",
+           [({'cache': name}, c['hits']) for name, c in caches])
+    family('cache_misses_total', 'counter', "Cache misses.",
+           [({'cache': name}, c['misses']) for name, c in caches])
+    family('cache_hit_ratio', 'gauge', "Cache hit rate for this run.",
+           [({'cache': name}, c['hit_rate']) for name, c in caches if c['hit_rate'] is not None])
+    if run_seconds is not None:
+        family('run_seconds', 'gauge', "Wall time of the whole run.", [({}, run_seconds)])
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path, script, run_seconds=None):
+    """Write to_prometheus() output atomically (for a textfile collector)."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(to_prometheus(script, run_seconds))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class StackSampler:
+    """
+    Sampling profiler: records the target thread's stack at a fixed interval
+    from a background thread and writes collapsed stacks.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        samples = self.samples
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                samples[key] = samples.get(key, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path):
+        """Write collapsed stacks, one "frame;frame;frame count" per line."""
+        with open(path, 'w') as f:
+            for stack, samples in sorted(self.samples.items()):
+                f.write(f"{stack} {samples}\n")
+
+def add_arguments(parser):
+    """Add the --metrics, --prometheus, --profile and --profiler options."""
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--metrics', metavar='PATH',
+                       help="Append this run's stage metrics to a JSON-lines file")
+    group.add_argument('--prometheus', metavar='PATH',
+                       help="Write this run's metrics in Prometheus text format")
+    group.add_argument('--profile', metavar='PATH',
+                       help="Profile the run and write a flamegraph-compatible file")
+    group.add_argument('--profiler', choices=PROFILERS, default='sample',
+                       help="sample: collapsed stacks; cprofile: cProfile stats "
+                            "(default: sample)")
+
+@contextmanager
+def session(script, metrics_path=None, prometheus_path=None, profile_path=None,
+            profiler='sample'):
+    """
+    Record metrics (and optionally profile) for one run, then export them.
+
+    Does nothing unless at least one output path is given. Metrics are
+    exported even if the run fails or exits.
+
+    Args:
+        script (str): Script name used as the 'script' label
+        metrics_path (str): JSON-lines metrics file to append to
+        prometheus_path (str): Prometheus text file to write
+        profile_path (str): Profile output file
+        profiler (str): 'sample' or 'cprofile'
+    """
+    if not (metrics_path or prometheus_path or profile_path):
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler!r}; expected one of {PROFILERS}")
+
+    reset()
+    enable()
+    active = None
+    if profile_path:
+        if profiler == 'sample':
+            active = StackSampler()
+            active.start()
+        else:
+            import cProfile
+            active = cProfile.Profile()
+            active.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run_seconds = time.perf_counter() - start
+        if active is not None:
+            if profiler == 'sample':
+                active.stop()
+                active.write(profile_path)
+            else:
+                active.disable()
+                active.dump_stats(profile_path)
+        disable()
+        if metrics_path:
+            write_jsonl(metrics_path, script, run_seconds)
+        if prometheus_path:
+            write_prometheus(prometheus_path, script, run_seconds)
+
+def session_from_args(script, args):
+    """session() configured from add_arguments() options."""
+    return session(script, args.metrics, args.prometheus, args.profile, args.profiler)
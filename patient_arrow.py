@@ -0,0 +1,506 @@
+"""
+Arrow IPC Interchange
+
+Patient records can be handed between pipeline stages as Arrow IPC files
+instead of JSON. A downstream stage memory-maps the file and reads its
+record batches in place: column buffers are used straight from the mapped
+pages, nothing is parsed, and processes reading the same file share one copy
+of it in the page cache.
+
+Format:
+    Files are written in the IPC stream format (a schema message, record
+    batch messages and an end-of-stream marker), so appending a batch is a
+    write at the end of the file. Readers also accept the IPC file format
+    (Feather v2), e.g. files written by Polars or the data generator.
+
+Schema:
+    Every file has a column for each known patient and dosage field (the
+    RECORD_FIELDS of patient_records.py) with a fixed Arrow type
+    (FIELD_TYPES): names and the categorical fields are strings, age int64,
+    weights and dosages float64, the dose flags booleans and the
+    allergy/warning lists list<string>. Categorical fields are plain strings
+    rather than dictionary-encoded, because IPC files cannot replace a
+    dictionary between batches and Polars cannot read delta dictionaries.
+    Any other field, and a known field whose values do not fit its type (raw
+    string ages, say), is stored as JSON text and marked in the field
+    metadata, so records read back as the dictionaries that were written.
+    Absent keys and None values are both stored as nulls and read back as
+    absent keys; integer weights and dosages read back as floats.
+
+Schema Changes:
+    The schema is chosen from the first batch. A later batch with a new
+    field, or with a value that does not fit a typed column (a weight of
+    "154 lbs" after numeric weights), widens it: the changed columns become
+    JSON columns, and the batches written so far are re-encoded into a new
+    file with the wider schema. Widening happens at most once per field.
+
+Versioning:
+    The schema metadata records SCHEMA_VERSION. Readers accept files of this
+    version or older and reject newer ones with a ValueError rather than
+    misreading them; files written by other tools (no version) are read with
+    their own types.
+
+Appending:
+    ArrowPatientWriter writes one record batch per `batch_size` records as
+    they are produced, so a streaming stage never holds its whole output.
+    append_arrow_patients() adds batches to an existing stream file by
+    overwriting its end-of-stream marker; existing batches are not read or
+    copied. Only records that need a wider schema, or a file in the IPC file
+    format, make it rewrite the file (atomically, through a temporary file).
+
+Usage:
+    write_arrow_patients(cleaned, "cleaned.arrow")
+    append_arrow_patients(more_cleaned, "cleaned.arrow")
+    for patient in iter_arrow_patients("cleaned.arrow"): ...
+    table = read_arrow_table("cleaned.arrow")    # zero-copy pyarrow.Table
+"""
+
+import itertools
+import json
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.ipc
+
+# File extensions recognized as Arrow IPC
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Version of the patient record schema written to new files
+SCHEMA_VERSION = 1
+
+# Schema and field metadata keys
+SCHEMA_VERSION_KEY = b'pipeline.schema_version'
+ENCODING_KEY = b'pipeline.encoding'
+
+# Records per record batch
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+# Leading bytes of the IPC file format; stream files start with a message
+FILE_MAGIC = b'ARROW1'
+
+# End-of-stream marker closing an IPC stream (continuation token, length 0)
+END_OF_STREAM = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+_STRING_LIST = pa.list_(pa.string())
+
+# Arrow type of each known patient and dosage field (patient_records.RECORD_FIELDS)
+FIELD_TYPES = {
+    'name': pa.string(),
+    'age': pa.int64(),
+    'gender': pa.string(),
+    'diagnosis': pa.string(),
+    'weight': pa.float64(),
+    'medication': pa.string(),
+    'condition': pa.string(),
+    'is_first_dose': pa.bool_(),
+    'allergies': _STRING_LIST,
+    'base_dosage': pa.float64(),
+    'loading_dose_applied': pa.bool_(),
+    'final_dosage': pa.float64(),
+    'warnings': _STRING_LIST,
+    'contraindications': _STRING_LIST,
+}
+
+def is_arrow_path(path):
+    """Whether a path has an Arrow IPC file extension."""
+    return str(path).lower().endswith(ARROW_EXTENSIONS)
+
+def _fits(arrow_type, value):
+    """Whether a Python value is stored by arrow_type without changing type."""
+    if value is None:
+        return True
+    if arrow_type == pa.float64():
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if arrow_type == pa.int64():
+        return type(value) is int
+    if arrow_type == pa.bool_():
+        return type(value) is bool
+    if arrow_type == _STRING_LIST:
+        return type(value) is list and all(type(item) is str for item in value)
+    if arrow_type == pa.string():
+        return type(value) is str
+    # Other types only occur in files written by other tools
+    try:
+        pa.scalar(value, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return False
+    return True
+
+def _json_field(name):
+    return pa.field(name, pa.string(), metadata={ENCODING_KEY: b'json'})
+
+def _is_json(field):
+    return bool(field.metadata) and field.metadata.get(ENCODING_KEY) == b'json'
+
+def patient_schema(patients):
+    """
+    Return the file schema for records starting with `patients`.
+
+    Args:
+        patients (list): The first batch of patient mappings
+
+    Returns:
+        pyarrow.Schema: RECORD_FIELDS (typed where the batch fits), then any
+        other fields of the batch in order of appearance, as JSON text
+    """
+    base = pa.schema([pa.field(name, arrow_type) for name, arrow_type in FIELD_TYPES.items()],
+                     metadata={SCHEMA_VERSION_KEY: str(SCHEMA_VERSION).encode()})
+    return widen_schema(base, patients)
+
+def widen_schema(schema, patients):
+    """
+    Return a schema in which a batch of patient mappings fits.
+
+    Returns:
+        pyarrow.Schema: `schema` itself if the batch fits; otherwise a copy in
+        which the typed columns the batch does not fit are JSON columns and
+        the batch's new fields are appended as JSON columns
+    """
+    fields = list(schema)
+    changed = False
+    for index, field in enumerate(fields):
+        if not _is_json(field) and not all(_fits(field.type, patient.get(field.name))
+                                           for patient in patients):
+            fields[index] = _json_field(field.name)
+            changed = True
+    names = set(schema.names)
+    extra = {}
+    for patient in patients:
+        for name in patient:
+            if name not in names:
+                extra[name] = None
+    if extra:
+        fields.extend(_json_field(name) for name in extra)
+        changed = True
+    return pa.schema(fields, metadata=schema.metadata) if changed else schema
+
+def check_schema(schema, path='<stream>'):
+    """
+    Reject files written with a newer schema version.
+
+    Raises:
+        ValueError: If the file's schema version is newer than SCHEMA_VERSION
+    """
+    version = (schema.metadata or {}).get(SCHEMA_VERSION_KEY)
+    if version is not None and int(version) > SCHEMA_VERSION:
+        raise ValueError(f"{path} uses patient schema version {int(version)}; "
+                         f"this version reads up to {SCHEMA_VERSION}")
+
+def record_batch(patients, schema):
+    """
+    Convert patient mappings to one record batch of a file schema.
+
+    Raises:
+        ValueError: If a record has a field the schema lacks, or a value that
+            does not fit a typed column (see widen_schema)
+    """
+    names = set(schema.names)
+    for patient in patients:
+        for name in patient:
+            if name not in names:
+                raise ValueError(f"field {name!r} is not in the Arrow file's schema")
+    arrays = []
+    for field in schema:
+        values = [patient.get(field.name) for patient in patients]
+        if _is_json(field):
+            values = [None if value is None else json.dumps(value) for value in values]
+        elif not all(_fits(field.type, value) for value in values):
+            raise ValueError(f"values of {field.name!r} do not fit the Arrow file's "
+                             f"{field.type} column")
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def convert_batch(batch, schema):
+    """
+    Re-encode a record batch for a wider schema (see widen_schema).
+
+    Typed columns that became JSON columns are encoded as JSON text and
+    fields the batch lacks are added as null columns.
+    """
+    if batch.schema.equals(schema, check_metadata=True):
+        return batch
+    arrays = []
+    for field in schema:
+        index = batch.schema.get_field_index(field.name)
+        if index < 0:
+            arrays.append(pa.nulls(batch.num_rows, field.type))
+            continue
+        column = batch.column(index)
+        if _is_json(field) and not _is_json(batch.schema.field(index)):
+            column = pa.array([None if value is None else json.dumps(value)
+                               for value in column.to_pylist()], type=pa.string())
+        arrays.append(column)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def batch_to_dicts(batch):
+    """Convert a record batch back to patient dictionaries (nulls omitted)."""
+    columns = []
+    for field, column in zip(batch.schema, batch.columns):
+        values = column.to_pylist()
+        if _is_json(field):
+            values = [None if value is None else json.loads(value) for value in values]
+        columns.append((field.name, values))
+    patients = []
+    for row in range(batch.num_rows):
+        patient = {}
+        for name, values in columns:
+            value = values[row]
+            if value is not None:
+                patient[name] = value
+        patients.append(patient)
+    return patients
+
+def _open_reader(source, path='<stream>'):
+    """Open an IPC reader (stream or file format) on a memory map and check its schema."""
+    is_file_format = source.read(len(FILE_MAGIC)) == FILE_MAGIC
+    source.seek(0)
+    reader = pa.ipc.open_file(source) if is_file_format else pa.ipc.open_stream(source)
+    check_schema(reader.schema, path)
+    return reader
+
+def _reader_batches(reader):
+    """Yield the record batches of a stream or file reader in order."""
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+    else:
+        yield from reader
+
+class ArrowPatientWriter:
+    """
+    Write patient records to an Arrow IPC stream file one record batch at a time.
+
+    The file is written under a temporary name and renamed into place by
+    close(), so readers never see a partial file.
+
+    Example:
+        with ArrowPatientWriter("cleaned.arrow") as writer:
+            for patient in stream:
+                writer.write(patient)
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, schema=None):
+        """
+        Args:
+            path (str): Output file
+            batch_size (int): Records per record batch
+            schema (pyarrow.Schema): Initial file schema (default: from the
+                first batch); widened if later records do not fit it
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.path = path
+        self.batch_size = batch_size
+        self.schema = schema
+        self.count = 0
+        self._pending = []
+        self._writer = None
+        self._sink = None
+        self._tmp_path = self._temp_file()
+
+    def _temp_file(self):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), suffix='.arrow.tmp')
+        os.close(fd)
+        return tmp_path
+
+    def _open(self):
+        self._sink = pa.OSFile(self._tmp_path, 'wb')
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def _widen(self, schema):
+        """Switch to a wider schema, re-encoding the batches already written."""
+        self.schema = schema
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        old_path, self._tmp_path = self._tmp_path, self._temp_file()
+        self._open()
+        with pa.memory_map(old_path) as source:
+            for batch in pa.ipc.open_stream(source):
+                self._writer.write_batch(convert_batch(batch, schema))
+        os.remove(old_path)
+
+    def write_batch(self, batch):
+        """Write a pyarrow.RecordBatch, re-encoded for the file schema if needed."""
+        self._flush()
+        if self.schema is None:
+            self.schema = batch.schema
+        if not batch.schema.equals(self.schema, check_metadata=True):
+            wider = self.schema
+            for field in batch.schema:
+                index = wider.get_field_index(field.name)
+                if index < 0:
+                    wider = wider.append(_json_field(field.name))
+                elif (not _is_json(wider.field(index))
+                      and not wider.field(index).equals(field, check_metadata=True)):
+                    wider = wider.set(index, _json_field(field.name))
+            if wider is not self.schema:
+                self._widen(wider)
+            batch = convert_batch(batch, self.schema)
+        if self._writer is None:
+            self._open()
+        self._writer.write_batch(batch)
+        self.count += batch.num_rows
+
+    def _flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            if self.schema is None:
+                self.schema = patient_schema(pending)
+            else:
+                wider = widen_schema(self.schema, pending)
+                if wider is not self.schema:
+                    self._widen(wider)
+            batch = record_batch(pending, self.schema)
+            if self._writer is None:
+                self._open()
+            self._writer.write_batch(batch)
+            self.count += batch.num_rows
+
+    def write(self, patient):
+        """Buffer one patient mapping, writing a batch when one is full."""
+        self._pending.append(patient)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def write_all(self, patients):
+        """Write every patient mapping from an iterable."""
+        for patient in patients:
+            self.write(patient)
+
+    def close(self):
+        """Write any buffered records and publish the file."""
+        self._flush()
+        if self._writer is None:
+            if self.schema is None:
+                self.schema = patient_schema([])
+            self._open()
+        self._writer.close()
+        self._sink.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partial file."""
+        if self._writer is not None:
+            self._sink.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def write_arrow_patients(patients, path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write patient records to an Arrow IPC file as they are produced.
+
+    Args:
+        patients (iterable): Patient mappings (dicts, PatientRecords or a
+            PatientBatch)
+        path (str): Output file
+        batch_size (int): Records per record batch
+
+    Returns:
+        int: Number of records written
+    """
+    with ArrowPatientWriter(path, batch_size) as writer:
+        writer.write_all(patients)
+    return writer.count
+
+def _append_in_place(chunks, path):
+    """
+    Append batches of records to a stream file while they fit its schema.
+
+    Returns:
+        tuple: (records appended, the first chunk that did not fit or None)
+    """
+    with pa.memory_map(path) as source:
+        schema = _open_reader(source, path).schema
+    count = 0
+    with open(path, 'r+b') as f:
+        end = f.seek(-len(END_OF_STREAM), os.SEEK_END)
+        if f.read() != END_OF_STREAM:
+            raise ValueError(f"{path} does not end with an Arrow end-of-stream marker")
+        try:
+            for chunk in chunks:
+                if widen_schema(schema, chunk) is not schema:
+                    return count, chunk
+                message = record_batch(chunk, schema).serialize()
+                f.seek(end)
+                f.write(message)
+                end += message.size
+                count += len(chunk)
+        finally:
+            # Close the stream after the last complete batch
+            f.seek(end)
+            f.write(END_OF_STREAM)
+            f.truncate()
+    return count, None
+
+def append_arrow_patients(patients, path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Append record batches to an Arrow IPC file (creating it if needed).
+
+    Batches that fit the file's schema are appended in place. Records that
+    need a wider schema, or a file in the IPC file format, make the whole
+    file be rewritten with a stream writer.
+
+    Returns:
+        int: Number of records appended
+    """
+    if not os.path.exists(path):
+        return write_arrow_patients(patients, path, batch_size)
+    iterator = iter(patients)
+    chunks = iter(lambda: list(itertools.islice(iterator, batch_size)), [])
+    with open(path, 'rb') as f:
+        is_file_format = f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    appended = 0
+    if not is_file_format:
+        appended, rest = _append_in_place(chunks, path)
+        if rest is None:
+            return appended
+        chunks = itertools.chain([rest], chunks)
+
+    with pa.memory_map(path) as source:
+        reader = _open_reader(source, path)
+        with ArrowPatientWriter(path, batch_size, reader.schema) as writer:
+            for batch in _reader_batches(reader):
+                writer.write_batch(batch)
+            existing = writer.count
+            for chunk in chunks:
+                writer.write_all(chunk)
+    return appended + writer.count - existing
+
+def read_arrow_table(path):
+    """
+    Memory-map an Arrow IPC file and return its contents without copying.
+
+    Returns:
+        pyarrow.Table: Table whose buffers point into the mapped file
+    """
+    with pa.memory_map(path) as source:
+        return _open_reader(source, path).read_all()
+
+def iter_arrow_batches(path):
+    """Yield the record batches of a memory-mapped Arrow IPC file."""
+    with pa.memory_map(path) as source:
+        yield from _reader_batches(_open_reader(source, path))
+
+def iter_arrow_patients(path):
+    """
+    Stream patient dictionaries from an Arrow IPC file, one batch at a time.
+
+    Yields:
+        dict: Patient dictionaries in file order
+    """
+    for batch in iter_arrow_batches(path):
+        yield from batch_to_dicts(batch)
@@ -0,0 +1,387 @@
+"""
+Patient Record De-duplication
+
+Scalable duplicate detection for the patient data cleaner. Instead of keeping
+every record (or comparing records pairwise), each cleaned record is reduced
+to a fixed-width fingerprint of its normalized identifying fields (name, age,
+gender, diagnosis) and only the fingerprint is stored.
+
+Three storage modes are available:
+
+    memory  - fingerprints in a Python set (fastest, bounded by RAM)
+    disk    - fingerprints in a memory-mapped, open-addressing hash table
+              file, for inputs whose unique records do not fit in RAM
+    bloom   - a Bloom filter in front of an exact disk table; records the
+              filter has never seen skip the table lookup entirely. With
+              ``exact=False`` the filter alone decides, trading a bounded
+              false-positive rate (wrongly dropped records) for memory.
+
+Normalization:
+    String fields are compared with whitespace collapsed and case folded, so
+    "John  Smith" equals "john smith" and a diagnosis of "Flu" equals "flu".
+    Case carries no meaning in the free-text names, genders and diagnoses
+    (or in ICD-10 codes) of these feeds, so differently cased copies of a
+    record are treated as the same record.
+
+Resuming:
+    A disk table given by path starts empty on every run unless ``resume``
+    is set, in which case the fingerprints of earlier runs are kept (and,
+    in 'bloom' mode, loaded back into the filter) so records already
+    processed are dropped as duplicates.
+
+Example:
+    dedup = PatientDeduplicator(mode="disk", path="seen.idx", resume=True)
+    kept = [p for p in cleaned if not dedup.is_duplicate(p)]
+    print(dedup.summary())
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+# Fields that identify a patient record
+KEY_FIELDS = ('name', 'age', 'gender', 'diagnosis')
+
+# Width of a fingerprint in bytes (128 bits keeps collisions negligible)
+FINGERPRINT_SIZE = 16
+
+# Disk table layout: magic, slot capacity, occupied slots
+_TABLE_MAGIC = b'PDEDUP01'
+_TABLE_HEADER = struct.Struct('<8sQQ')
+
+# Grow the disk table once it is this full
+_MAX_LOAD_FACTOR = 0.7
+
+_EMPTY_SLOT = bytes(FINGERPRINT_SIZE)
+
+DEDUP_MODES = ('memory', 'disk', 'bloom')
+
+def normalize_field(value):
+    """Normalize one field: collapse whitespace and lowercase (see Normalization)."""
+    if value is None:
+        return ''
+    return ' '.join(str(value).split()).lower()
+
+def patient_fingerprint(patient, fields=KEY_FIELDS):
+    """
+    Compute the fixed-width fingerprint of a patient record.
+
+    Args:
+        patient (dict): Patient dictionary (normally already cleaned)
+        fields (tuple): Fields that identify the record
+
+    Returns:
+        bytes: FINGERPRINT_SIZE-byte digest of the normalized fields
+    """
+    key = '\x1f'.join(normalize_field(patient.get(field)) for field in fields)
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=FINGERPRINT_SIZE).digest()
+    # All-zero bytes mark empty slots in the disk table
+    if digest == _EMPTY_SLOT:
+        digest = digest[:-1] + b'\x01'
+    return digest
+
+class FingerprintTable:
+    """
+    Disk-backed, memory-mapped hash set of fixed-width fingerprints.
+
+    Uses open addressing with linear probing over a power-of-two number of
+    slots. When the load factor exceeds 0.7 the table is rebuilt at twice the
+    size in a new file which atomically replaces the old one.
+    """
+
+    def __init__(self, path, initial_capacity=1 << 16, resume=False):
+        """
+        Create (or reopen) a fingerprint table.
+
+        Args:
+            path (str): Table file path
+            initial_capacity (int): Slot count for a new table (rounded up
+                to a power of two)
+            resume (bool): Reopen an existing table with its fingerprints
+                instead of replacing it with an empty one
+
+        Raises:
+            ValueError: If path exists and is not a fingerprint table
+        """
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and not resume:
+            # Refuse to overwrite a file that is not one of our tables
+            with open(path, 'rb') as file:
+                if file.read(len(_TABLE_MAGIC)) != _TABLE_MAGIC:
+                    raise ValueError(f"{path} is not a fingerprint table")
+        if not (exists and resume):
+            capacity = 1 << max(4, (initial_capacity - 1).bit_length())
+            self._create(path, capacity)
+        self._open()
+
+    @staticmethod
+    def _create(path, capacity):
+        with open(path, 'wb') as file:
+            file.write(_TABLE_HEADER.pack(_TABLE_MAGIC, capacity, 0))
+            file.truncate(_TABLE_HEADER.size + capacity * FINGERPRINT_SIZE)
+
+    def _open(self):
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.capacity, self._count = _TABLE_HEADER.unpack_from(self._map, 0)
+        if magic != _TABLE_MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a fingerprint table")
+        self._mask = self.capacity - 1
+
+    def _find(self, fingerprint):
+        """Return (offset, found) for the slot holding or receiving fingerprint."""
+        slot = int.from_bytes(fingerprint[:8], 'little') & self._mask
+        while True:
+            offset = _TABLE_HEADER.size + slot * FINGERPRINT_SIZE
+            current = self._map[offset:offset + FINGERPRINT_SIZE]
+            if current == fingerprint:
+                return offset, True
+            if current == _EMPTY_SLOT:
+                return offset, False
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, fingerprint):
+        return self._find(fingerprint)[1]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Yield the stored fingerprints in slot order."""
+        for slot in range(self.capacity):
+            offset = _TABLE_HEADER.size + slot * FINGERPRINT_SIZE
+            fingerprint = self._map[offset:offset + FINGERPRINT_SIZE]
+            if fingerprint != _EMPTY_SLOT:
+                yield fingerprint
+
+    def add(self, fingerprint):
+        """
+        Insert a fingerprint.
+
+        Returns:
+            bool: True if it was newly added, False if already present
+        """
+        offset, found = self._find(fingerprint)
+        if found:
+            return False
+        self._map[offset:offset + FINGERPRINT_SIZE] = fingerprint
+        self._count += 1
+        _TABLE_HEADER.pack_into(self._map, 0, _TABLE_MAGIC, self.capacity, self._count)
+        if self._count > self.capacity * _MAX_LOAD_FACTOR:
+            self._grow()
+        return True
+
+    def _grow(self):
+        """Rehash into a table twice the size and swap it in place."""
+        new_path = self.path + '.grow'
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        bigger = FingerprintTable(new_path, initial_capacity=self.capacity * 2)
+        for fingerprint in self:
+            bigger.add(fingerprint)
+        bigger.close()
+        self.close()
+        os.replace(new_path, self.path)
+        self._open()
+
+    def close(self):
+        """Flush and release the memory map."""
+        if getattr(self, '_map', None) is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if getattr(self, '_file', None) is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BloomFilter:
+    """
+    Bloom filter over fingerprints, sized for a target false-positive rate.
+
+    Bit positions come from double hashing the two halves of the fingerprint,
+    so no additional hashing is needed per record.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Args:
+            capacity (int): Expected number of distinct records
+            error_rate (float): Target false-positive probability (0 < p < 1)
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, fingerprint):
+        h1 = int.from_bytes(fingerprint[:8], 'little')
+        h2 = int.from_bytes(fingerprint[8:16], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, fingerprint):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(fingerprint))
+
+    def add(self, fingerprint):
+        """
+        Set the fingerprint's bits.
+
+        Returns:
+            bool: True if any bit was newly set (the fingerprint was
+            definitely not present before)
+        """
+        bits = self._bits
+        new = False
+        for p in self._positions(fingerprint):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                new = True
+        return new
+
+class PatientDeduplicator:
+    """
+    Detects duplicate patient records by fingerprint and counts what it saw.
+
+    Attributes:
+        records_seen (int): Records checked so far
+        duplicates_dropped (int): Records reported as duplicates
+        bloom_false_positives (int): Bloom hits that the exact store rejected
+    """
+
+    def __init__(self, mode='memory', path=None, expected_records=1_000_000,
+                 error_rate=0.001, exact=True, resume=False):
+        """
+        Args:
+            mode (str): 'memory', 'disk' or 'bloom'
+            path (str): Disk table file for 'disk' mode (and for the exact
+                store in 'bloom' mode). A temporary file is used if omitted.
+            expected_records (int): Sizing hint for the Bloom filter and
+                the initial disk table
+            error_rate (float): Bloom filter false-positive rate
+            exact (bool): In 'bloom' mode, confirm possible duplicates
+                against the disk table. If False, the filter alone decides.
+            resume (bool): Keep the fingerprints already in the table at
+                path (see Resuming) instead of starting empty
+        """
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode {mode!r}; expected one of {DEDUP_MODES}")
+        self.mode = mode
+        self.records_seen = 0
+        self.duplicates_dropped = 0
+        self.bloom_false_positives = 0
+
+        self._bloom = None
+        self._tempdir = None
+        if mode == 'bloom':
+            self._bloom = BloomFilter(expected_records, error_rate)
+
+        if mode == 'disk' or (mode == 'bloom' and exact):
+            if path is None:
+                self._tempdir = tempfile.mkdtemp(prefix='patient_dedup_')
+                path = os.path.join(self._tempdir, 'fingerprints.idx')
+            capacity = int(expected_records / _MAX_LOAD_FACTOR) if mode == 'disk' else 1 << 16
+            self._exact = FingerprintTable(path, initial_capacity=max(16, capacity),
+                                           resume=resume)
+            if self._bloom is not None:
+                for fingerprint in self._exact:
+                    self._bloom.add(fingerprint)
+        elif mode == 'memory':
+            self._exact = set()
+        else:
+            self._exact = None
+
+    def _add_exact(self, fingerprint):
+        if isinstance(self._exact, set):
+            if fingerprint in self._exact:
+                return False
+            self._exact.add(fingerprint)
+            return True
+        return self._exact.add(fingerprint)
+
+    def is_duplicate(self, patient):
+        """
+        Record a patient and report whether an equal record was seen before.
+
+        Args:
+            patient (dict): Cleaned patient dictionary
+
+        Returns:
+            bool: True if the record is a duplicate and should be dropped
+        """
+        self.records_seen += 1
+        fingerprint = patient_fingerprint(patient)
+
+        if self._bloom is not None:
+            definitely_new = self._bloom.add(fingerprint)
+            if definitely_new:
+                if self._exact is not None:
+                    self._add_exact(fingerprint)
+                return False
+            if self._exact is None:
+                self.duplicates_dropped += 1
+                return True
+            if self._add_exact(fingerprint):
+                self.bloom_false_positives += 1
+                return False
+            self.duplicates_dropped += 1
+            return True
+
+        if self._add_exact(fingerprint):
+            return False
+        self.duplicates_dropped += 1
+        return True
+
+    @property
+    def unique_records(self):
+        """Number of records that were kept."""
+        return self.records_seen - self.duplicates_dropped
+
+    def summary(self):
+        """
+        Report de-duplication statistics.
+
+        Returns:
+            dict: mode, records_seen, duplicates_dropped, unique_records and
+            (in 'bloom' mode) bloom_false_positives
+        """
+        stats = {
+            'mode': self.mode,
+            'records_seen': self.records_seen,
+            'duplicates_dropped': self.duplicates_dropped,
+            'unique_records': self.unique_records,
+        }
+        if self._bloom is not None:
+            stats['bloom_false_positives'] = self.bloom_false_positives
+        return stats
+
+    def close(self):
+        """Release the disk table and remove any temporary files."""
+        if isinstance(self._exact, FingerprintTable):
+            self._exact.close()
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,615 @@
+"""
+Compact Patient Records
+
+Memory-efficient stand-ins for the lists of patient dictionaries passed
+between the cleaner (1_patient_data_cleaner.py) and the dosage calculator
+(2_med_dosage_calculator.py). Both accept a PatientBatch wherever they accept
+a list of dictionaries and then return a PatientBatch.
+
+PatientRecord:
+    One patient with a __slots__ attribute per known patient and dosage field
+    (plus an overflow dict for any others). It is a mutable mapping, so code
+    written for dictionaries (record['age'], record.get('allergies'),
+    dict(record)) works unchanged, at a fraction of a dictionary's size.
+
+PatientBatch:
+    A column-oriented batch of patients:
+    - Categorical fields (CATEGORICAL_FIELDS: gender, diagnosis, medication,
+      condition, plus age, the dose flags and the allergy/warning lists) are
+      dictionary-encoded as int32 codes into a Vocabulary. Batches share one
+      vocabulary by default, so codes are comparable across batches and each
+      distinct value is stored once per process (see Vocabulary Lifetime).
+    - Names are packed into one UTF-8 buffer with an offsets array.
+    - Weights and dosages are float64 arrays.
+    - Other fields are kept as plain Python lists.
+    An absent field is a flag in the column (a code, or a row kind for the
+    float and text columns). A value a column cannot store compactly (an age
+    of "abc") is kept exactly in a small per-column exception map, so records
+    round-trip to identical dictionaries. A cleaned and dosed record takes
+    roughly a tenth of the memory of the equivalent dictionary.
+
+Vocabulary Lifetime:
+    The shared vocabulary only grows. A long-running process can give each
+    unit of work its own vocabulary with ``with vocabulary_scope(): ...``
+    (batches created inside use a fresh one, released with them), or start
+    over with reset_shared_vocabulary(). Existing batches keep the
+    vocabulary they were created with, so neither invalidates their codes.
+
+Laziness:
+    Nothing is converted up front. Iterating a batch builds one PatientRecord
+    per row on demand, dicts() yields dictionaries one at a time, and
+    from_dicts() consumes any iterable (e.g. a streaming reader) record by
+    record.
+
+Example:
+    batch = PatientBatch.from_dicts(load_patient_data("patients.json"))
+    cleaned = clean_patient_data(batch)          # a PatientBatch
+    cleaned.codes('diagnosis'), cleaned.vocabulary
+    cleaned.to_dicts()                           # list of dicts when needed
+"""
+
+import contextlib
+import math
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+# Fields dictionary-encoded into the vocabulary
+CATEGORICAL_FIELDS = ('age', 'gender', 'diagnosis', 'medication', 'condition',
+                      'is_first_dose', 'loading_dose_applied', 'allergies', 'warnings',
+                      'contraindications')
+
+# Fields stored as float64 arrays
+FLOAT_FIELDS = ('weight', 'dosing_weight', 'base_dosage', 'final_dosage')
+
+# Fields packed into a UTF-8 text buffer
+TEXT_FIELDS = ('name',)
+
+# PatientRecord slots, in output order
+RECORD_FIELDS = ('name', 'age', 'gender', 'diagnosis', 'weight', 'medication', 'condition',
+                 'is_first_dose', 'allergies', 'dosing_weight', 'base_dosage',
+                 'loading_dose_applied', 'final_dosage', 'warnings', 'contraindications')
+
+# Category codes with special meaning
+MISSING_CODE = -1
+EXCEPTION_CODE = -2
+
+# Row kinds of float (_FLOAT/_INT) and text (_TEXT) columns
+_FLOAT, _INT, _EXCEPTION, _ABSENT = 0, 1, 2, 3
+_TEXT = 0
+
+class _Missing:
+    """Marks a field that is absent from a record."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+def _exceptions_nbytes(exceptions):
+    """Approximate bytes held by a column's exception map."""
+    if not exceptions:
+        return 0
+    return sys.getsizeof(exceptions) + sum(sys.getsizeof(value) for value in exceptions.values())
+
+def _vocabulary_key(value):
+    """Hashable key that keeps 1, 1.0 and True (and lists vs tuples) apart."""
+    if type(value) is list:
+        return (list, tuple(value))
+    hash(value)
+    return (type(value), value)
+
+class Vocabulary:
+    """
+    Interns values to dense integer codes.
+
+    Lists are interned by content and decoded to a fresh list each time, so
+    callers may mutate what they get back.
+    """
+
+    __slots__ = ('_keys', '_codes')
+
+    def __init__(self):
+        self._keys = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def encode(self, value):
+        """
+        Return the code for a value, adding it if it is new.
+
+        Raises:
+            TypeError: If the value is unhashable (other than a list of
+                hashable items)
+        """
+        key = _vocabulary_key(value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self._keys)
+            self._keys.append(key)
+        return code
+
+    def lookup(self, value):
+        """Return the code for a value, or None if it has never been encoded."""
+        try:
+            return self._codes.get(_vocabulary_key(value))
+        except TypeError:
+            return None
+
+    def decode(self, code):
+        """Return the value for a code."""
+        kind, value = self._keys[code]
+        return list(value) if kind is list else value
+
+    def values(self):
+        """All interned values, indexed by code."""
+        return [self.decode(code) for code in range(len(self._keys))]
+
+# Vocabulary used by every batch unless one is passed explicitly
+SHARED_VOCABULARY = Vocabulary()
+
+def reset_shared_vocabulary():
+    """
+    Replace SHARED_VOCABULARY with an empty vocabulary.
+
+    Existing batches keep (and keep alive) the vocabulary they were created
+    with; only batches created afterwards use the new one.
+
+    Returns:
+        Vocabulary: The previous shared vocabulary
+    """
+    global SHARED_VOCABULARY
+    previous, SHARED_VOCABULARY = SHARED_VOCABULARY, Vocabulary()
+    return previous
+
+@contextlib.contextmanager
+def vocabulary_scope(vocabulary=None):
+    """
+    Use a separate shared vocabulary for batches created inside the block.
+
+    Args:
+        vocabulary (Vocabulary): Vocabulary to use (default: a new one)
+
+    Yields:
+        Vocabulary: The vocabulary in effect inside the block
+    """
+    global SHARED_VOCABULARY
+    previous = SHARED_VOCABULARY
+    SHARED_VOCABULARY = Vocabulary() if vocabulary is None else vocabulary
+    try:
+        yield SHARED_VOCABULARY
+    finally:
+        SHARED_VOCABULARY = previous
+
+class _CategoryColumn:
+    __slots__ = ('codes', 'vocabulary', 'exceptions')
+
+    def __init__(self, vocabulary, size=0):
+        self.codes = array('i', [MISSING_CODE]) * size
+        self.vocabulary = vocabulary
+        self.exceptions = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        if value is MISSING:
+            self.codes.append(MISSING_CODE)
+            return
+        try:
+            self.codes.append(self.vocabulary.encode(value))
+        except TypeError:
+            self.exceptions[len(self.codes)] = value
+            self.codes.append(EXCEPTION_CODE)
+
+    def get(self, row):
+        code = self.codes[row]
+        if code >= 0:
+            return self.vocabulary.decode(code)
+        return MISSING if code == MISSING_CODE else self.exceptions[row]
+
+    def take(self, rows):
+        column = _CategoryColumn(self.vocabulary)
+        codes = self.codes
+        column.codes = array('i', [codes[row] for row in rows])
+        if self.exceptions:
+            column.exceptions = {i: self.exceptions[row] for i, row in enumerate(rows)
+                                 if row in self.exceptions}
+        return column
+
+    def copy(self):
+        column = _CategoryColumn(self.vocabulary)
+        column.codes = array('i', self.codes)
+        column.exceptions = dict(self.exceptions)
+        return column
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + _exceptions_nbytes(self.exceptions)
+
+class _FloatColumn:
+    __slots__ = ('values', 'kinds', 'exceptions')
+
+    def __init__(self, size=0):
+        self.values = array('d', [math.nan]) * size
+        self.kinds = bytearray([_ABSENT]) * size
+        self.exceptions = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        kind = type(value)
+        if kind is float:
+            self.values.append(value)
+            self.kinds.append(_FLOAT)
+        elif kind is int and -2 ** 53 <= value <= 2 ** 53:
+            self.values.append(value)
+            self.kinds.append(_INT)
+        elif value is MISSING:
+            self.values.append(math.nan)
+            self.kinds.append(_ABSENT)
+        else:
+            self.exceptions[len(self.values)] = value
+            self.values.append(math.nan)
+            self.kinds.append(_EXCEPTION)
+
+    def get(self, row):
+        kind = self.kinds[row]
+        if kind == _FLOAT:
+            return self.values[row]
+        if kind == _INT:
+            return int(self.values[row])
+        return MISSING if kind == _ABSENT else self.exceptions[row]
+
+    def is_numeric(self):
+        """Whether every row holds a number."""
+        return not self.exceptions and _ABSENT not in self.kinds
+
+    def take(self, rows):
+        column = _FloatColumn()
+        values, kinds = self.values, self.kinds
+        column.values = array('d', [values[row] for row in rows])
+        column.kinds = bytearray(kinds[row] for row in rows)
+        if self.exceptions:
+            column.exceptions = {i: self.exceptions[row] for i, row in enumerate(rows)
+                                 if row in self.exceptions}
+        return column
+
+    def copy(self):
+        column = _FloatColumn()
+        column.values = array('d', self.values)
+        column.kinds = bytearray(self.kinds)
+        column.exceptions = dict(self.exceptions)
+        return column
+
+    def nbytes(self):
+        return 9 * len(self.values) + _exceptions_nbytes(self.exceptions)
+
+class _TextColumn:
+    __slots__ = ('data', 'offsets', 'kinds', 'exceptions')
+
+    def __init__(self, size=0):
+        self.data = bytearray()
+        self.offsets = array('q', [0]) * (size + 1)
+        self.kinds = bytearray([_ABSENT]) * size
+        self.exceptions = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, value):
+        if type(value) is str:
+            self.data += value.encode('utf-8', 'surrogatepass')
+            self.kinds.append(_TEXT)
+        elif value is MISSING:
+            self.kinds.append(_ABSENT)
+        else:
+            self.exceptions[len(self.kinds)] = value
+            self.kinds.append(_EXCEPTION)
+        self.offsets.append(len(self.data))
+
+    def get(self, row):
+        kind = self.kinds[row]
+        if kind == _TEXT:
+            return self.data[self.offsets[row]:self.offsets[row + 1]].decode(
+                'utf-8', 'surrogatepass')
+        return MISSING if kind == _ABSENT else self.exceptions[row]
+
+    def take(self, rows):
+        column = _TextColumn()
+        for row in rows:
+            column.append(self.get(row))
+        return column
+
+    def copy(self):
+        column = _TextColumn()
+        column.data = bytearray(self.data)
+        column.offsets = array('q', self.offsets)
+        column.kinds = bytearray(self.kinds)
+        column.exceptions = dict(self.exceptions)
+        return column
+
+    def nbytes(self):
+        return (len(self.data) + 8 * len(self.offsets) + len(self.kinds)
+                + _exceptions_nbytes(self.exceptions))
+
+class _ObjectColumn:
+    __slots__ = ('values',)
+
+    def __init__(self, size=0):
+        self.values = [MISSING] * size
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        self.values.append(value)
+
+    def get(self, row):
+        return self.values[row]
+
+    def take(self, rows):
+        column = _ObjectColumn()
+        column.values = [self.values[row] for row in rows]
+        return column
+
+    def copy(self):
+        column = _ObjectColumn()
+        column.values = list(self.values)
+        return column
+
+    def nbytes(self):
+        return sys.getsizeof(self.values) + sum(
+            sys.getsizeof(value) for value in self.values if value is not MISSING)
+
+class PatientRecord(MutableMapping):
+    """
+    One patient with a slot per field in RECORD_FIELDS.
+
+    Behaves like the patient dictionary it was built from: unset fields are
+    absent keys, and fields outside RECORD_FIELDS live in an overflow dict.
+    Iteration follows RECORD_FIELDS order, then any other fields.
+    """
+
+    __slots__ = RECORD_FIELDS + ('_extra',)
+
+    def __init__(self, fields=(), **kwargs):
+        self._extra = None
+        self.update(fields, **kwargs)
+
+    @classmethod
+    def from_dict(cls, patient):
+        """Build a record from a patient mapping."""
+        return cls(patient)
+
+    def __getitem__(self, key):
+        if key in _RECORD_SLOTS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _RECORD_SLOTS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _RECORD_SLOTS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for field in RECORD_FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"PatientRecord({self.to_dict()!r})"
+
+    def copy(self):
+        """Return a shallow copy (as dict.copy does)."""
+        return PatientRecord(self)
+
+    def to_dict(self):
+        """Return the record as a plain dictionary."""
+        return dict(self.items())
+
+_RECORD_SLOTS = frozenset(RECORD_FIELDS)
+
+class PatientBatch:
+    """
+    Column-oriented batch of patient records (see the module docstring).
+
+    Example:
+        batch = PatientBatch.from_dicts(patients)
+        batch[0]['diagnosis']        # -> 'hypertension'
+        for record in batch: ...     # PatientRecord rows, built lazily
+        batch.nbytes()               # approximate memory use
+    """
+
+    def __init__(self, vocabulary=None):
+        """
+        Args:
+            vocabulary (Vocabulary): Vocabulary for the categorical fields
+                (default: SHARED_VOCABULARY)
+        """
+        self.vocabulary = SHARED_VOCABULARY if vocabulary is None else vocabulary
+        self._columns = {}
+        self._length = 0
+
+    @classmethod
+    def from_dicts(cls, patients, vocabulary=None):
+        """Build a batch from an iterable of patient mappings, one at a time."""
+        batch = cls(vocabulary)
+        batch.extend(patients)
+        return batch
+
+    def _new_column(self, field, size):
+        """Create the column type for a field with `size` absent rows."""
+        if field in CATEGORICAL_FIELDS:
+            return _CategoryColumn(self.vocabulary, size)
+        if field in FLOAT_FIELDS:
+            return _FloatColumn(size)
+        if field in TEXT_FIELDS:
+            return _TextColumn(size)
+        return _ObjectColumn(size)
+
+    def append(self, patient):
+        """Append one patient mapping (a dict or a PatientRecord)."""
+        columns = self._columns
+        for field in patient:
+            if field not in columns:
+                columns[field] = self._new_column(field, self._length)
+        for field, column in columns.items():
+            column.append(patient.get(field, MISSING))
+        self._length += 1
+
+    def extend(self, patients):
+        """Append every patient mapping from an iterable."""
+        for patient in patients:
+            self.append(patient)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def fields(self):
+        """Field names, in the order they were first seen."""
+        return list(self._columns)
+
+    def _row(self, row, record):
+        for field, column in self._columns.items():
+            value = column.get(row)
+            if value is not MISSING:
+                record[field] = value
+        return record
+
+    def __getitem__(self, row):
+        if not -self._length <= row < self._length:
+            raise IndexError("patient batch index out of range")
+        return self._row(row % self._length, PatientRecord())
+
+    def __iter__(self):
+        for row in range(self._length):
+            yield self._row(row, PatientRecord())
+
+    def dicts(self):
+        """Yield each row as a plain dictionary, one at a time."""
+        for row in range(self._length):
+            yield self._row(row, {})
+
+    def to_dicts(self):
+        """Return every row as a list of plain dictionaries."""
+        return list(self.dicts())
+
+    def get(self, field, row, default=None):
+        """Return one field of one row, or default if it is absent."""
+        column = self._columns.get(field)
+        value = MISSING if column is None else column.get(row)
+        return default if value is MISSING else value
+
+    def column(self, field, default=None):
+        """Return one field for every row as a list (default where absent)."""
+        return [self.get(field, row, default) for row in range(self._length)]
+
+    def codes(self, field):
+        """
+        Return the int32 vocabulary codes of a categorical field.
+
+        MISSING_CODE marks absent values and EXCEPTION_CODE values that could
+        not be encoded (read those with get()).
+
+        Raises:
+            KeyError: If the field is not a categorical column of this batch
+        """
+        column = self._columns.get(field)
+        if not isinstance(column, _CategoryColumn):
+            raise KeyError(f"{field!r} is not a categorical field of this batch")
+        return column.codes
+
+    def floats(self, field):
+        """
+        Return the float64 array of a float field and whether every row
+        holds a number (False if any row is absent or non-numeric).
+
+        Raises:
+            KeyError: If the field is not a float column of this batch
+        """
+        column = self._columns.get(field)
+        if not isinstance(column, _FloatColumn):
+            raise KeyError(f"{field!r} is not a float field of this batch")
+        return column.values, column.is_numeric()
+
+    def set_column(self, field, values):
+        """Add or replace a field from one value per row (MISSING to omit)."""
+        column = self._new_column(field, 0)
+        for value in values:
+            column.append(value)
+        if len(column) != self._length:
+            raise ValueError(f"{field!r} has {len(column)} values for {self._length} rows")
+        self._columns[field] = column
+
+    def set_floats(self, field, values):
+        """Add or replace a float field from one float per row."""
+        if field not in FLOAT_FIELDS:
+            raise KeyError(f"{field!r} is not a float field")
+        column = _FloatColumn()
+        column.values = array('d', values)
+        column.kinds = bytearray(len(column.values))
+        if len(column) != self._length:
+            raise ValueError(f"{field!r} has {len(column)} values for {self._length} rows")
+        self._columns[field] = column
+
+    def set_codes(self, field, codes):
+        """Add or replace a categorical field from existing vocabulary codes."""
+        if field not in CATEGORICAL_FIELDS:
+            raise KeyError(f"{field!r} is not a categorical field")
+        if len(codes) != self._length:
+            raise ValueError(f"{field!r} has {len(codes)} codes for {self._length} rows")
+        column = _CategoryColumn(self.vocabulary)
+        column.codes = array('i', codes)
+        self._columns[field] = column
+
+    def take(self, rows):
+        """Return a new batch holding the given rows, in the given order."""
+        rows = list(rows)
+        batch = PatientBatch(self.vocabulary)
+        batch._columns = {field: column.take(rows) for field, column in self._columns.items()}
+        batch._length = len(rows)
+        return batch
+
+    def copy(self):
+        """Return an independent copy of the batch."""
+        batch = PatientBatch(self.vocabulary)
+        batch._columns = {field: column.copy() for field, column in self._columns.items()}
+        batch._length = self._length
+        return batch
+
+    def nbytes(self):
+        """Approximate bytes used by the batch's columns (vocabulary excluded)."""
+        return sum(column.nbytes() for column in self._columns.values())
+
+    def __repr__(self):
+        return f"PatientBatch({self._length} rows, fields={self.fields})"
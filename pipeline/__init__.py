@@ -0,0 +1,3 @@
+"""
+Patient pipeline command line: python -m pipeline COMMAND ... (see pipeline.cli).
+"""
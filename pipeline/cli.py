@@ -0,0 +1,257 @@
+"""
+Pipeline Command Line
+
+One entry point for the patient pipelines, for cron jobs and shell scripts.
+
+Commands:
+    clean     clean and de-duplicate patient records (1_patient_data_cleaner.py)
+    dose      calculate medication dosages (2_med_dosage_calculator.py)
+    cohort    analyze patient cohorts by BMI range (3_cohort_analysis.py)
+    generate  generate synthetic patient data (generate_large_health_data.py)
+
+Startup:
+    Only the standard library and the instrumentation module are imported up
+    front. Each command imports its script when it runs, and with it Polars
+    or NumPy only if that script needs them: 'clean' with the default engine
+    and 'dose' never load Polars (unless --coerce or --quarantine is given),
+    and --help loads no command at all.
+
+Chaining:
+    Record commands (clean, dose) can be joined with 'then'. Records stream
+    from the first stage's input through every stage to the last stage's
+    output, so no intermediate JSON files are written. The first stage takes
+    the input path; the last takes -o/--output and --format.
+
+Arrow Interchange:
+    Record commands read and write Arrow IPC files (.arrow, .feather, .ipc;
+    see patient_arrow.py) as well as JSON. Writing a stage's output as Arrow
+    lets later runs, or other processes, memory-map it instead of parsing
+    JSON, and 'cohort' scans Arrow input in place (e.g. from
+    'generate -o patients.arrow').
+
+Output:
+    Record commands write a JSON array, JSON Lines or Arrow IPC file (from
+    --format or the extension), or JSON Lines on standard output when no -o
+    is given. cohort writes CSV, Parquet, JSON or Arrow with -o.
+    Instrumentation options (--metrics, --prometheus, --profile) go before
+    the command.
+
+Usage:
+    python -m pipeline clean data/raw/patients.json -o cleaned.jsonl
+    python -m pipeline clean orders.jsonl then dose --engine numpy -o doses.jsonl
+    python -m pipeline dose data/raw/meds.json --cache-size 1024 | jq .final_dosage
+    python -m pipeline cohort patients_large.csv --approx -o cohorts.parquet
+    python -m pipeline clean patients.json -o cleaned.arrow
+    python -m pipeline dose cleaned.arrow -o doses.arrow
+    python -m pipeline generate --rows 1000000 -o patients.arrow
+    python -m pipeline cohort patients.arrow --memory-budget 512MB
+    python -m pipeline clean feed.jsonl --quarantine rejected.jsonl then dose -o doses.jsonl
+    python -m pipeline --metrics runs.jsonl generate --rows 1000000 -o patients.parquet
+"""
+
+import argparse
+import importlib
+import itertools
+import os
+import sys
+
+# The scripts and their helper modules live in the project root
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import instrumentation
+import patient_coercion
+
+# Subcommand -> (module it runs, one-line description)
+COMMANDS = {
+    'clean': ('1_patient_data_cleaner', "Clean and de-duplicate patient records"),
+    'dose': ('2_med_dosage_calculator', "Calculate emergency medication dosages"),
+    'cohort': ('3_cohort_analysis', "Analyze patient cohorts by BMI range"),
+    'generate': ('generate_large_health_data', "Generate synthetic patient data"),
+}
+
+# Commands that transform a stream of records and can be chained
+RECORD_COMMANDS = ('clean', 'dose')
+
+# Word joining chained stages on the command line
+CHAIN_SEPARATOR = 'then'
+
+# Record output formats
+RECORD_FORMATS = ('json', 'jsonl', 'arrow')
+
+# Orders per calculate_all_dosages call when dosing a stream
+DOSE_BATCH_SIZE = 10_000
+
+def load_command(command):
+    """Import the module behind a command."""
+    return importlib.import_module(COMMANDS[command][0])
+
+def stage_parser(command, module, first=True, last=True):
+    """
+    Build the argument parser for one command.
+
+    Args:
+        command (str): Command name
+        module (module): The command's module (see load_command)
+        first (bool): Whether the stage reads the input (first in a chain)
+        last (bool): Whether the stage writes the output (last in a chain)
+
+    Returns:
+        argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog=f"pipeline {command}",
+                                     description=COMMANDS[command][1] + ".")
+    if command in RECORD_COMMANDS:
+        if first:
+            parser.add_argument('input',
+                                help="Patient JSON array, JSON Lines or Arrow IPC file")
+        if last:
+            parser.add_argument('-o', '--output',
+                                help="Output file (default: JSON Lines on standard output)")
+            parser.add_argument('--format', choices=RECORD_FORMATS,
+                                help="Output format (default: from the --output extension)")
+        if command == 'clean':
+            module.add_cleaning_arguments(parser)
+        else:
+            module.add_dosage_arguments(parser)
+    elif command == 'cohort':
+        parser.add_argument('input', help="Patient CSV or Arrow IPC file")
+        module.add_arguments(parser)
+    else:
+        module.add_arguments(parser)
+    return parser
+
+def split_chain(tokens):
+    """Split command-line tokens on CHAIN_SEPARATOR into one list per stage."""
+    stages = [[]]
+    for token in tokens:
+        if token == CHAIN_SEPARATOR:
+            stages.append([])
+        else:
+            stages[-1].append(token)
+    return stages
+
+def parse_args(argv=None):
+    """
+    Parse the command line into instrumentation options and stages.
+
+    Returns:
+        tuple: (options namespace, list of (command, module, stage args))
+    """
+    parser = argparse.ArgumentParser(
+        prog='pipeline',
+        description="Run the patient data pipelines.",
+        epilog="commands:\n" + "\n".join(f"  {name:<10}{description}"
+                                         for name, (_, description) in COMMANDS.items())
+               + f"\n\nChain record commands with '{CHAIN_SEPARATOR}', e.g. "
+                 f"pipeline clean in.json {CHAIN_SEPARATOR} dose -o out.jsonl",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    instrumentation.add_arguments(parser)
+    parser.add_argument('command', metavar='COMMAND', choices=list(COMMANDS),
+                        help=f"One of: {', '.join(COMMANDS)}")
+    parser.add_argument('args', metavar='ARGS', nargs=argparse.REMAINDER,
+                        help="Command arguments (see pipeline COMMAND --help)")
+    options = parser.parse_args(argv)
+
+    chain = split_chain([options.command] + options.args)
+    if len(chain) > 1:
+        for tokens in chain:
+            if not tokens or tokens[0] not in RECORD_COMMANDS:
+                parser.error(f"only {', '.join(RECORD_COMMANDS)} can be chained with "
+                             f"'{CHAIN_SEPARATOR}'")
+
+    stages = []
+    for index, (command, *tokens) in enumerate(chain):
+        module = load_command(command)
+        stage = stage_parser(command, module, first=index == 0, last=index == len(chain) - 1)
+        args = stage.parse_args(tokens)
+        if command == 'cohort':
+            module.check_args(stage, args)
+        elif command == 'dose':
+            module.check_dosage_args(stage, args)
+        stages.append((command, module, args))
+    return options, stages
+
+def _batches(records, size):
+    """Yield lists of up to `size` records."""
+    iterator = iter(records)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def clean_stage(module, args):
+    """Return a function cleaning a record stream as configured by args."""
+    deduplicator = module.deduplicator_from_args(args)
+    coercer = module.coercer_from_args(args)
+
+    def clean(records):
+        with deduplicator:
+            yield from module.iter_clean_patients(records, deduplicator, args.engine,
+                                                  coercer=coercer)
+            stats = deduplicator.summary()
+            print(f"Duplicate check ({stats['mode']}): {stats['records_seen']} records seen, "
+                  f"{stats['duplicates_dropped']} duplicates dropped", file=sys.stderr)
+        if coercer is not None:
+            coercer.close()
+            print(patient_coercion.format_summary(coercer), file=sys.stderr)
+    return clean
+
+def dose_stage(module, args):
+    """Return a function adding dosages to a record stream as configured by args."""
+    if args.formulary != module.DEFAULT_FORMULARY_PATH:
+        module.use_formulary(args.formulary)
+    cache = module.DosageCache(args.cache_size) if args.cache_size > 0 else None
+    coercer = module.coercer_from_args(args)
+
+    def dose(records):
+        for batch in _batches(records, DOSE_BATCH_SIZE):
+            if coercer is not None:
+                batch = coercer.coerce(batch)
+            yield from module.calculate_all_dosages(batch, args.engine, cache)[0]
+        if coercer is not None:
+            coercer.close()
+            print(patient_coercion.format_summary(coercer), file=sys.stderr)
+    return dose
+
+RECORD_STAGES = {'clean': clean_stage, 'dose': dose_stage}
+
+def run_records(stages):
+    """
+    Stream records from the first stage's input through every stage.
+
+    Args:
+        stages (list): (command, module, args) for record commands
+
+    Returns:
+        int: Records written
+    """
+    reader = load_command('clean')
+    records = reader.iter_patient_records(stages[0][2].input)
+    for command, module, args in stages:
+        records = RECORD_STAGES[command](module, args)(records)
+
+    output, fmt = stages[-1][2].output, stages[-1][2].format
+    if output:
+        count = reader.write_patient_stream(records, output, fmt)
+        print(f"Wrote {count} records to {output}", file=sys.stderr)
+    elif fmt == 'arrow':
+        raise ValueError("Arrow output needs a file; pass -o/--output")
+    else:
+        count = reader.write_patients(records, sys.stdout, fmt or 'jsonl')
+    return count
+
+def main(argv=None):
+    """Run one command or a chain of record commands; returns the exit status."""
+    options, stages = parse_args(argv)
+    script = '+'.join(command for command, _, _ in stages)
+    with instrumentation.session_from_args(script, options):
+        try:
+            if stages[0][0] in RECORD_COMMANDS:
+                run_records(stages)
+            else:
+                _, module, args = stages[0]
+                module.run(args)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    return 0